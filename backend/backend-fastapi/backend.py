@@ -1,36 +1,42 @@
 # backend.py
 
+import asyncio
 import json
 import httpx # Keep httpx if needed for other external calls, but not for calling /score-essay
 import shutil
 from pathlib import Path
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-import pdfplumber
-import fitz  # PyMuPDF
-import pytesseract
-# pdf2image might require poppler path configuration depending on OS
-# from pdf2image import convert_from_path
-import cv2
-import numpy as np
-from PIL import Image
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import ctypes
+import functools
+import logging
 import os
-import traceback # For detailed error printing
 
 load_dotenv()
 
+from structured_logging import REQUEST_ID_HEADER, SAMPLED, correlation, incoming_correlation_id, payload, setup_logging
+setup_logging("fastapi")
+logger = logging.getLogger(__name__)
+
 
 # --- Import the Prometheus Scoring Function (Hugging Face API version) ---
 try:
     # Assuming prometheus_scoring.py is in the same directory as backend.py
     from prometheus_scoring import query_prometheus
 except ImportError as e:
-    print(f"Error importing prometheus_router or query_prometheus: {e}")
-    print("Please ensure 'prometheus_scoring.py' is in the same directory as 'backend.py'.")
+    logger.critical("Could not import query_prometheus (is prometheus_scoring.py next to backend.py?): %s", e)
     raise e
 
+from content_cache import get_cached_extraction
+import latency_metrics
+from extraction_pool import ExtractionQueueFull, ExtractionTimeout, get_pool
+from batch_extraction import EXTRACTION_BATCH_MAX_FILES, BatchExtraction, open_media, open_upload, store_extraction
+from pdf_extraction import SpooledUpload, UploadTooLarge, extract_document, extract_pages
+from trait_scorer import get_batcher
+from pydantic import BaseModel
+
 # --- Create FastAPI App ---
 app = FastAPI()
 
@@ -41,84 +47,161 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[REQUEST_ID_HEADER],
 )
 
-# --- PDF Extraction Functions ---
-# (These functions remain unchanged)
-def extract_text_pymupdf(pdf_path):
-    extracted_text = ""
-    try:
-        doc = fitz.open(pdf_path)
-        for page in doc: extracted_text += page.get_text("text") + "\n"
-        doc.close()
-    except Exception as e: print(f"PyMuPDF extraction failed: {e}")
-    return extracted_text.strip()
-
-def extract_text_pdfplumber(pdf_path):
-    extracted_text = ""
-    extracted_tables = []
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text();
-                if text: extracted_text += text + "\n"
-                tables = page.extract_tables();
-                for table in tables: extracted_tables.append([[cell or "" for cell in row] for row in table])
-    except Exception as e: print(f"pdfplumber extraction failed: {e}")
-    return extracted_text.strip(), extracted_tables
-
-def preprocess_image(img):
-    img_np = np.array(img)
-    if len(img_np.shape) == 3 and img_np.shape[2] == 4: img_np = cv2.cvtColor(img_np, cv2.COLOR_RGBA2RGB)
-    img_gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
-    img_bin = cv2.threshold(img_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-    return Image.fromarray(img_bin)
-
-def extract_text_ocr(pdf_path):
-    extracted_text = ""
-    try:
-        from pdf2image import convert_from_path
-        images = convert_from_path(pdf_path)
-        for img in images:
-            img_processed = preprocess_image(img);
-            text = pytesseract.image_to_string(img_processed, config="--psm 6");
-            extracted_text += text + "\n"
-    except ImportError: print("OCR failed: pdf2image/poppler not installed/configured.")
-    except Exception as e: print(f"OCR extraction failed: {e}")
-    return extracted_text.strip()
-# --- End PDF Functions ---
+# --- Correlation ID Middleware ---
+# Tags everything logged for a request with the caller's X-Request-ID (the grading
+# pipeline forwards its job's ID) or a fresh one, echoed back in the response.
+@app.middleware("http")
+async def correlation_id_middleware(request, call_next):
+    with correlation(incoming_correlation_id(request.headers.get(REQUEST_ID_HEADER))) as request_id:
+        response = await call_next(request)
+    response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+# --- PDF Extraction Worker Pool ---
+# Extraction (pdf_extraction.py) is CPU-bound, so it runs in worker processes
+# rather than on the event loop; see extraction_pool.py for the limits.
+@app.on_event("shutdown")
+def stop_extraction_pool():
+    get_pool().shutdown()
+# --- End PDF Extraction Worker Pool ---
 
 
 # --- PDF Text Extraction Endpoint ---
-# (This endpoint remains unchanged)
 @app.post("/extract-text/")
 async def extract_text(file: UploadFile = File(...), type: str = Form("text")):
-    print(f"\n--- Received request to /extract-text/ for type: {type} ---")
-    temp_dir = Path("temp_uploads"); temp_dir.mkdir(exist_ok=True)
-    safe_filename = Path(file.filename).name; temp_pdf_path = temp_dir / safe_filename
+    safe_filename = Path(file.filename).name
+    upload = None
     try:
-        with temp_pdf_path.open("wb") as buffer: shutil.copyfileobj(file.file, buffer)
-        print(f"Temporarily saved uploaded file to: {temp_pdf_path}")
-        text = extract_text_pymupdf(temp_pdf_path); tables = []
-        if not text or not text.strip(): text, tables = extract_text_pdfplumber(temp_pdf_path)
-        if not text or not text.strip(): text = extract_text_ocr(temp_pdf_path); tables = []
-        json_output = {"generic_text": text, "generic_tables": tables}
-        print("--- /extract-text/ Extraction Result ---")
-        print(f"Text Snippet: {text[:200]}{'...' if len(text)>200 else ''}")
-        print(f"Tables extracted: {len(tables)}")
-        print("-------------------------------------\n")
+        upload = await SpooledUpload.read(file)
+        content_sha256 = upload.sha256
+        cached = await asyncio.to_thread(get_cached_extraction, content_sha256) # Redis or disk; off the event loop
+        if cached is not None:
+            logger.info("Extraction cache hit for %.12s (%d bytes).", content_sha256, upload.size)
+            return {**cached, "content_sha256": content_sha256}
+        result = await get_pool().run(extract_document, upload.source)
+        text, tables = result["generic_text"], result["generic_tables"]
+        # pages: which extractor served each page ({"page", "method", "chars"})
+        json_output = {"generic_text": text, "generic_tables": tables, "pages": result["pages"]}
+        await asyncio.to_thread(store_extraction, content_sha256, result.pop("timings"), json_output)
+        json_output["content_sha256"] = content_sha256
+        logger.info("Extracted %d chars and %d tables from %s (%d pages, %d OCR'd).", len(text), len(tables), safe_filename,
+                    len(result["pages"]), sum(page["method"] == "ocr" for page in result["pages"]))
+        logger.debug("Extracted text: %s", payload(text, 200), extra=SAMPLED)
         return json_output
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ExtractionQueueFull as e:
+        logger.warning("Rejecting extraction of %s: %s", safe_filename, e)
+        raise HTTPException(status_code=503, detail="PDF extraction is at capacity, retry shortly.", headers={"Retry-After": "5"})
+    except ExtractionTimeout:
+        logger.error("Extraction of %s timed out.", safe_filename)
+        raise HTTPException(status_code=504, detail="PDF extraction timed out.")
     except Exception as e:
-        print(f"\n--- /extract-text/ Error: {e} ---")
-        traceback.print_exc()
+        logger.exception("/extract-text/ failed for %s", safe_filename)
         raise HTTPException(status_code=500, detail=f"Failed to process PDF file: {e}")
     finally:
-        if temp_pdf_path.exists():
-            try: temp_pdf_path.unlink(); print(f"Deleted temporary file: {temp_pdf_path}")
-            except OSError as e: print(f"Error deleting temp file {temp_pdf_path}: {e}")
+        if upload is not None:
+            upload.close()
 # --- End PDF Extraction Endpoint ---
 
 
+# --- Streaming PDF Text Extraction Endpoint ---
+# /extract-text/ as NDJSON, one line per page as soon as the worker has read it:
+#   {"type": "page", "page", "method", "text", "tables"} for each page, then
+#   {"type": "result", "content_sha256", "pages", "cached": false}
+# A cached document is a single result line ("cached": true) that also carries
+# generic_text and generic_tables. Errors before the first line get the usual
+# status codes; after it they end the stream with {"type": "error", "detail"}.
+def ndjson(entry: dict) -> str:
+    return json.dumps(entry) + "\n"
+
+@app.post("/extract-text/stream")
+async def extract_text_stream(file: UploadFile = File(...)):
+    safe_filename = Path(file.filename).name
+    upload = None
+    try:
+        upload = await SpooledUpload.read(file)
+        content_sha256 = upload.sha256
+        cached = await asyncio.to_thread(get_cached_extraction, content_sha256)
+        if cached is not None:
+            logger.info("Extraction cache hit for %.12s (%d bytes).", content_sha256, upload.size)
+            upload.close()
+            result = {"type": "result", **cached, "content_sha256": content_sha256, "cached": True}
+            return StreamingResponse(iter([ndjson(result)]), media_type="application/x-ndjson")
+        pages = get_pool().stream(extract_pages, upload.source)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ExtractionQueueFull as e:
+        upload.close()
+        logger.warning("Rejecting extraction of %s: %s", safe_filename, e)
+        raise HTTPException(status_code=503, detail="PDF extraction is at capacity, retry shortly.", headers={"Retry-After": "5"})
+    except Exception as e:
+        if upload is not None:
+            upload.close()
+        logger.exception("/extract-text/stream failed for %s", safe_filename)
+        raise HTTPException(status_code=500, detail=f"Failed to process PDF file: {e}")
+    return StreamingResponse(stream_pages(pages, upload, safe_filename), media_type="application/x-ndjson")
+
+async def stream_pages(pages, upload: SpooledUpload, safe_filename: str):
+    # Only the text is kept (for the cache entry), not the lines already sent
+    texts, tables, summary, timings = [], [], [], {}
+    try:
+        async for page in pages:
+            for method, seconds in page.pop("seconds").items():
+                timings[method] = timings.get(method, 0.0) + seconds
+            texts.append(page["text"])
+            tables.extend(page["tables"])
+            summary.append({"page": page["page"], "method": page["method"], "chars": len(page["text"])})
+            yield ndjson({"type": "page", **page})
+        text = "\n".join(texts).strip()
+        await asyncio.to_thread(store_extraction, upload.sha256, timings, {"generic_text": text, "generic_tables": tables, "pages": summary})
+        logger.info("Streamed %d chars and %d tables from %s (%d pages, %d OCR'd).", len(text), len(tables), safe_filename,
+                    len(summary), sum(page["method"] == "ocr" for page in summary))
+        yield ndjson({"type": "result", "content_sha256": upload.sha256, "pages": summary, "cached": False})
+    except ExtractionTimeout:
+        logger.error("Extraction of %s timed out after %d pages.", safe_filename, len(summary))
+        yield ndjson({"type": "error", "detail": "PDF extraction timed out."})
+    except Exception as e:
+        logger.exception("/extract-text/stream failed for %s after %d pages", safe_filename, len(summary))
+        yield ndjson({"type": "error", "detail": f"Failed to process PDF file: {e}"})
+    finally:
+        upload.close()
+# --- End Streaming PDF Text Extraction Endpoint ---
+
+
+# --- Batch PDF Text Extraction Endpoints ---
+# Many PDFs per request, streamed back as NDJSON in the order they finish (see
+# batch_extraction.py): one {"type": "file", "index", "source", "status",
+# "content_sha256", ...} line per file, with generic_text, generic_tables,
+# "cached" and "duplicate" (same content as another file of the batch, extracted
+# once) or an "error", then {"type": "result", "files", "extracted", "cached",
+# "duplicates", "failed"}. A file that fails does not fail the batch.
+class MediaBatchRequest(BaseModel):
+    paths: list[str] # As stored in Django FileFields, under submissions/ or rubrics/ (EXTRACTION_MEDIA_DIRS)
+
+def stream_batch(items: list) -> StreamingResponse:
+    if not items:
+        raise HTTPException(status_code=400, detail="No files given.")
+    if len(items) > EXTRACTION_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {EXTRACTION_BATCH_MAX_FILES} files per batch.")
+    logger.info("Extracting a batch of %d files.", len(items))
+    batch = BatchExtraction(items)
+    lines = (ndjson(entry) async for entry in batch.results())
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.post("/extract-text/batch")
+async def extract_text_batch(files: list[UploadFile] = File(...)):
+    return stream_batch([(Path(file.filename).name, functools.partial(open_upload, file)) for file in files])
+
+@app.post("/extract-text/batch/media")
+async def extract_media_batch(data: MediaBatchRequest):
+    return stream_batch([(path, functools.partial(open_media, path)) for path in data.paths])
+# --- End Batch PDF Text Extraction Endpoints ---
+
+
 # --- /api/score-essay Endpoint ---
 from fastapi import Request
 
@@ -138,14 +221,45 @@ async def score_essay(request: Request):
 
 
 
+# --- /score-traits Endpoint (in-process FLAN-T5 trait scoring) ---
+# Same request/response shape as the Next.js /api/huggingface route, so SCORE_ESSAY_URL can point here.
+# Like that route, it fails (422) when the model's output for a trait has no numeric score.
+class TraitScoreRequest(BaseModel):
+    essay: str
+    traits: list[dict]
+
+@app.post("/score-traits")
+async def score_traits(data: TraitScoreRequest):
+    if not data.essay or not data.traits or any("name" not in trait for trait in data.traits):
+        raise HTTPException(status_code=400, detail="Essay and traits (each with a name) are required")
+    try:
+        scores = await get_batcher().score(data.essay, data.traits)
+    except Exception as e:
+        logger.exception("/score-traits failed")
+        raise HTTPException(status_code=500, detail=f"Trait scoring failed: {e}")
+    unscored = [entry["trait"] for entry in scores if entry["score"] is None]
+    if unscored:
+        logger.warning("FLAN output for trait(s) %s had no numeric score.", unscored)
+        raise HTTPException(status_code=422, detail=f"The model returned no numeric score for trait(s): {', '.join(unscored)}")
+    return {"scores": scores}
+# --- End /score-traits Endpoint ---
+
+
+# --- Metrics Endpoint (Prometheus text format) ---
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return await asyncio.to_thread(latency_metrics.render, latency_metrics.EXTRACTION_METRICS)
+# --- End Metrics Endpoint ---
+
+
 # --- Root Endpoint ---
 @app.get("/")
 async def read_root():
-    # Provide more status info since model/tokenizer loading is removed
-    status = "API is running. Model loading has been removed; only PDF extraction and scoring endpoints are active."
+    status = ("API is running: PDF extraction (/extract-text/), Prometheus essay scoring (/api/score-essay) "
+              "and in-process FLAN trait scoring (/score-traits, model loaded on first use).")
     return {"message": status}
 # --- End Root Endpoint ---
 
-print("--- FastAPI app configured ---")
+logger.info("FastAPI app configured.")
 
 # To run: uvicorn backend:app --reload --host 0.0.0.0 --port 8000
\ No newline at end of file
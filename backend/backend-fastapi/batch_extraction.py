@@ -0,0 +1,174 @@
+# batch_extraction.py
+#
+# Batch PDF extraction for backend.py's /extract-text/batch endpoints: many
+# uploads, or many files on the media volume shared with Django (mounted at
+# EXTRACTION_MEDIA_ROOT, referenced by their FileField names such as
+# "submissions/essay.pdf"), in one request. Only the directories Django
+# uploads submissions and rubrics to (EXTRACTION_MEDIA_DIRS) can be read.
+#
+# Files are extracted EXTRACTION_BATCH_CONCURRENCY at a time (by default one
+# per extraction worker) and reported as each finishes, keyed by content hash.
+# A batch never takes more than its share of the pool's wait queue: when
+# single-document requests have filled it, the batch backs off and retries
+# rather than failing. Files with the same content are extracted once, and
+# files already in the extraction cache are not extracted at all.
+#
+# The content cache (Redis or disk) and the latency histograms are blocking
+# calls, so they run in worker threads rather than on the event loop.
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path, PurePosixPath
+
+from content_cache import cache_extraction, get_cached_extraction, sha256_file
+from extraction_pool import ExtractionQueueFull, ExtractionTimeout, get_pool
+from latency_metrics import observe
+from pdf_extraction import EXTRACTION_MAX_UPLOAD_BYTES, SpooledUpload, UploadTooLarge, extract_document
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_MEDIA_ROOT = Path(os.getenv("EXTRACTION_MEDIA_ROOT", "/media"))
+EXTRACTION_MEDIA_DIRS = [name.strip() for name in os.getenv("EXTRACTION_MEDIA_DIRS", "submissions,rubrics").split(",") if name.strip()]
+EXTRACTION_BATCH_MAX_FILES = int(os.getenv("EXTRACTION_BATCH_MAX_FILES", "1000")) # Also Starlette's limit on uploads per form
+EXTRACTION_BATCH_CONCURRENCY = int(os.getenv("EXTRACTION_BATCH_CONCURRENCY", "0")) # Files in flight per batch (0 = pool workers)
+QUEUE_FULL_BACKOFF = 1.0 # Seconds a batch waits before retrying when the pool's queue is full
+
+
+class BatchItemError(Exception):
+    """One file of a batch cannot be extracted; reported with status instead of failing the batch."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+
+
+def resolve_media_path(reference: str) -> Path:
+    """
+    The file a media reference names. Raises BatchItemError for absolute paths,
+    paths with "..", paths outside EXTRACTION_MEDIA_DIRS and missing files.
+    """
+    reference_path = PurePosixPath(reference)
+    if not reference_path.parts or reference_path.is_absolute() or "\\" in reference or ".." in reference_path.parts:
+        raise BatchItemError(400, "Path must be relative to the media volume, without '..'.")
+    if reference_path.parts[0] not in EXTRACTION_MEDIA_DIRS:
+        raise BatchItemError(403, f"Only files under {', '.join(EXTRACTION_MEDIA_DIRS)} can be extracted.")
+    # Resolved too, so a symlink cannot lead out of the directory
+    directory = (EXTRACTION_MEDIA_ROOT / reference_path.parts[0]).resolve()
+    path = (EXTRACTION_MEDIA_ROOT / reference_path).resolve()
+    if not path.is_relative_to(directory):
+        raise BatchItemError(403, f"Only files under {', '.join(EXTRACTION_MEDIA_DIRS)} can be extracted.")
+    if not path.is_file():
+        raise BatchItemError(404, "File not found.")
+    if path.stat().st_size > EXTRACTION_MAX_UPLOAD_BYTES:
+        raise BatchItemError(413, f"File exceeds {EXTRACTION_MAX_UPLOAD_BYTES} bytes.")
+    return path
+
+
+def store_extraction(content_sha256: str, timings: dict, result: dict):
+    """Records an extraction's per-method timings and caches its result (blocking; run it in a thread)."""
+    for method, seconds in timings.items():
+        observe("extraction_duration_seconds", seconds, method=method)
+    cache_extraction(content_sha256, result)
+
+
+@asynccontextmanager
+async def open_upload(file):
+    """(content hash, extraction source) of an UploadFile, read only when its turn comes."""
+    upload = await SpooledUpload.read(file)
+    try:
+        yield upload.sha256, upload.source
+    finally:
+        upload.close()
+
+
+@asynccontextmanager
+async def open_media(reference: str):
+    """(content hash, extraction source) of a file on the media volume; the worker reads it by path."""
+    path = resolve_media_path(reference)
+    yield await asyncio.to_thread(sha256_file, path), str(path)
+
+
+class BatchExtraction:
+    """
+    One batch: items are (name, opener) pairs, opener an async context manager
+    factory like open_upload or open_media. Iterate results() for the entries.
+    """
+
+    def __init__(self, items: list, pool=None, concurrency: int = None):
+        self.items = items
+        self.pool = pool or get_pool()
+        self.concurrency = max(1, concurrency or EXTRACTION_BATCH_CONCURRENCY or self.pool.workers)
+        # Every file counts once: extracted by this batch, served from the cache, a duplicate
+        # of another file of the batch (extracted once for both) or failed
+        self.counts = {"extracted": 0, "cached": 0, "duplicates": 0, "failed": 0}
+        self._extractions = {} # content hash -> task extracting it, shared by files with that content
+
+    async def results(self):
+        """
+        Yields {"type": "file", "index", "source", "status", "content_sha256", ...}
+        for each file as it finishes (with generic_text, generic_tables, "cached" and
+        "duplicate", or "error"), then {"type": "result", "files", "extracted",
+        "cached", "duplicates", "failed"}.
+        """
+        finished = asyncio.Queue(self.concurrency) # Finished files wait here for a slow reader
+        pending = iter(enumerate(self.items))
+
+        async def drain():
+            for index, (name, opener) in pending:
+                await finished.put(await self._extract_item(index, name, opener))
+
+        runners = [asyncio.create_task(drain()) for _ in range(min(self.concurrency, len(self.items)))]
+        try:
+            for _ in self.items:
+                yield await finished.get()
+        finally:
+            for task in (*runners, *self._extractions.values()):
+                task.cancel()
+        yield {"type": "result", "files": len(self.items), **self.counts}
+
+    async def _extract_item(self, index: int, name: str, opener) -> dict:
+        entry = {"type": "file", "index": index, "source": name}
+        try:
+            async with opener() as (content_sha256, source):
+                entry["content_sha256"] = content_sha256
+                # Registered before the first await, so a copy arriving meanwhile shares it
+                task = self._extractions.get(content_sha256)
+                duplicate = task is not None
+                if task is None:
+                    task = self._extractions[content_sha256] = asyncio.ensure_future(self._extract(content_sha256, source))
+                    task.add_done_callback(lambda _: self._extractions.pop(content_sha256, None))
+                # A duplicate waits on the first file's extraction without being able to cancel it
+                result, cached = await asyncio.shield(task)
+            self.counts["duplicates" if duplicate else "cached" if cached else "extracted"] += 1
+            return {**entry, "status": 200, **result, "cached": cached, "duplicate": duplicate}
+        except (ExtractionTimeout, Exception) as e:
+            self.counts["failed"] += 1
+            return {**entry, **self._error(name, e)}
+
+    async def _extract(self, content_sha256: str, source) -> tuple[dict, bool]:
+        """(result, whether it came from the extraction cache) for one content hash."""
+        cached = await asyncio.to_thread(get_cached_extraction, content_sha256)
+        if cached is not None:
+            return cached, True
+        while True:
+            try:
+                result = await self.pool.run(extract_document, source)
+                break
+            except ExtractionQueueFull:
+                await asyncio.sleep(QUEUE_FULL_BACKOFF) # Single-document requests go first
+        await asyncio.to_thread(store_extraction, content_sha256, result.pop("timings"), result)
+        return result, False
+
+    @staticmethod
+    def _error(name: str, error: BaseException) -> dict:
+        if isinstance(error, BatchItemError):
+            return {"status": error.status, "error": str(error)}
+        if isinstance(error, UploadTooLarge):
+            return {"status": 413, "error": str(error)}
+        if isinstance(error, ExtractionTimeout):
+            logger.error("Batch extraction of %s timed out.", name)
+            return {"status": 504, "error": "PDF extraction timed out."}
+        logger.error("Batch extraction of %s failed: %s", name, error, exc_info=error)
+        return {"status": 500, "error": f"Failed to process PDF file: {error}"}
@@ -0,0 +1,241 @@
+# content_cache.py
+#
+# Content-addressed, size-bounded LRU caches shared by the FastAPI service and
+# the Django grading pipeline (lib/auto_grader.py imports this module too).
+# Backed by Redis when REDIS_URL is set, so every container sees the same
+# entries; otherwise falls back to a local directory.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_DIR = Path(os.getenv("CONTENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "content_cache")))
+
+EXTRACTION_CACHE_NAMESPACE = "pdftext"
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Writes between full directory scans of an on-disk cache that looks under its size limit
+# (other processes writing to the same directory are only seen by a scan)
+DISK_CACHE_SCAN_INTERVAL = int(os.getenv("DISK_CACHE_SCAN_INTERVAL", "100"))
+DISK_CACHE_EVICT_TO = 0.9 # Eviction frees space down to this share of max_bytes, leaving room for the next writes
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskLRUStore:
+    """
+    One file per entry; a file's mtime is its last access time, and the oldest
+    files are evicted once the directory grows past max_bytes. Each file starts
+    with a header line holding its write time, used for TTL expiry.
+    The directory is only scanned when this process's running estimate of its
+    size passes max_bytes, or every DISK_CACHE_SCAN_INTERVAL writes; eviction
+    then goes down to DISK_CACHE_EVICT_TO of max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, ttl: int | None = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._total = None # Estimated bytes in the directory; None until the first scan
+        self._writes = 0 # Writes since the last scan
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            written_at, _, value = path.read_bytes().partition(b"\n")
+        except FileNotFoundError:
+            return None
+        if self.ttl is not None and time.time() - float(written_at) > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            pass
+        return value
+
+    def set(self, key: str, value: bytes):
+        path = self._path(key)
+        tmp_path = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        data = f"{time.time()}\n".encode() + value
+        tmp_path.write_bytes(data)
+        try:
+            previous = path.stat().st_size
+        except FileNotFoundError:
+            previous = 0
+        os.replace(tmp_path, path) # Atomic, so concurrent readers never see a partial entry
+        with self._lock:
+            self._writes += 1
+            if self._total is not None:
+                self._total += len(data) - previous
+            if self._total is None or self._total > self.max_bytes or self._writes >= DISK_CACHE_SCAN_INTERVAL:
+                self._evict()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        """Scans the directory and, past max_bytes, removes the least recently used files. Call with _lock held."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * DISK_CACHE_EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+        self._total = total
+        self._writes = 0
+
+
+class RedisLRUStore:
+    """
+    Entries live under "<namespace>:<key>". A sorted set of last-access times and
+    a running byte total drive LRU eviction once the namespace exceeds max_bytes.
+    """
+
+    def __init__(self, client, namespace: str, max_bytes: int, ttl: int | None = None):
+        self.client = client
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lru_key = f"{namespace}:__lru__"
+        self.sizes_key = f"{namespace}:__sizes__"
+        self.total_key = f"{namespace}:__bytes__"
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str) -> bytes | None:
+        value = self.client.get(self._key(key))
+        if value is None:
+            self._forget(key) # Expired by TTL (or evicted); drop its bookkeeping
+            return None
+        self.client.zadd(self.lru_key, {key: time.time()})
+        return value
+
+    def set(self, key: str, value: bytes):
+        size = len(value)
+        previous = self.client.hget(self.sizes_key, key)
+        pipe = self.client.pipeline()
+        pipe.set(self._key(key), value, ex=self.ttl)
+        pipe.hset(self.sizes_key, key, size)
+        pipe.incrby(self.total_key, size - int(previous or 0))
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.execute()
+        self._evict()
+
+    def delete(self, key: str):
+        self.client.delete(self._key(key))
+        self._forget(key)
+
+    def _forget(self, key: str):
+        size = self.client.hget(self.sizes_key, key)
+        if size is None:
+            return
+        pipe = self.client.pipeline()
+        pipe.hdel(self.sizes_key, key)
+        pipe.zrem(self.lru_key, key)
+        pipe.decrby(self.total_key, int(size))
+        pipe.execute()
+
+    def _evict(self):
+        while int(self.client.get(self.total_key) or 0) > self.max_bytes:
+            oldest = self.client.zpopmin(self.lru_key)
+            if not oldest:
+                break
+            key = oldest[0][0]
+            key = key.decode() if isinstance(key, bytes) else key
+            self.client.delete(self._key(key))
+            size = self.client.hget(self.sizes_key, key)
+            if size is not None:
+                self.client.hdel(self.sizes_key, key)
+                self.client.decrby(self.total_key, int(size))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def make_store(namespace: str, max_bytes: int, ttl: int | None = None):
+    """Returns the shared store for a namespace: Redis if configured, else a local directory."""
+    with _stores_lock:
+        if namespace not in _stores:
+            store = None
+            if REDIS_URL:
+                try:
+                    import redis
+                    store = RedisLRUStore(redis.Redis.from_url(REDIS_URL), namespace, max_bytes, ttl)
+                except ImportError:
+                    logger.warning("redis package not installed; using the on-disk content cache.")
+            if store is None:
+                store = DiskLRUStore(CACHE_DIR / namespace, max_bytes, ttl)
+            _stores[namespace] = store
+        return _stores[namespace]
+
+
+# --- PDF extraction cache (text + tables, keyed by SHA-256 of the PDF bytes) ---
+
+def get_cached_extraction(content_sha256: str) -> dict | None:
+    try:
+        raw = make_store(EXTRACTION_CACHE_NAMESPACE, EXTRACTION_CACHE_MAX_BYTES).get(content_sha256)
+        if raw is None:
+            return None
+        cached = json.loads(raw)
+        cached.setdefault("pages", []) # Entries from the Next.js parser have no per-page report
+        return cached
+    except Exception as e:
+        logger.warning("Extraction cache read failed: %s", e)
+        return None
+
+
+def cache_extraction(content_sha256: str, result: dict):
+    """
+    Stores {"generic_text", "generic_tables", "pages"} for a PDF, pages being the
+    extraction service's per-page routing report. Empty extractions are not cached.
+    """
+    if not (result.get("generic_text") or "").strip():
+        return
+    payload = {
+        "generic_text": result.get("generic_text", ""),
+        "generic_tables": result.get("generic_tables", []),
+        "pages": result.get("pages", []),
+    }
+    try:
+        make_store(EXTRACTION_CACHE_NAMESPACE, EXTRACTION_CACHE_MAX_BYTES).set(
+            content_sha256, json.dumps(payload).encode("utf-8")
+        )
+    except Exception as e:
+        logger.warning("Extraction cache write failed: %s", e)
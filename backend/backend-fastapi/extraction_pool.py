@@ -0,0 +1,240 @@
+# extraction_pool.py
+#
+# Runs CPU-bound PDF extraction (pdf_extraction.py) in a pool of worker
+# processes, so the FastAPI event loop stays free for other requests while a
+# scanned PDF is OCR'd, and concurrent uploads use every core.
+#
+# At most EXTRACTION_WORKERS jobs run at once and EXTRACTION_QUEUE_SIZE more
+# may wait for a worker; beyond that callers get ExtractionQueueFull (503)
+# instead of piling up. Each job gets EXTRACTION_TIMEOUT seconds: the worker
+# interrupts itself with SIGALRM, and a worker that does not come back within
+# a grace period (stuck in native code) is killed along with the pool.
+#
+# stream() runs a generator in a worker and hands its items back as they are
+# produced (one per page for /extract-text/stream), through a bounded queue
+# owned by a manager process, so a slow reader holds the worker back instead
+# of pages piling up in memory.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+from structured_logging import correlation, get_correlation_id, setup_logging, stop_logging
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0")) or os.cpu_count() or 1
+EXTRACTION_QUEUE_SIZE = int(os.getenv("EXTRACTION_QUEUE_SIZE", "32")) # Jobs waiting for a free worker
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "120")) # Seconds per job
+# Workers are replaced after this many jobs, bounding memory held on to by the native libraries
+EXTRACTION_MAX_TASKS_PER_CHILD = int(os.getenv("EXTRACTION_MAX_TASKS_PER_CHILD", "100"))
+KILL_GRACE = 10 # Seconds past the timeout before a worker that ignored its alarm is killed
+EXTRACTION_STREAM_BUFFER = int(os.getenv("EXTRACTION_STREAM_BUFFER", "4")) # Items a streaming job may run ahead of its reader
+STREAM_POLL = 1.0 # Seconds between checks that the other end of a stream is still there
+
+
+class ExtractionQueueFull(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+
+class ExtractionTimeout(BaseException):
+    """
+    A job ran past its time limit. BaseException, so the extractors' own
+    `except Exception` fallbacks cannot swallow it.
+    """
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout("Extraction timed out.")
+
+
+def _init_worker():
+    setup_logging("fastapi")
+    Finalize(None, stop_logging, exitpriority=0) # Worker processes skip atexit handlers
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def _run_job(func, args, timeout, request_id):
+    """Runs func(*args) in a worker process, under the job's time limit and correlation ID."""
+    with correlation(request_id):
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return func(*args)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _stream_job(func, args, items, stopped):
+    """
+    Worker side of ExtractionPool.stream: puts ("item", x) on the items queue for
+    each x func(*args) yields, blocking while the queue is full, then ("done", None).
+    Gives up once the reader sets stopped.
+    """
+    for item in func(*args):
+        if not _put(items, ("item", item), stopped):
+            return
+    _put(items, ("done", None), stopped)
+
+
+def _put(items, entry, stopped) -> bool:
+    while True:
+        # The time limit's alarm is held off while talking to the manager: raised
+        # mid-call it would leave the connection, shared by later jobs, out of step
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        try:
+            items.put(entry, timeout=STREAM_POLL)
+            return True
+        except queue.Full:
+            if stopped.is_set():
+                return False
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+
+
+def _get(items):
+    try:
+        return items.get(timeout=STREAM_POLL)
+    except queue.Empty:
+        return None
+
+
+class ExtractionPool:
+    """
+    Process pool with bounded admission and per-job time limits. Used from the
+    event loop only: run() and the stream() iterators are coroutines and the
+    counters are not locked.
+    """
+
+    def __init__(self, workers: int = EXTRACTION_WORKERS, queue_size: int = EXTRACTION_QUEUE_SIZE,
+                 timeout: float = EXTRACTION_TIMEOUT, max_tasks_per_child: int = EXTRACTION_MAX_TASKS_PER_CHILD):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._executor = None
+        self._manager = None
+        self._slots = None
+        self._waiting = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Fresh interpreters: forking the server would copy its threads' locks mid-use
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                max_tasks_per_child=self.max_tasks_per_child,
+            )
+        return self._executor
+
+    def _get_manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager
+
+    def _admit(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._slots.locked() and self._waiting >= self.queue_size:
+            raise ExtractionQueueFull(f"{self.workers} extractions running and {self._waiting} waiting.")
+
+    async def run(self, func, *args, timeout: float = None):
+        """
+        Runs func(*args) (a picklable, module-level function) in a worker process
+        and returns its result. Raises ExtractionQueueFull when the queue is full,
+        ExtractionTimeout when the job runs too long, or whatever func raised.
+        """
+        self._admit()
+        timeout = timeout or self.timeout
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        # The slot is held until the worker finishes, even if the caller goes away meanwhile
+        try:
+            executor = self._get_executor()
+            future = asyncio.get_running_loop().run_in_executor(executor, _run_job, func, args, timeout, get_correlation_id())
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._job_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout + KILL_GRACE)
+        except asyncio.TimeoutError:
+            logger.error("Extraction worker did not stop %ss after its %ss time limit; restarting the pool.", KILL_GRACE, timeout)
+            self._restart(executor)
+            raise ExtractionTimeout("Extraction timed out.")
+
+    def stream(self, func, *args, timeout: float = None):
+        """
+        Runs func(*args) (a picklable, module-level generator function) in a worker
+        process and returns an async iterator over what it yields, at most
+        EXTRACTION_STREAM_BUFFER items ahead of the reader. ExtractionQueueFull is
+        raised here, before anything is sent; the job starts when iteration does,
+        and its errors (as for run(); the time limit covers the whole stream) are
+        raised by the iterator. Closing the iterator early stops the job.
+        """
+        self._admit()
+        return self._stream(func, args, timeout)
+
+    async def _stream(self, func, args, timeout):
+        manager = self._get_manager()
+        items = manager.Queue(EXTRACTION_STREAM_BUFFER)
+        stopped = manager.Event()
+        job = asyncio.ensure_future(self.run(_stream_job, func, args, items, stopped, timeout=timeout))
+        job.add_done_callback(lambda done: done.cancelled() or done.exception())
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                entry = await loop.run_in_executor(None, _get, items)
+                if entry is None:
+                    if job.done():
+                        job.result() # Raises what the job raised; if it succeeded, "done" is queued
+                    continue
+                kind, value = entry
+                if kind == "done":
+                    await job
+                    return
+                yield value
+        finally:
+            stopped.set()
+            job.cancel() # Still holds its worker until the job notices stopped
+
+    def _job_done(self, future):
+        self._slots.release()
+        if not future.cancelled():
+            future.exception() # Retrieved here, in case the caller stopped waiting
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        if self._executor is not executor:
+            return
+        self._executor = None
+        # There is no public way to stop a busy worker; jobs still running on the old pool fail
+        for process in list(executor._processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+_pool = None
+
+
+def get_pool() -> ExtractionPool:
+    global _pool
+    if _pool is None:
+        _pool = ExtractionPool()
+    return _pool
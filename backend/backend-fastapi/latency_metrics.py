@@ -0,0 +1,145 @@
+# latency_metrics.py
+#
+# Latency histograms shared by the FastAPI service and the Django grading
+# pipeline (lib/auto_grader.py imports this module too), rendered in the
+# Prometheus text format by each service's /metrics endpoint.
+# Backed by Redis when REDIS_URL is set, so the web process can report what
+# the grading workers measured; otherwise kept in process memory.
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+METRICS_KEY = "metrics:histograms"
+
+# Upper bounds in seconds; GPT and OCR calls can take minutes
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Metrics measured on a longer scale (queue waits reach hours around deadlines)
+METRIC_BUCKETS = {
+    "grading_queue_wait_seconds": (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 28800),
+}
+
+# Series exported by each service's /metrics endpoint
+GRADING_METRICS = ("grading_run_duration_seconds", "grading_stage_duration_seconds", "downstream_request_duration_seconds",
+                   "grading_queue_wait_seconds")
+EXTRACTION_METRICS = ("extraction_duration_seconds", "trait_batch_duration_seconds")
+
+HELP = {
+    "grading_run_duration_seconds": "Wall time of a whole grading pipeline run.",
+    "grading_stage_duration_seconds": "Wall time of a grading pipeline stage, including retries.",
+    "downstream_request_duration_seconds": "Latency of a request to a downstream service.",
+    "grading_queue_wait_seconds": "Time a grading job waited in the queue before a worker picked it up.",
+    "extraction_duration_seconds": "Time spent by one PDF text extraction method.",
+    "trait_batch_duration_seconds": "Time of one batched FLAN trait scoring forward pass.",
+}
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def increment(self, increments: dict):
+        with self._lock:
+            for field, amount in increments.items():
+                self.values[field] = self.values.get(field, 0) + amount
+
+    def read(self) -> dict:
+        with self._lock:
+            return dict(self.values)
+
+
+class RedisBackend:
+    def __init__(self, client):
+        self.client = client
+
+    def increment(self, increments: dict):
+        pipe = self.client.pipeline()
+        for field, amount in increments.items():
+            if isinstance(amount, float):
+                pipe.hincrbyfloat(METRICS_KEY, field, amount)
+            else:
+                pipe.hincrby(METRICS_KEY, field, amount)
+        pipe.execute()
+
+    def read(self) -> dict:
+        return {field: float(value) for field, value in self.client.hgetall(METRICS_KEY).items()}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = None
+                if REDIS_URL:
+                    try:
+                        import redis
+                        backend = RedisBackend(redis.Redis.from_url(REDIS_URL, decode_responses=True))
+                    except ImportError:
+                        logger.warning("redis package not installed; keeping latency metrics in memory.")
+                _backend = backend or MemoryBackend()
+    return _backend
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def observe(name: str, seconds: float, **labels):
+    """Records one latency sample (e.g. observe("grading_stage_duration_seconds", 1.2, stage="hf_scores"))."""
+    series = f"{name}\t{_labels(labels)}"
+    increments = {f"{series}\tcount": 1, f"{series}\tsum": float(seconds), f"{series}\t+Inf": 1}
+    for bound in METRIC_BUCKETS.get(name, BUCKETS):
+        if seconds <= bound:
+            increments[f"{series}\t{bound}"] = 1
+    try:
+        get_backend().increment(increments)
+    except Exception as e:
+        logger.warning("Could not record metric %s: %s", name, e)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Observes the duration of the with-block, whether or not it raises."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+def render(names=None) -> str:
+    """
+    Histograms in the Prometheus text exposition format. names limits the output to
+    those metrics, so each service only exports its own series from the shared store.
+    """
+    series = {}
+    for field, value in get_backend().read().items():
+        name, labels, suffix = field.split("\t")
+        if names is not None and name not in names:
+            continue
+        series.setdefault(name, {}).setdefault(labels, {})[suffix] = value
+
+    lines = []
+    for name in sorted(series):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, values in sorted(series[name].items()):
+            prefix = f"{labels}," if labels else ""
+            for bound in METRIC_BUCKETS.get(name, BUCKETS):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {int(values.get(str(bound), 0))}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {int(values.get("+Inf", 0))}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {values.get('sum', 0.0)}")
+            lines.append(f"{name}_count{suffix} {int(values.get('count', 0))}")
+    return "\n".join(lines) + "\n"
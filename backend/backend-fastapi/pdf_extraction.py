@@ -0,0 +1,255 @@
+# pdf_extraction.py
+#
+# CPU-bound PDF text extraction (PyMuPDF, pdfplumber, Tesseract OCR) used by
+# backend.py's /extract-text/ endpoint. Runs inside the extraction worker
+# processes (see extraction_pool.py), never on the event loop.
+#
+# Uploads are extracted from memory: the endpoint reads them into a
+# SpooledUpload and hands the worker its bytes, or the path of a private
+# temp file for uploads past EXTRACTION_SPOOL_MAX_BYTES. The worker parses
+# the PDF once and shares the document across extractors, routing each page
+# to the cheapest extractor that can read it (see classify_page). Pages are
+# produced one at a time (iter_pages), so /extract-text/stream can send each
+# page on as soon as it is read.
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pdfplumber
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_MAX_UPLOAD_BYTES = int(os.getenv("EXTRACTION_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Uploads up to this size are passed to the worker in memory; larger ones through a temp file
+EXTRACTION_SPOOL_MAX_BYTES = int(os.getenv("EXTRACTION_SPOOL_MAX_BYTES", str(16 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """The upload is larger than EXTRACTION_MAX_UPLOAD_BYTES."""
+
+
+class SpooledUpload:
+    """
+    An uploaded PDF read once, hashing it on the way: kept in memory, or spilled
+    to a uniquely named temp file past spool_max bytes (so concurrent uploads
+    with the same filename never share a path). close() removes the temp file.
+    """
+
+    def __init__(self, spool_max: int = EXTRACTION_SPOOL_MAX_BYTES):
+        self.spool_max = spool_max
+        self.size = 0
+        self.sha256 = None
+        self._chunks = []
+        self._spill = None
+
+    @classmethod
+    async def read(cls, upload, max_bytes: int = EXTRACTION_MAX_UPLOAD_BYTES,
+                   spool_max: int = EXTRACTION_SPOOL_MAX_BYTES) -> "SpooledUpload":
+        """Reads a FastAPI UploadFile (anything with an async read(size)). Raises UploadTooLarge."""
+        spooled = cls(spool_max)
+        digest = hashlib.sha256()
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                spooled.size += len(chunk)
+                if spooled.size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes.")
+                digest.update(chunk)
+                spooled._write(chunk)
+        except BaseException:
+            spooled.close()
+            raise
+        if spooled._spill is not None:
+            spooled._spill.flush()
+        spooled.sha256 = digest.hexdigest()
+        return spooled
+
+    def _write(self, chunk: bytes):
+        if self._spill is None and self.size > self.spool_max:
+            self._spill = tempfile.NamedTemporaryFile(prefix="extract-", suffix=".pdf", delete=False)
+            self._spill.writelines(self._chunks)
+            self._chunks = []
+        if self._spill is not None:
+            self._spill.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+    @property
+    def source(self) -> bytes | str:
+        """What the extraction worker opens: the PDF bytes, or the spill file's path."""
+        if self._spill is not None:
+            return self._spill.name
+        if len(self._chunks) != 1:
+            self._chunks = [b"".join(self._chunks)]
+        return self._chunks[0]
+
+    def close(self):
+        self._chunks = []
+        if self._spill is not None:
+            self._spill.close()
+            try:
+                os.unlink(self._spill.name)
+            except OSError as e:
+                logger.warning("Could not delete spooled upload %s: %s", self._spill.name, e)
+            self._spill = None
+
+
+class PdfDocument:
+    """
+    A PDF opened from bytes or a path. PyMuPDF parses it once, shared by the
+    page classifier and the extractors; pdfplumber parses the same buffer only
+    if some page is routed to it.
+    """
+
+    def __init__(self, source: bytes | str):
+        self.source = source
+        if isinstance(source, (bytes, bytearray)):
+            self.fitz = fitz.open(stream=source, filetype="pdf")
+        else:
+            self.fitz = fitz.open(source)
+        self._pdfplumber = None
+
+    @property
+    def pdfplumber(self):
+        if self._pdfplumber is None:
+            if isinstance(self.source, (bytes, bytearray)):
+                self._pdfplumber = pdfplumber.open(io.BytesIO(self.source))
+            else:
+                self._pdfplumber = pdfplumber.open(self.source)
+        return self._pdfplumber
+
+    def close(self):
+        if self._pdfplumber is not None:
+            self._pdfplumber.close()
+        self.fitz.close()
+
+
+# --- Page routing ---
+# Each page goes to the cheapest extractor that can read it: PyMuPDF's text
+# layer when it has one, pdfplumber when the page has no images but PyMuPDF
+# found no text (fonts it cannot decode), OCR when the page is a scan.
+PAGE_MIN_TEXT_CHARS = int(os.getenv("PAGE_MIN_TEXT_CHARS", "25")) # Fewer characters count as no text layer
+# Text characters per 1000 pt² below which an image-covered page is treated as a scan
+# (a page of prose has ~5; a scan with a stamped header or page number well under 0.5)
+PAGE_MIN_TEXT_DENSITY = float(os.getenv("PAGE_MIN_TEXT_DENSITY", "0.5"))
+PAGE_SCAN_IMAGE_COVERAGE = float(os.getenv("PAGE_SCAN_IMAGE_COVERAGE", "0.5")) # Share of the page covered by images
+OCR_DPI = int(os.getenv("OCR_DPI", "200")) # Resolution scanned pages are rendered at for Tesseract
+
+
+def image_coverage(page) -> float:
+    """Share of the page's area covered by images (overlaps counted twice, capped at 1)."""
+    page_area = abs(page.rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page.rect)
+    return min(1.0, covered / page_area)
+
+
+def classify_page(page, text: str) -> str:
+    """The extractor for a page given its PyMuPDF text: "pymupdf", "pdfplumber" or "ocr"."""
+    chars = len(text.strip())
+    coverage = image_coverage(page)
+    if chars < PAGE_MIN_TEXT_CHARS:
+        return "ocr" if coverage > 0 else "pdfplumber"
+    density = chars / (abs(page.rect) / 1000 or 1.0)
+    if density < PAGE_MIN_TEXT_DENSITY and coverage >= PAGE_SCAN_IMAGE_COVERAGE:
+        return "ocr"
+    return "pymupdf"
+
+
+def extract_page_pdfplumber(document: PdfDocument, index: int):
+    try:
+        page = document.pdfplumber.pages[index]
+        text = page.extract_text() or ""
+        tables = [[[cell or "" for cell in row] for row in table] for table in page.extract_tables()]
+        return text, tables
+    except Exception as e:
+        logger.warning("pdfplumber extraction failed on page %d: %s", index + 1, e)
+        return "", []
+
+def preprocess_image(pix) -> np.ndarray:
+    """
+    Otsu binarization of a grayscale pixmap. The input array is a view of the
+    pixmap's own buffer, not a copy, so pix must outlive the call.
+    """
+    gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+def extract_page_ocr(document: PdfDocument, index: int):
+    try:
+        # Rendered straight to 8-bit gray: one page's pixels in memory at a time
+        pix = document.fitz[index].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+        return pytesseract.image_to_string(preprocess_image(pix), config="--psm 6")
+    except Exception as e: logger.warning("OCR extraction failed on page %d: %s", index + 1, e)
+    return ""
+
+def iter_pages(document: PdfDocument):
+    """
+    Extracts the document page by page. Yields {"page" (1-based), "method", "text",
+    "tables", "seconds"}; method is the extractor that served the page (a page
+    pdfplumber finds empty falls through to OCR).
+    """
+    for index, page in enumerate(document.fitz):
+        started = time.perf_counter()
+        try:
+            text = page.get_text("text")
+        except Exception as e:
+            logger.warning("PyMuPDF extraction failed on page %d: %s", index + 1, e)
+            text = ""
+        method = classify_page(page, text)
+        seconds = {"pymupdf": time.perf_counter() - started}
+        tables = []
+        if method == "pdfplumber":
+            started = time.perf_counter()
+            text, tables = extract_page_pdfplumber(document, index)
+            seconds["pdfplumber"] = time.perf_counter() - started
+            if len(text.strip()) < PAGE_MIN_TEXT_CHARS and not tables and page.get_cdrawings():
+                method = "ocr" # Vector graphics, maybe outlined text; a blank page is left as is
+        if method == "ocr":
+            started = time.perf_counter()
+            text = extract_page_ocr(document, index) or text
+            seconds["ocr"] = time.perf_counter() - started
+        yield {"page": index + 1, "method": method, "text": text.strip(), "tables": tables, "seconds": seconds}
+
+
+def extract_pages(source: bytes | str):
+    """
+    Yields the pages of a PDF given as bytes or a path, as iter_pages does, one at
+    a time (for streaming; see extraction_pool.ExtractionPool.stream). Yields
+    nothing if the PDF cannot be opened.
+    """
+    try:
+        document = PdfDocument(source)
+    except Exception as e:
+        logger.warning("Could not open PDF: %s", e) # Every extractor would fail the same way
+        return
+    try:
+        yield from iter_pages(document)
+    finally:
+        document.close()
+
+
+def extract_document(source: bytes | str) -> dict:
+    """
+    Text (and pdfplumber tables) of a PDF given as bytes or a path, each page read
+    by the extractor classify_page picks. Returns {"generic_text", "generic_tables",
+    "pages", "timings"}: pages lists {"page", "method", "chars"} per page, timings
+    the seconds spent per method (recorded by the calling process).
+    """
+    timings = {}
+    texts, tables, pages = [], [], []
+    for page in extract_pages(source):
+        texts.append(page["text"])
+        tables.extend(page["tables"])
+        pages.append({"page": page["page"], "method": page["method"], "chars": len(page["text"])})
+        for method, seconds in page["seconds"].items():
+            timings[method] = timings.get(method, 0.0) + seconds
+    return {"generic_text": "\n".join(texts).strip(), "generic_tables": tables, "pages": pages, "timings": timings}
@@ -8,9 +8,16 @@ import time
 import re # For parsing score
 import requests
 import os
+import logging
+
+import prompt_builder
+
+logger = logging.getLogger(__name__)
 
 HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/prometheus-eval/prometheus-7b-v2.0"
 HF_API_KEY = os.getenv("NEXT_PUBLIC_HF_API_KEY")
+# Prompt tokens per scoring call; the essay is trimmed to fit, never the rubric
+PROMETHEUS_PROMPT_TOKEN_BUDGET = int(os.getenv("PROMETHEUS_PROMPT_TOKEN_BUDGET", "3584"))
 
 headers = {
     "Authorization": f"Bearer {HF_API_KEY}",
@@ -18,8 +25,16 @@ headers = {
 }
 
 def query_prometheus(input_text, rubric):
+    if not isinstance(rubric, str):
+        rubric = json.dumps(rubric, separators=(",", ":"), ensure_ascii=False) # Compact: indentation only costs tokens
     payload = {
-        "inputs": f"[Rubric]: {rubric} [Essay]: {input_text}"
+        "inputs": prompt_builder.compile_text_prompt(
+            "",
+            shared=[("Rubric", rubric)],
+            varying=[("Essay", prompt_builder.normalize_extracted_text(input_text))],
+            trim="Essay",
+            budget=PROMETHEUS_PROMPT_TOKEN_BUDGET,
+        )
     }
 
     response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload)
@@ -43,7 +58,7 @@ def extract_rubric_from_pdf(rubric_file: UploadFile):
     For simplicity, assuming the rubric is predefined in this example.
     Actual PDF parsing would be needed here if used.
     """
-    print(f"⚠️ Function 'extract_rubric_from_pdf' called (currently uses hardcoded example). File: {rubric_file.filename}")
+    logger.warning("extract_rubric_from_pdf uses a hardcoded example rubric (file: %s).", rubric_file.filename)
     # In a real implementation, you would add PDF parsing logic here
     # using libraries like pdfplumber, PyPDF2, etc. to extract data
     # from the uploaded 'rubric_file'.
@@ -73,5 +88,4 @@ def extract_rubric_from_pdf(rubric_file: UploadFile):
         }
         # Add other criteria as needed based on your actual rubric structure
     }
-    print("⚠️ Returning hardcoded example rubric.")
     return rubric
\ No newline at end of file
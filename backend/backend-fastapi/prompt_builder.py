@@ -0,0 +1,101 @@
+# prompt_builder.py
+#
+# Prompt assembly shared by the Django grading pipeline (lib/auto_grader.py,
+# lib/llm_cache.py) and the Prometheus scorers, which run in the FastAPI service
+# too: sections are ordered for provider-side prefix caching, extracted text is
+# cleaned up, and the essay is trimmed so the prompt fits a token budget.
+
+import logging
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Max prompt tokens per LLM call; the trimmable section (the essay) is cut to fit
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+CHARS_PER_TOKEN = 4 # Rough average for English text, used when tiktoken is not installed
+TRUNCATION_MARKER = " [...]"
+
+# Exact token counts when tiktoken (and its encoding file) is available
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def normalize_extracted_text(text: str) -> str:
+    """
+    Cleans PDF-extracted text before it goes into a prompt: ligatures and other
+    compatibility characters are normalized, words hyphenated across line breaks
+    are rejoined, wrapped lines are unwrapped and runs of whitespace collapsed.
+    Paragraph breaks (blank lines) are kept.
+    """
+    text = unicodedata.normalize("NFKC", text or "").replace("\u00ad", "") # Soft hyphens
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"([a-z])-\n[ \t]*([a-z])", r"\1\2", text) # "exam-\nple" -> "example"
+    text = re.sub(r"[ \t\f\v]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    text = re.sub(r"(?<!\n)\n(?!\n)", " ", text) # Unwrap lines inside a paragraph
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text to at most max_tokens (at a word boundary when estimating), marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARKER))
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text)[:keep]) + TRUNCATION_MARKER
+    cut = text[:keep * CHARS_PER_TOKEN]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut + TRUNCATION_MARKER
+
+
+def _render(sections) -> str:
+    return "\n\n".join(f"### {heading}\n{body}" for heading, body in sections)
+
+
+def compile_prompt(instructions: str, shared=(), varying=(), trim: str = None, budget: int = None) -> list[dict]:
+    """
+    Builds chat messages ordered for provider-side prefix caching: the static
+    instructions (system message), then the `shared` sections that repeat across
+    calls, then the `varying` sections last. Sections are (heading, text) pairs.
+
+    The section whose heading is `trim` is shortened so the whole prompt stays
+    within `budget` tokens (PROMPT_TOKEN_BUDGET by default).
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    shared, varying = list(shared), list(varying)
+    if trim is not None:
+        fixed = count_tokens(instructions) + count_tokens(_render(
+            [(heading, "" if heading == trim else body) for heading, body in shared + varying]
+        ))
+        allowance = max(0, budget - fixed)
+        for sections in (shared, varying):
+            for i, (heading, body) in enumerate(sections):
+                if heading == trim:
+                    trimmed = truncate_to_tokens(body, allowance)
+                    if trimmed is not body:
+                        logger.debug("Trimmed '%s' to ~%s tokens to fit the %s-token prompt budget.", heading, allowance, budget)
+                    sections[i] = (heading, trimmed)
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": _render(shared + varying)},
+    ]
+
+
+def compile_text_prompt(instructions: str, shared=(), varying=(), trim: str = None, budget: int = None) -> str:
+    """compile_prompt for completion-style models that take a single string: the messages' contents, joined."""
+    messages = compile_prompt(instructions, shared, varying, trim=trim, budget=budget)
+    return "\n\n".join(message["content"] for message in messages if message["content"])
@@ -0,0 +1,167 @@
+# trait_scorer.py
+#
+# In-process FLAN-T5 trait scoring for the /score-traits endpoint (replaces the
+# per-trait calls the Next.js /api/huggingface route makes to the hosted model).
+# Every (essay, trait) pair of a request, and of any other requests queued within
+# FLAN_BATCH_WINDOW_MS, is scored in one padded generate() batch on the CPU.
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from latency_metrics import observe
+
+logger = logging.getLogger(__name__)
+
+FLAN_MODEL_ID = os.getenv("FLAN_MODEL_ID", "srutiii/flan-t5-base-pt2")
+# "none" (fp32 PyTorch), "int8" (dynamically quantized Linear layers) or "onnx" (ONNX Runtime via optimum)
+FLAN_ACCELERATION = os.getenv("FLAN_ACCELERATION", "none")
+FLAN_NUM_THREADS = int(os.getenv("FLAN_NUM_THREADS", "0")) # 0 = torch default (all cores)
+FLAN_MAX_INPUT_TOKENS = int(os.getenv("FLAN_MAX_INPUT_TOKENS", "512")) # T5's trained context
+FLAN_MAX_NEW_TOKENS = int(os.getenv("FLAN_MAX_NEW_TOKENS", "4")) # The model answers with a number
+FLAN_MAX_BATCH_SIZE = int(os.getenv("FLAN_MAX_BATCH_SIZE", "32")) # Rows (essay x trait) per forward pass
+FLAN_BATCH_WINDOW_MS = float(os.getenv("FLAN_BATCH_WINDOW_MS", "15")) # How long to wait for more essays
+
+
+def trait_prompt(trait_name: str, essay: str) -> str:
+    """The input format the fine-tuned model was trained on (same as /api/huggingface)."""
+    return f"Evaluate this essay based on the trait '{trait_name}': {essay}"
+
+
+def parse_score(generated_text: str) -> float | None:
+    match = re.search(r"-?\d+(\.\d+)?", generated_text or "")
+    return float(match.group(0)) if match else None
+
+
+class FlanModel:
+    """Tokenizer + seq2seq model, loaded on first use."""
+
+    def __init__(self, model_id: str = FLAN_MODEL_ID, acceleration: str = FLAN_ACCELERATION):
+        self.model_id = model_id
+        self.acceleration = acceleration
+        self.tokenizer = None
+        self.model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.model is not None:
+                return
+            import torch
+            from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+            if FLAN_NUM_THREADS > 0:
+                torch.set_num_threads(FLAN_NUM_THREADS)
+            logger.info("Loading FLAN trait scorer '%s' (acceleration: %s)...", self.model_id, self.acceleration)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+            model = None
+            if self.acceleration == "onnx":
+                try:
+                    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+                    model = ORTModelForSeq2SeqLM.from_pretrained(self.model_id, export=True)
+                except ImportError:
+                    logger.warning("optimum[onnxruntime] not installed; falling back to PyTorch.")
+            if model is None:
+                model = AutoModelForSeq2SeqLM.from_pretrained(self.model_id)
+                model.eval()
+                if self.acceleration == "int8":
+                    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.model = model
+            logger.info("FLAN trait scorer loaded.")
+
+    def generate(self, prompts: list[str]) -> list[str]:
+        """One padded forward batch; returns the decoded output per prompt."""
+        import torch
+
+        self.load()
+        inputs = self.tokenizer(
+            prompts, padding=True, truncation=True, max_length=FLAN_MAX_INPUT_TOKENS, return_tensors="pt"
+        )
+        with torch.inference_mode():
+            output_ids = self.model.generate(**inputs, max_new_tokens=FLAN_MAX_NEW_TOKENS)
+        return self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+
+class TraitBatcher:
+    """
+    Collects scoring requests for up to window_ms and runs them as shared batches.
+    Rows are sorted by length before being cut into batches of max_batch_size,
+    so essays of similar length are padded together.
+    """
+
+    def __init__(self, model: FlanModel, max_batch_size: int = FLAN_MAX_BATCH_SIZE, window_ms: float = FLAN_BATCH_WINDOW_MS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000
+        self._queue = None
+        self._worker = None
+        # One inference thread: torch already spreads each batch across all cores
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flan")
+
+    async def score(self, essay: str, traits: list[dict]) -> list[dict]:
+        """Returns [{"trait", "score"}] in trait order; score is None if the output had no number."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        prompts = [trait_prompt(trait["name"], essay) for trait in traits]
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompts, future))
+        outputs = await future
+        return [{"trait": trait["name"], "score": parse_score(text)} for trait, text in zip(traits, outputs)]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            rows = len(pending[0][0])
+            deadline = loop.time() + self.window
+            while rows < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+
+            prompts = [prompt for item_prompts, _ in pending for prompt in item_prompts]
+            try:
+                outputs = await loop.run_in_executor(self._executor, self._generate_sorted, prompts)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            start = 0
+            for item_prompts, future in pending:
+                if not future.done():
+                    future.set_result(outputs[start:start + len(item_prompts)])
+                start += len(item_prompts)
+
+    def _generate_sorted(self, prompts: list[str]) -> list[str]:
+        order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+        outputs = [None] * len(prompts)
+        for start in range(0, len(order), self.max_batch_size):
+            chunk = order[start:start + self.max_batch_size]
+            started = time.monotonic()
+            texts = self.model.generate([prompts[i] for i in chunk])
+            observe("trait_batch_duration_seconds", time.monotonic() - started)
+            for i, text in zip(chunk, texts):
+                outputs[i] = text
+        return outputs
+
+
+_batcher = None
+
+
+def get_batcher() -> TraitBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = TraitBatcher(FlanModel())
+    return _batcher
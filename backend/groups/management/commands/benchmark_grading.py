@@ -0,0 +1,86 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lib.benchmark import SCENARIOS, run_scenario
+from lib.stub_services import SERVICES, ServiceProfile, StubServices, DEFAULT_PROFILES
+
+
+def _service_options(values, parse, option):
+    """Parses repeated "service=value" options into {service: parsed value}."""
+    parsed = {}
+    for value in values or []:
+        service, _, setting = value.partition("=")
+        if service not in SERVICES or not setting:
+            raise CommandError(f"--{option} expects SERVICE=VALUE with SERVICE one of {', '.join(SERVICES)} (got '{value}').")
+        try:
+            parsed[service] = parse(setting)
+        except ValueError as e:
+            raise CommandError(str(e))
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the grading pipeline offline against local stub services "
+        "(PDF parsing, rubric parsing, HF scoring, OpenAI), reporting p50/p95/p99 "
+        "latency and submissions per minute."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", default="pipeline,batch",
+                            help=f"Comma-separated scenarios: {', '.join(SCENARIOS)}.")
+        parser.add_argument("--concurrency", default="1,4,8",
+                            help="Comma-separated submissions-in-flight levels to run each scenario at.")
+        parser.add_argument("--submissions", type=int, default=24, help="Submissions graded per run.")
+        parser.add_argument("--latency", action="append", metavar="SERVICE=SPEC",
+                            help="Latency model for a stub, e.g. openai=lognormal:1.2,0.6, pdfparse=fixed:0.2 "
+                                 "or score_essay=uniform:0.5,2. Repeatable.")
+        parser.add_argument("--error-rate", action="append", metavar="SERVICE=RATE",
+                            help="Share of a stub's requests that fail (503, or 429 for openai), e.g. openai=0.05. Repeatable.")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed for stub latencies and failures.")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+        parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own log output.")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options["scenario"].split(",") if name.strip()]
+        unknown = [name for name in scenarios if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenario(s) {unknown}; choose from {', '.join(SCENARIOS)}.")
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",") if level.strip()]
+        except ValueError:
+            raise CommandError("--concurrency expects comma-separated integers.")
+
+        latencies = _service_options(options["latency"], str, "latency")
+        error_rates = _service_options(options["error_rate"], float, "error-rate")
+        profiles = {}
+        for service in SERVICES:
+            default = DEFAULT_PROFILES[service]
+            try:
+                profiles[service] = ServiceProfile(
+                    latencies.get(service, default.latency.spec),
+                    error_rates.get(service, default.error_rate),
+                    default.error_status,
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        results = []
+        with StubServices(profiles, seed=options["seed"]) as stubs:
+            for scenario in scenarios:
+                for concurrency in levels:
+                    if not options["json"]:
+                        self.stdout.write(f"Running '{scenario}' with {options['submissions']} submissions at concurrency {concurrency}...")
+                    result = run_scenario(scenario, stubs, options["submissions"], concurrency, quiet=not options["verbose"])
+                    results.append(result)
+                    if not options["json"]:
+                        self.stdout.write(
+                            f"  p50 {result['p50_sec']}s  p95 {result['p95_sec']}s  p99 {result['p99_sec']}s  "
+                            f"{result['submissions_per_minute']} submissions/min  "
+                            f"({result['succeeded']} ok, {result['failed']} failed, "
+                            f"downstream errors {sum(result['downstream_errors'].values())})"
+                        )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from groups.models import Assignment
+from lib import llm_cache
+from lib.batch_grader import BATCH_GRADING_PARALLELISM, grade_assignment
+
+
+class Command(BaseCommand):
+    help = "Auto-grades every submission of an assignment in parallel, reporting progress and throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument("assignment_id", type=int)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Regrade every submission, not only those without an AI grade.",
+        )
+        parser.add_argument(
+            "--parallelism",
+            type=int,
+            default=BATCH_GRADING_PARALLELISM,
+            help="Number of submissions graded concurrently.",
+        )
+        parser.add_argument(
+            "--no-llm-cache",
+            action="store_true",
+            help="Ask the models again instead of replaying cached responses.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            assignment = Assignment.objects.get(id=options["assignment_id"])
+        except Assignment.DoesNotExist:
+            raise CommandError(f"Assignment {options['assignment_id']} not found.")
+
+        def report(progress, submission, ok):
+            status = "graded" if ok else "FAILED"
+            self.stdout.write(
+                f"[{progress.completed}/{progress.total}] submission {submission.id} {status} "
+                f"({progress.submissions_per_minute} submissions/min)"
+            )
+
+        self.stdout.write(f"Grading assignment '{assignment.name}' with parallelism {options['parallelism']}...")
+        try:
+            summary = grade_assignment(
+                assignment,
+                only_ungraded=not options["all"],
+                parallelism=options["parallelism"],
+                on_progress=report,
+                use_llm_cache=not options["no_llm_cache"],
+            )
+        except Exception as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {summary['succeeded']} graded, {summary['failed']} failed out of {summary['total']} "
+            f"in {summary['elapsed_sec']}s ({summary['submissions_per_minute']} submissions/min)."
+        ))
+        cache = llm_cache.stats()
+        self.stdout.write(
+            f"LLM cache: {cache['hits']} hits, {cache['misses']} misses, {cache['bypassed']} bypassed "
+            f"(hit rate {cache['hit_rate']}); {cache['cached_prompt_tokens']} of {cache['prompt_tokens']} prompt tokens "
+            f"served from the provider's prompt cache."
+        )
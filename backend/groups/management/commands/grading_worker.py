@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from lib.grading_queue import GradingWorker, WORKER_CONCURRENCY
+
+
+class Command(BaseCommand):
+    help = "Consumes auto-grading jobs from the Redis grading queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=WORKER_CONCURRENCY,
+            help="Number of grading jobs processed in parallel by this worker.",
+        )
+
+    def handle(self, *args, **options):
+        worker = GradingWorker(concurrency=options["concurrency"])
+
+        def shutdown(signum, frame):
+            self.stdout.write("Shutting down grading worker after in-flight jobs finish...")
+            worker.stop()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        worker.start()
+        worker.join()
+        self.stdout.write(self.style.SUCCESS("Grading worker stopped."))
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0006_submission_grading_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='rubric_sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='rubric_traits',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
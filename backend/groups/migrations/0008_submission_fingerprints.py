@@ -0,0 +1,33 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0007_assignment_rubric_traits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='graded_rubric_sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='text_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='trait_scores',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0008_submission_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('scoring_mode', models.CharField(blank=True, max_length=20, null=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_sec', models.FloatField(blank=True, null=True)),
+                ('stages', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grading_runs', to='groups.submission')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0009_grading_run'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gradingrun',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='running', max_length=20),
+        ),
+    ]
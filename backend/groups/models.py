@@ -21,6 +21,10 @@ class Assignment(models.Model):
     prompt = models.TextField(blank=True, null=True)
     due_date = models.DateTimeField()
     rubric_file = models.FileField(upload_to='rubrics/', null=True, blank=True)
+    # Traits parsed from rubric_file ([{"name", "definition", "max_score"}, ...]) and the
+    # SHA-256 of the rubric content they were parsed from; re-parsed only when it changes.
+    rubric_traits = models.JSONField(null=True, blank=True)
+    rubric_sha256 = models.CharField(max_length=64, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -28,6 +32,13 @@ class Assignment(models.Model):
 
 
 class Submission(models.Model):
+    GRADING_STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='submissions')
     student = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     submission_file = models.FileField(upload_to='submissions/')  # ✅ Save files to MEDIA_ROOT/submissions/
@@ -36,6 +47,36 @@ class Submission(models.Model):
     ai_grade = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     graded_by_ai = models.BooleanField(default=False)
     feedback = models.TextField(null=True, blank=True)
+    grading_status = models.CharField(max_length=20, choices=GRADING_STATUS_CHOICES, null=True, blank=True)
+    grading_error = models.TextField(null=True, blank=True)
+    # Fingerprints of the graded essay (PDF bytes, whitespace-normalized text) and of the
+    # rubric it was graded against, so an unchanged resubmission can reuse trait_scores.
+    content_sha256 = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    text_sha256 = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    graded_rubric_sha256 = models.CharField(max_length=64, null=True, blank=True)
+    trait_scores = models.JSONField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.student.name} - {self.assignment.name}"
+
+
+class GradingRun(models.Model):
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'), # Superseded by a newer grading job for the same submission
+    ]
+
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name='grading_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    scoring_mode = models.CharField(max_length=20, null=True, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_sec = models.FloatField(null=True, blank=True)
+    # {stage name: {"duration_sec", "attempts", "error"}} for every stage that ran
+    stages = models.JSONField(default=dict, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Run {self.id} of submission {self.submission_id} ({self.status})"
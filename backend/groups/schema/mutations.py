@@ -1,3 +1,4 @@
+import logging
 import strawberry
 from typing import Optional
 from datetime import datetime, timedelta
@@ -18,7 +19,104 @@ current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(project_root)
 
-from lib.auto_grader import trigger_auto_grading_pipeline
+from lib.grading_queue import PRIORITY_REGRADE, enqueue_grading, enqueue_rubric_parsing, supersede_grading
+from lib import idempotency
+from lib.batch_grader import submissions_to_grade
+from lib.auto_grader import find_prior_grading, sha256_bytes, sha256_file
+
+logger = logging.getLogger(__name__)
+
+
+def queue_rubric_parsing(assignment: Assignment):
+    """Parses rubric traits in the background so grading runs can reuse them."""
+    try:
+        enqueue_rubric_parsing(assignment.id)
+    except Exception as e:
+        # Not fatal: the first grading run parses the traits instead
+        logger.error("Failed to queue rubric parsing for assignment %s: %s", assignment.id, e)
+
+
+def save_submission(user: CustomUser, assignment: Assignment, submission_file: Upload) -> str:
+    """Stores a student's upload for an assignment and queues (or reuses) its grading. Returns the result message."""
+    # Check for existing submission and update it, or create a new one
+    submission = Submission.objects.filter(assignment=assignment, student=user).first()
+
+    file_bytes = submission_file.read()
+    content_sha256 = sha256_bytes(file_bytes)
+
+    # The same file uploaded again while it is still queued or grading (e.g. a
+    # double-clicked submit) is a no-op instead of a second grading run
+    if submission and submission.content_sha256 == content_sha256 and submission.grading_status in ("queued", "running"):
+        logger.info("Submission %s already has this file (%s). Nothing to do.", submission.id, submission.grading_status)
+        return f"Submission uploaded successfully to {submission.submission_file.name}"
+
+    # Build file name and path
+    file_name = f"{user.user_id}_{assignment.id}_{submission_file.name}"
+    relative_path = os.path.join("submissions", file_name)
+    full_path = default_storage.save(relative_path, ContentFile(file_bytes))
+
+    # An identical file already graded against the current rubric keeps that grade
+    prior = None
+    if assignment.rubric_file:
+        try:
+            prior = find_prior_grading(sha256_file(assignment.rubric_file.path), content_sha256=content_sha256)
+        except Exception as e:
+            logger.warning("Could not look up prior gradings: %s", e)
+
+    if submission:
+        submission.submission_file = full_path
+        submission.submission_date = now()
+        submission.human_grade = None
+        submission.ai_grade = None
+        submission.graded_by_ai = False
+        submission.feedback = None
+        submission.trait_scores = None
+        submission.graded_rubric_sha256 = None
+        submission.content_sha256 = content_sha256
+        submission.text_sha256 = None
+        submission.save()
+    else:
+        submission = Submission.objects.create(
+            assignment=assignment,
+            student=user,
+            submission_file=full_path,
+            content_sha256=content_sha256,
+        )
+
+    if prior is not None:
+        logger.info("Submission matches already graded submission %s. Reusing its AI grade.", prior.id)
+        submission.ai_grade = prior.ai_grade
+        submission.graded_by_ai = True
+        submission.feedback = prior.feedback
+        submission.trait_scores = prior.trait_scores
+        submission.text_sha256 = prior.text_sha256
+        submission.graded_rubric_sha256 = prior.graded_rubric_sha256
+        submission.grading_status = "done"
+        submission.grading_error = None
+        submission.save()
+        try:
+            supersede_grading(submission.id) # Any grading of the previous file is now moot
+        except Exception as e:
+            logger.warning("Could not cancel earlier grading of submission %s: %s", submission.id, e)
+
+    # Queue AI grading; a grading_worker process runs the pipeline in the background
+    elif assignment.rubric_file:
+        submission.grading_status = "queued"
+        submission.grading_error = None
+        submission.save(update_fields=["grading_status", "grading_error"])
+        try:
+            enqueue_grading(submission.id, assignment=assignment)
+        except Exception as e:
+            logger.error("Failed to queue grading job: %s", e)
+            submission.grading_status = "failed"
+            submission.grading_error = f"Could not queue grading job: {e}"
+            submission.save(update_fields=["grading_status", "grading_error"])
+            # Fails the request (and frees its idempotency key) so the client's retry queues it again
+            raise Exception("Your submission was saved but could not be queued for grading. Please submit again.")
+
+    logger.info("Submission %s saved.", submission.id)
+
+    return f"Submission uploaded successfully to {relative_path}"
 
 
 @strawberry.type
@@ -69,6 +167,8 @@ class Mutation:
             existing.due_date = due_date
             existing.prompt = prompt
             existing.save()
+            if rubric_file:
+                queue_rubric_parsing(existing)
             return f"Assignment '{name}' updated successfully."
         else:
             saved_rubric_path = None
@@ -77,13 +177,15 @@ class Mutation:
                 relative_path = os.path.join("rubrics", filename)
                 saved_rubric_path = default_storage.save(relative_path, ContentFile(rubric_file.read()))
 
-            Assignment.objects.create(
+            assignment = Assignment.objects.create(
                 class_assigned=class_obj,
                 name=name,
                 due_date=due_date,
                 prompt=prompt,
                 rubric_file=saved_rubric_path,
             )
+            if saved_rubric_path:
+                queue_rubric_parsing(assignment)
             return f"Assignment '{name}' created successfully."
 
 
@@ -128,14 +230,12 @@ class Mutation:
 
 
     @strawberry.mutation
-    def submit_assignment(self, info: Info, assignment_id: int, submission_file: Upload) -> str:
-        print("DEBUG >> Backend hit: submit_assignment")
-        print("DEBUG >> File received:", submission_file.name)
+    def submit_assignment(self, info: Info, assignment_id: int, submission_file: Upload,
+                          idempotency_key: Optional[str] = None) -> str:
+        logger.debug("submit_assignment received file %s", submission_file.name)
         request = info.context.request
         user: CustomUser = request.user
 
-        print("DEBUG - got submission:", submission_file.name)
-
         if not user.is_authenticated or user.role != "student":
             raise Exception("Only students can submit assignments.")
 
@@ -144,46 +244,25 @@ class Mutation:
         except Assignment.DoesNotExist:
             raise Exception("Assignment not found.")
 
-        # Build file name and path
-        file_name = f"{user.user_id}_{assignment.id}_{submission_file.name}"
-        relative_path = os.path.join("submissions", file_name)
-        full_path = default_storage.save(relative_path, ContentFile(submission_file.read()))
-
-        # Check for existing submission and update it, or create a new one
-        submission = Submission.objects.filter(assignment=assignment, student=user).first()
-
-        if submission:
-            submission.submission_file = relative_path
-            submission.submission_date = now()
-            submission.human_grade = None
-            submission.ai_grade = None
-            submission.graded_by_ai = False
-            submission.feedback = None
-            submission.save()
-        else:
-            submission = Submission.objects.create(
-                assignment=assignment,
-                student=user,
-                submission_file=relative_path,
-            )
-
-        # Trigger AI grading pipeline after saving the submission
-        rubric_path = assignment.rubric_file.path if assignment.rubric_file else None
-        essay_path = default_storage.path(relative_path)
-
-        if rubric_path:
+        # A retried request (same idempotency key) gets the first request's answer
+        idempotency_scope = f"submit_assignment:{user.user_id}:{assignment.id}"
+        if idempotency_key:
             try:
-                trigger_auto_grading_pipeline(
-                    submission=submission,
-                    rubric_path=rubric_path,
-                    essay_path=essay_path
-                )
-            except Exception as e:
-                print(f"Grading pipeline error: {e}")
+                previous_result = idempotency.claim(idempotency_scope, idempotency_key)
+            except idempotency.RequestInProgress:
+                raise Exception("This submission is already being uploaded.")
+            if previous_result is not None:
+                return previous_result
 
-        print("✅ Submission saved to DB:", submission)
-
-        return f"Submission uploaded successfully to {relative_path}"
+        try:
+            result = save_submission(user, assignment, submission_file)
+        except Exception:
+            if idempotency_key:
+                idempotency.release(idempotency_scope, idempotency_key) # Let the client's retry run it again
+            raise
+        if idempotency_key:
+            idempotency.store_result(idempotency_scope, idempotency_key, result)
+        return result
 
     @strawberry.field
     def my_classes(self, info: Info) -> list["ClassType"]:
@@ -216,6 +295,33 @@ class Mutation:
 
     #     return list(assignments)
 
+    @strawberry.mutation
+    def grade_assignment(self, info: Info, assignment_id: int, only_ungraded: bool = True, use_llm_cache: bool = True) -> str:
+        user = info.context.request.user
+        if not user.is_authenticated or user.role != "teacher":
+            raise Exception("Only teachers can grade assignments.")
+
+        try:
+            assignment = Assignment.objects.get(id=assignment_id, class_assigned__teacher=user)
+        except Assignment.DoesNotExist:
+            raise Exception("Assignment not found or not owned by your class.")
+
+        if not assignment.rubric_file:
+            raise Exception("This assignment has no rubric to grade against.")
+
+        # Parse the rubric first so every grading job reuses the stored traits
+        queue_rubric_parsing(assignment)
+
+        # Submissions already queued or being graded keep that job rather than getting a second one
+        submissions = submissions_to_grade(assignment, only_ungraded)
+        submission_ids = list(submissions.values_list("id", flat=True))
+        submissions.update(grading_status="queued", grading_error=None)
+        # Teacher-initiated grading yields to fresh student submissions (see lib/grading_scheduler.py)
+        for submission_id in submission_ids:
+            enqueue_grading(submission_id, use_llm_cache=use_llm_cache, assignment=assignment, priority=PRIORITY_REGRADE)
+
+        return f"Queued {len(submission_ids)} submission(s) of '{assignment.name}' for grading."
+
     @strawberry.mutation
     def update_submission(
         self,
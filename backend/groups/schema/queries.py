@@ -4,7 +4,7 @@ from strawberry.types import Info
 
 from groups.models import Class as ClassModel
 from groups.models import Submission
-from groups.schema.types import ClassType, AssignmentType, SubmissionMeta
+from groups.schema.types import ClassType, AssignmentType, SubmissionMeta, GradingProgressType
 from accounts.schema.types import UserType
 
 
@@ -31,6 +31,33 @@ class Query:
         )
 
 
+    @strawberry.field
+    def assignment_grading_progress(self, info: Info, assignment_id: int) -> GradingProgressType:
+        from django.db.models import Count
+        from groups.models import Assignment
+
+        user = info.context.request.user
+        if not user.is_authenticated or user.role != "teacher":
+            raise Exception("Only authenticated teachers can view grading progress.")
+
+        try:
+            assignment = Assignment.objects.get(id=assignment_id, class_assigned__teacher=user)
+        except Assignment.DoesNotExist:
+            raise Exception("Assignment not found or not owned by your class.")
+
+        counts = {
+            row["grading_status"]: row["n"]
+            for row in assignment.submissions.values("grading_status").annotate(n=Count("id"))
+        }
+        return GradingProgressType(
+            assignment_id=assignment.id,
+            total=sum(counts.values()),
+            queued=counts.get("queued", 0),
+            running=counts.get("running", 0),
+            done=counts.get("done", 0),
+            failed=counts.get("failed", 0),
+        )
+
     @strawberry.field
     def student_classes(self, student_id: int) -> List[ClassType]:
         classes = ClassModel.objects.filter(students__user_id=student_id).prefetch_related("assignments", "teacher", "students")
@@ -118,6 +145,7 @@ class Query:
                 feedback=s.feedback,
                 graded_by_ai=s.graded_by_ai,
                 submission_file=s.submission_file.url if s.submission_file else None,
+                grading_status=s.grading_status,
             )
             for s in submissions
         ]
@@ -151,6 +179,7 @@ class Query:
                 feedback=sub.feedback,
                 graded_by_ai=sub.graded_by_ai,
                 submission_file=sub.submission_file.url if sub.submission_file else None,
+                grading_status=sub.grading_status,
 
             )
             for sub in submissions
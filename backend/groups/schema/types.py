@@ -37,3 +37,14 @@ class SubmissionMeta:
     feedback: Optional[str]
     graded_by_ai: bool
     submission_file: Optional[str]
+    grading_status: Optional[str] = None
+
+
+@strawberry.type
+class GradingProgressType:
+    assignment_id: int
+    total: int
+    queued: int
+    running: int
+    done: int
+    failed: int
@@ -0,0 +1,23 @@
+import importlib.util
+import os
+import sys
+from unittest import skipUnless
+
+# Modules shared with the FastAPI service live in backend-fastapi/ (see lib/auto_grader.py)
+FASTAPI_SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'backend-fastapi'))
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+
+# The grading queue and scheduler run Lua scripts (EVALSHA), which fakeredis
+# only supports when lupa is installed too
+requires_fake_redis = skipUnless(
+    all(importlib.util.find_spec(name) for name in ("fakeredis", "lupa")),
+    "fakeredis and lupa are not installed",
+)
+
+# The FastAPI service's PDF extraction needs its own requirements, which the
+# Django image need not install
+requires_pdf_extraction = skipUnless(
+    all(importlib.util.find_spec(name) for name in ("fitz", "pdfplumber", "cv2", "pytesseract", "numpy")),
+    "the PDF extraction requirements are not installed",
+)
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from . import requires_pdf_extraction
+
+
+class FakePool:
+    """Extracts a source to {"generic_text": source}, a little slowly. Reports a full queue once per source in full_once."""
+
+    workers = 4
+
+    def __init__(self, full_once=()):
+        self.extracted = []
+        self.full_once = set(full_once)
+
+    async def run(self, func, source):
+        from extraction_pool import ExtractionQueueFull
+
+        if source in self.full_once:
+            self.full_once.discard(source)
+            raise ExtractionQueueFull("Queue full.")
+        await asyncio.sleep(0.01)
+        if source == "broken":
+            raise ValueError("Cannot parse PDF")
+        self.extracted.append(source)
+        return {"generic_text": source, "generic_tables": [], "pages": [], "timings": {"pymupdf": 0.01}}
+
+
+def opener(content):
+    """An opener for a file whose content (and content hash) is the given string."""
+    @asynccontextmanager
+    async def open_file():
+        yield f"sha-{content}", content
+    return open_file
+
+
+@requires_pdf_extraction
+class BatchExtractionTests(SimpleTestCase):
+    def setUp(self):
+        import batch_extraction
+        self.batch_extraction = batch_extraction
+        self.cache = {}
+        for name, value in (
+            ("get_cached_extraction", self.cache.get),
+            ("store_extraction", lambda content_sha256, timings, result: self.cache.__setitem__(content_sha256, result)),
+            ("QUEUE_FULL_BACKOFF", 0),
+        ):
+            patcher = mock.patch.object(batch_extraction, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_batch(self, items, pool):
+        async def collect():
+            return [entry async for entry in self.batch_extraction.BatchExtraction(items, pool=pool).results()]
+        entries = asyncio.run(collect())
+        return sorted(entries[:-1], key=lambda entry: entry["index"]), entries[-1]
+
+    def test_files_with_the_same_content_are_extracted_once(self):
+        pool = FakePool()
+
+        files, result = self.run_batch([(f"copy{i}.pdf", opener("essay")) for i in range(3)] + [("other.pdf", opener("rubric"))], pool)
+
+        self.assertEqual(sorted(pool.extracted), ["essay", "rubric"])
+        self.assertEqual([entry["duplicate"] for entry in files], [False, True, True, False])
+        self.assertEqual(result, {"type": "result", "files": 4, "extracted": 2, "cached": 0, "duplicates": 2, "failed": 0})
+
+    def test_cached_files_are_not_extracted(self):
+        self.cache["sha-essay"] = {"generic_text": "essay", "generic_tables": [], "pages": []}
+        pool = FakePool()
+
+        files, result = self.run_batch([("essay.pdf", opener("essay"))], pool)
+
+        self.assertEqual(pool.extracted, [])
+        self.assertEqual((files[0]["cached"], files[0]["generic_text"]), (True, "essay"))
+        self.assertEqual(result["cached"], 1)
+
+    def test_failed_files_do_not_fail_the_batch(self):
+        @asynccontextmanager
+        async def missing():
+            raise self.batch_extraction.BatchItemError(404, "File not found.")
+            yield
+
+        files, result = self.run_batch([("missing.pdf", missing), ("broken.pdf", opener("broken")), ("ok.pdf", opener("ok"))], FakePool())
+
+        self.assertEqual([entry["status"] for entry in files], [404, 500, 200])
+        self.assertEqual((result["extracted"], result["failed"]), (1, 2))
+
+    def test_a_full_extraction_queue_is_retried(self):
+        pool = FakePool(full_once=["essay"])
+
+        files, result = self.run_batch([("essay.pdf", opener("essay"))], pool)
+
+        self.assertEqual(pool.extracted, ["essay"])
+        self.assertEqual(files[0]["status"], 200)
+
+
+@requires_pdf_extraction
+class MediaPathTests(SimpleTestCase):
+    def setUp(self):
+        import batch_extraction
+        self.batch_extraction = batch_extraction
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        for name in ("submissions", "rubrics", "private"):
+            (self.root / name).mkdir()
+            (self.root / name / "file.pdf").write_bytes(b"%PDF-1.7")
+        patcher = mock.patch.object(batch_extraction, "EXTRACTION_MEDIA_ROOT", self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def status(self, reference) -> int:
+        try:
+            self.batch_extraction.resolve_media_path(reference)
+        except self.batch_extraction.BatchItemError as e:
+            return e.status
+        return 200
+
+    def test_files_under_the_submission_and_rubric_directories_are_allowed(self):
+        self.assertEqual(self.batch_extraction.resolve_media_path("submissions/file.pdf"), (self.root / "submissions" / "file.pdf").resolve())
+        self.assertEqual(self.status("rubrics/file.pdf"), 200)
+        self.assertEqual(self.status("rubrics/missing.pdf"), 404)
+
+    def test_relative_escapes_and_absolute_paths_are_rejected(self):
+        for reference in ("../file.pdf", "submissions/../private/file.pdf", str(self.root / "rubrics" / "file.pdf"), "", "rubrics\\file.pdf"):
+            self.assertEqual(self.status(reference), 400, reference)
+
+    def test_other_media_directories_are_forbidden(self):
+        self.assertEqual(self.status("private/file.pdf"), 403)
+
+    def test_symlinks_cannot_lead_out_of_an_allowed_directory(self):
+        os.symlink(self.root / "private", self.root / "rubrics" / "link")
+
+        self.assertEqual(self.status("rubrics/link/file.pdf"), 403)
@@ -0,0 +1,66 @@
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase
+
+from lib import checkpoints
+from lib.checkpoints import NO_CHECKPOINTS, RunCheckpoints
+
+from . import requires_fake_redis
+
+
+@requires_fake_redis
+class RunCheckpointsTests(SimpleTestCase):
+    def setUp(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.redis.flushall()
+        self.checkpoints = RunCheckpoints(42, redis_client=self.redis)
+        self.computed = []
+
+    def compute(self, value):
+        def run():
+            self.computed.append(value)
+            return value
+        return run
+
+    def test_a_retried_run_reuses_the_saved_artifact(self):
+        self.checkpoints.remember("essay_text", ("essay-sha",), self.compute("Essay text"))
+
+        resumed = RunCheckpoints(42, redis_client=self.redis)
+        self.assertEqual(resumed.remember("essay_text", ("essay-sha",), self.compute("Recomputed")), "Essay text")
+        self.assertEqual(self.computed, ["Essay text"])
+        self.assertGreater(self.redis.ttl(f"{checkpoints.KEY_PREFIX}42"), 0)
+
+    def test_changed_inputs_are_computed_afresh(self):
+        self.checkpoints.remember("traits", ("rubric-v1",), self.compute(["Ideas"]))
+
+        self.assertEqual(self.checkpoints.remember("traits", ("rubric-v2",), self.compute(["Voice"])), ["Voice"])
+        self.assertEqual(self.checkpoints.get("traits", ("rubric-v2",)), ["Voice"])
+
+    def test_results_rejected_by_keep_are_not_saved(self):
+        self.checkpoints.remember("gpt:Ideas", ("essay-sha",), self.compute([None, "Error"]), keep=lambda result: result[0] is not None)
+
+        self.assertIs(self.checkpoints.get("gpt:Ideas", ("essay-sha",)), checkpoints.MISSING)
+
+    def test_clearing_drops_every_artifact_of_the_run(self):
+        self.checkpoints.put("essay_text", ("essay-sha",), "Essay text")
+        self.checkpoints.clear()
+
+        self.assertEqual(self.redis.exists(f"{checkpoints.KEY_PREFIX}42"), 0)
+
+    def test_runs_without_a_submission_are_not_checkpointed(self):
+        NO_CHECKPOINTS.remember("essay_text", ("essay-sha",), self.compute("Essay text"))
+
+        self.assertIs(NO_CHECKPOINTS.get("essay_text", ("essay-sha",)), checkpoints.MISSING)
+        self.assertEqual(self.redis.keys("*"), [])
+
+
+class UnavailableCheckpointsTests(SimpleTestCase):
+    def test_a_redis_outage_only_disables_resuming(self):
+        client = mock.Mock()
+        client.hget.side_effect = client.pipeline.side_effect = redis.exceptions.ConnectionError("refused")
+        run = RunCheckpoints(42, redis_client=client)
+
+        self.assertEqual(run.remember("essay_text", ("essay-sha",), lambda: "Essay text"), "Essay text")
+        self.assertEqual(run.remember("essay_text", ("essay-sha",), lambda: "Recomputed"), "Recomputed")
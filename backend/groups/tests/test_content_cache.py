@@ -0,0 +1,104 @@
+import itertools
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+import content_cache
+from content_cache import DiskLRUStore, RedisLRUStore
+
+from . import requires_fake_redis
+
+
+class DiskLRUStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_values_round_trip(self):
+        store = DiskLRUStore(self.directory, max_bytes=1024)
+        store.set("key", b"value")
+
+        self.assertEqual(store.get("key"), b"value")
+        self.assertIsNone(store.get("missing"))
+
+    def test_expired_entries_are_dropped(self):
+        store = DiskLRUStore(self.directory, max_bytes=1024, ttl=60)
+        store.set("key", b"value")
+
+        with mock.patch.object(content_cache.time, "time", return_value=time.time() + 61):
+            self.assertIsNone(store.get("key"))
+        self.assertFalse((self.directory / "key").exists())
+
+    def test_the_least_recently_used_entries_are_evicted(self):
+        store = DiskLRUStore(self.directory, max_bytes=180) # Room for three entries and their headers
+        for index, key in enumerate(("old", "used", "new")):
+            store.set(key, b"x" * 30)
+            os.utime(self.directory / key, (index, index)) # Distinct access times, oldest first
+        store.get("used")
+
+        store.set("newest", b"x" * 30)
+
+        self.assertIsNone(store.get("old"))
+        for key in ("used", "new", "newest"):
+            self.assertIsNotNone(store.get(key))
+
+
+@requires_fake_redis
+class RedisLRUStoreTests(SimpleTestCase):
+    def setUp(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis()
+        self.redis.flushall()
+
+    def test_the_least_recently_used_entries_are_evicted(self):
+        store = RedisLRUStore(self.redis, "test", max_bytes=100)
+        with mock.patch.object(content_cache.time, "time", side_effect=itertools.count(1)):
+            store.set("old", b"x" * 40)
+            store.set("used", b"x" * 40)
+            store.get("old")
+            store.set("new", b"x" * 40)
+
+        self.assertIsNone(store.get("used"))
+        self.assertEqual(store.get("old"), b"x" * 40)
+        self.assertEqual(int(self.redis.get(store.total_key)), 80)
+
+    def test_deleting_an_entry_updates_the_byte_total(self):
+        store = RedisLRUStore(self.redis, "test", max_bytes=100)
+        store.set("key", b"value")
+        store.delete("key")
+
+        self.assertIsNone(store.get("key"))
+        self.assertEqual(int(self.redis.get(store.total_key)), 0)
+
+
+class ExtractionCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for patcher in (
+            mock.patch.object(content_cache, "REDIS_URL", None),
+            mock.patch.object(content_cache, "CACHE_DIR", Path(directory.name)),
+            mock.patch.object(content_cache, "_stores", {}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_extractions_are_cached_by_content_hash(self):
+        content_sha256 = content_cache.sha256_bytes(b"%PDF-1.7")
+        result = {"generic_text": "Essay text", "generic_tables": [[["a"]]], "pages": [{"page": 1}], "timings": {}}
+
+        content_cache.cache_extraction(content_sha256, result)
+
+        self.assertEqual(content_cache.get_cached_extraction(content_sha256), {
+            "generic_text": "Essay text", "generic_tables": [[["a"]]], "pages": [{"page": 1}],
+        })
+
+    def test_empty_extractions_are_not_cached(self):
+        content_cache.cache_extraction("empty", {"generic_text": "  \n", "generic_tables": []})
+
+        self.assertIsNone(content_cache.get_cached_extraction("empty"))
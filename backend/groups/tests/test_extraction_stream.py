@@ -0,0 +1,60 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from . import requires_pdf_extraction
+from .test_pdf_extraction import make_pdf
+
+
+@requires_pdf_extraction
+class ExtractionStreamTests(SimpleTestCase):
+    """ExtractionPool.stream() with real (spawned) worker processes."""
+
+    def setUp(self):
+        import extraction_pool
+        import pdf_extraction
+        self.extraction_pool = extraction_pool
+        self.pdf_extraction = pdf_extraction
+        self.pool = self.make_pool(queue_size=1)
+
+    def make_pool(self, queue_size):
+        pool = self.extraction_pool.ExtractionPool(workers=1, queue_size=queue_size, timeout=60)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_pages_are_streamed_in_order(self):
+        async def read():
+            return [page async for page in self.pool.stream(self.pdf_extraction.extract_pages, make_pdf("text", "blank", "text"))]
+
+        pages = asyncio.run(read())
+
+        self.assertEqual([(page["page"], page["method"]) for page in pages], [(1, "pymupdf"), (2, "pdfplumber"), (3, "pymupdf")])
+        self.assertIn("homework should be optional", pages[0]["text"])
+
+    def test_closing_a_stream_early_frees_its_worker(self):
+        async def read_first_then_extract():
+            stream = self.pool.stream(self.pdf_extraction.extract_pages, make_pdf(*["text"] * 20))
+            first = await anext(stream)
+            await stream.aclose()
+            # The pool has one worker: this only finishes once the stream's job has stopped
+            result = await asyncio.wait_for(self.pool.run(self.pdf_extraction.extract_document, make_pdf("text")), 30)
+            return first, result
+
+        first, result = asyncio.run(read_first_then_extract())
+
+        self.assertEqual(first["page"], 1)
+        self.assertEqual(len(result["pages"]), 1)
+
+    def test_a_full_pool_refuses_a_stream_before_it_starts(self):
+        pool = self.make_pool(queue_size=0)
+
+        async def stream_while_busy():
+            busy = pool.stream(self.pdf_extraction.extract_pages, make_pdf(*["text"] * 20))
+            await anext(busy)
+            try:
+                with self.assertRaises(self.extraction_pool.ExtractionQueueFull):
+                    pool.stream(self.pdf_extraction.extract_pages, make_pdf("text"))
+            finally:
+                await busy.aclose()
+
+        asyncio.run(stream_while_busy())
@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+import redis
+from django.test import TestCase
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from groups.models import Assignment, Class, Submission
+from lib import auto_grader, grading_queue
+from lib.auto_grader import ServiceError
+
+from . import requires_fake_redis
+
+
+@requires_fake_redis
+class GradingQueueTests(TestCase):
+    def setUp(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.redis.flushall()
+        for name, value in (("_redis_client", self.redis), ("_scheduler", None)):
+            patcher = mock.patch.object(grading_queue, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        teacher = CustomUser.objects.create_user("teacher@example.com", "Teacher", role="teacher")
+        student = CustomUser.objects.create_user("student@example.com", "Student")
+        class_assigned = Class.objects.create(name="English", teacher=teacher)
+        assignment = Assignment.objects.create(
+            class_assigned=class_assigned, name="Essay", due_date=timezone.now() + timedelta(days=1),
+            rubric_file="rubrics/rubric.pdf",
+        )
+        self.submission = Submission.objects.create(
+            assignment=assignment, student=student, submission_file="submissions/essay.pdf", grading_status="queued",
+        )
+        self.pipeline_calls = []
+
+    def pipeline(self, error=None, on_call=None):
+        """Replaces the grading pipeline with one that records its calls and raises error, if given."""
+        def run(**kwargs):
+            self.pipeline_calls.append(kwargs)
+            if on_call is not None:
+                on_call(kwargs)
+            if error is not None:
+                raise error
+        patcher = mock.patch.object(auto_grader, "trigger_auto_grading_pipeline", run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def next_job(self) -> dict | None:
+        raw_job = grading_queue.get_scheduler().dequeue("test:processing")
+        return None if raw_job is None else json.loads(raw_job)
+
+    def status(self) -> tuple:
+        self.submission.refresh_from_db()
+        return self.submission.grading_status, self.submission.grading_error
+
+    def test_enqueued_job_is_scheduled_and_graded(self):
+        self.pipeline()
+        job_id = grading_queue.enqueue_grading(self.submission.id)
+
+        self.assertEqual(grading_queue.queue_length(), 1)
+        job = self.next_job()
+        self.assertEqual((job["id"], job["submission_id"]), (job_id, self.submission.id))
+        grading_queue.run_job(job)
+
+        self.assertEqual(len(self.pipeline_calls), 1)
+        self.assertEqual(self.status(), ("done", None))
+        self.assertIsNone(self.redis.get(f"{grading_queue.CURRENT_JOB_KEY_PREFIX}{self.submission.id}"))
+
+    def test_a_newer_job_supersedes_a_queued_one(self):
+        self.pipeline()
+        grading_queue.enqueue_grading(self.submission.id)
+        newer_id = grading_queue.enqueue_grading(self.submission.id)
+
+        jobs = [self.next_job(), self.next_job()]
+        for job in jobs:
+            grading_queue.run_job(job)
+
+        self.assertEqual(len(self.pipeline_calls), 1)
+        self.assertEqual(jobs[1]["id"], newer_id)
+        self.assertEqual(self.status(), ("done", None))
+
+    def test_a_running_job_stops_when_superseded(self):
+        def supersede(kwargs):
+            grading_queue.supersede_grading(self.submission.id)
+            kwargs["cancel_check"]()
+
+        self.pipeline(on_call=supersede)
+        grading_queue.enqueue_grading(self.submission.id)
+        grading_queue.run_job(self.next_job())
+
+        self.assertEqual(len(self.pipeline_calls), 1)
+        self.assertNotEqual(self.status()[0], "failed")
+
+    def test_a_transient_failure_is_requeued_after_a_delay(self):
+        self.pipeline(error=ServiceError("scoring service down"))
+        job_id = grading_queue.enqueue_grading(self.submission.id)
+        grading_queue.run_job(self.next_job())
+
+        self.assertEqual(self.status(), ("queued", "Retrying after: scoring service down"))
+        [(raw_job, due)] = self.redis.zrange(grading_queue.DELAYED_KEY, 0, -1, withscores=True)
+        self.assertAlmostEqual(due, time.time() + grading_queue.GRADING_RETRY_BACKOFF, delta=5)
+        self.assertEqual(grading_queue.promote_delayed_jobs(), 0) # Not due yet
+
+        self.redis.zadd(grading_queue.DELAYED_KEY, {raw_job: 0})
+        self.assertEqual(grading_queue.promote_delayed_jobs(), 1)
+        retried = self.next_job()
+        self.assertEqual((retried["id"], retried["attempt"]), (job_id, 2))
+
+    def test_retries_stop_after_the_last_attempt(self):
+        self.pipeline(error=ServiceError("scoring service down"))
+        grading_queue.enqueue_grading(self.submission.id)
+        job = self.next_job()
+        job["attempt"] = grading_queue.GRADING_MAX_ATTEMPTS
+        grading_queue.run_job(job)
+
+        self.assertEqual(self.status(), ("failed", "scoring service down"))
+        self.assertEqual(self.redis.zcard(grading_queue.DELAYED_KEY), 0)
+
+    def test_other_errors_fail_without_a_retry(self):
+        self.pipeline(error=ValueError("bad essay"))
+        grading_queue.enqueue_grading(self.submission.id)
+        grading_queue.run_job(self.next_job())
+
+        self.assertEqual(self.status(), ("failed", "bad essay"))
+        self.assertEqual(grading_queue.queue_length(), 0)
+
+    def test_jobs_of_a_worker_without_heartbeat_are_recovered(self):
+        dead = f"{grading_queue.PROCESSING_KEY_PREFIX}dead-worker"
+        alive = f"{grading_queue.PROCESSING_KEY_PREFIX}live-worker"
+        self.redis.lpush(dead, json.dumps({"id": "orphan"}))
+        self.redis.lpush(alive, json.dumps({"id": "in-flight"}))
+        self.redis.set(f"{grading_queue.HEARTBEAT_KEY_PREFIX}live-worker", "1")
+
+        self.assertEqual(grading_queue.recover_orphaned_jobs(), 1)
+        self.assertEqual(self.next_job()["id"], "orphan")
+        self.assertEqual(self.redis.llen(alive), 1)
+
+    def test_the_heartbeat_outlives_a_redis_error(self):
+        worker = grading_queue.GradingWorker(concurrency=1, worker_id="test-worker")
+        beats = []
+
+        def flaky_set(*args, **kwargs):
+            beats.append(args)
+            if len(beats) == 1:
+                raise redis.exceptions.ConnectionError("connection reset")
+            worker.stop()
+
+        with mock.patch.object(self.redis, "set", flaky_set), mock.patch.object(grading_queue, "HEARTBEAT_TTL", 0.03):
+            thread = threading.Thread(target=worker._heartbeat)
+            thread.start()
+            thread.join(timeout=5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(beats), 2)
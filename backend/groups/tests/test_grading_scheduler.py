@@ -0,0 +1,84 @@
+import json
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from lib import grading_scheduler
+from lib.grading_scheduler import PRIORITY_REGRADE, PRIORITY_SUBMISSION, FairShareScheduler
+
+from . import requires_fake_redis
+
+
+@requires_fake_redis
+class FairShareSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.redis.flushall()
+        self.scheduler = FairShareScheduler(self.redis, "test:express", "test:signal")
+        self.now = time.time()
+        self.enqueued = 0
+        weights = {PRIORITY_SUBMISSION: 4.0, PRIORITY_REGRADE: 1.0}
+        patcher = mock.patch.dict(grading_scheduler.PRIORITY_WEIGHTS, weights)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueue(self, tag, priority=PRIORITY_SUBMISSION, teacher_id=1, class_id=10, due_in=3600):
+        self.enqueued += 1
+        self.scheduler.enqueue(
+            f"job-{self.enqueued}", json.dumps({"tag": tag}), priority, teacher_id, class_id,
+            self.now + due_in, self.now + self.enqueued / 1000,
+        )
+
+    def dequeue_tags(self, count):
+        return [json.loads(self.scheduler.dequeue("test:processing"))["tag"] for _ in range(count)]
+
+    def test_express_jobs_go_before_scheduled_ones(self):
+        self.enqueue("scheduled")
+        self.redis.lpush("test:express", json.dumps({"tag": "express"}))
+
+        self.assertEqual(self.dequeue_tags(2), ["express", "scheduled"])
+        self.assertIsNone(self.scheduler.dequeue("test:processing"))
+        self.assertEqual(self.redis.llen("test:processing"), 2)
+
+    def test_priority_classes_share_capacity_by_weight(self):
+        for _ in range(50):
+            self.enqueue("regrade", priority=PRIORITY_REGRADE)
+            self.enqueue("submission")
+
+        tags = self.dequeue_tags(25)
+
+        self.assertAlmostEqual(tags.count("submission"), 20, delta=1)
+        self.assertAlmostEqual(tags.count("regrade"), 5, delta=1)
+
+    def test_a_large_backlog_does_not_starve_other_teachers(self):
+        for _ in range(100):
+            self.enqueue("busy", teacher_id=1)
+        for _ in range(5):
+            self.enqueue("quiet", teacher_id=2, due_in=7200)
+
+        tags = self.dequeue_tags(10)
+
+        self.assertEqual(tags.count("quiet"), 5)
+        self.assertEqual(tags.count("busy"), 5)
+
+    def test_jobs_in_a_class_go_by_due_date_then_enqueue_order(self):
+        self.enqueue("later", due_in=7200)
+        self.enqueue("first")
+        self.enqueue("second")
+        self.enqueue("soonest", due_in=60)
+
+        self.assertEqual(self.dequeue_tags(4), ["soonest", "first", "second", "later"])
+        self.assertEqual(self.scheduler.pending(), 0)
+
+    def test_an_idle_class_gets_no_burst_credit(self):
+        for _ in range(20):
+            self.enqueue("steady", class_id=10)
+        self.dequeue_tags(10)
+        for _ in range(10):
+            self.enqueue("returning", class_id=11)
+
+        tags = self.dequeue_tags(10)
+
+        self.assertAlmostEqual(tags.count("returning"), 5, delta=1)
@@ -0,0 +1,59 @@
+from unittest import mock
+
+import redis
+from django.test import SimpleTestCase
+
+from lib import grading_queue, idempotency
+
+from . import requires_fake_redis
+
+SCOPE = "submit_assignment:7:3"
+
+
+@requires_fake_redis
+class IdempotencyTests(SimpleTestCase):
+    def setUp(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.redis.flushall()
+        patcher = mock.patch.object(grading_queue, "_redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_a_repeated_request_gets_the_first_result(self):
+        self.assertIsNone(idempotency.claim(SCOPE, "key-1"))
+        idempotency.store_result(SCOPE, "key-1", "Submitted essay.pdf")
+
+        self.assertEqual(idempotency.claim(SCOPE, "key-1"), "Submitted essay.pdf")
+        self.assertGreater(self.redis.ttl(f"{idempotency.KEY_PREFIX}{SCOPE}:key-1"), idempotency.IDEMPOTENCY_CLAIM_TTL)
+
+    def test_a_repeat_during_the_first_request_is_refused(self):
+        idempotency.claim(SCOPE, "key-1")
+
+        with self.assertRaises(idempotency.RequestInProgress):
+            idempotency.claim(SCOPE, "key-1")
+        self.assertIsNone(idempotency.claim(SCOPE, "key-2"))
+        self.assertIsNone(idempotency.claim("submit_assignment:8:3", "key-1"))
+
+    def test_a_released_claim_lets_the_retry_run(self):
+        idempotency.claim(SCOPE, "key-1")
+        idempotency.release(SCOPE, "key-1")
+
+        self.assertIsNone(idempotency.claim(SCOPE, "key-1"))
+
+    def test_releasing_keeps_a_stored_result(self):
+        idempotency.claim(SCOPE, "key-1")
+        idempotency.store_result(SCOPE, "key-1", "Submitted essay.pdf")
+        idempotency.release(SCOPE, "key-1")
+
+        self.assertEqual(idempotency.claim(SCOPE, "key-1"), "Submitted essay.pdf")
+
+
+class UnavailableIdempotencyTests(SimpleTestCase):
+    def test_without_redis_every_request_runs(self):
+        client = mock.Mock()
+        client.set.side_effect = redis.exceptions.ConnectionError("refused")
+
+        with mock.patch.object(grading_queue, "_redis_client", client):
+            self.assertIsNone(idempotency.claim(SCOPE, "key-1"))
+            self.assertIsNone(idempotency.claim(SCOPE, "key-1"))
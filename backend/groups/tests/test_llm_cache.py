@@ -0,0 +1,83 @@
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from content_cache import DiskLRUStore
+from lib import llm_cache
+
+REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Score this essay."}], "temperature": 0.1}
+
+
+class FakeClient:
+    """Answers chat completions with the next of answers, recording each request."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.requests.append(request)
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=SimpleNamespace(cached_tokens=60))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answers.pop(0)))], usage=usage)
+
+
+class LLMCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = DiskLRUStore(directory.name, max_bytes=1024 * 1024)
+        for patcher in (
+            mock.patch.object(llm_cache, "_store", lambda: store),
+            mock.patch.object(llm_cache, "call_openai", lambda create, estimated_tokens: create()),
+            mock.patch.object(llm_cache, "LLM_CACHE_ENABLED", True),
+            mock.patch.dict(llm_cache._counters, dict.fromkeys(llm_cache._counters, 0)),
+            mock.patch.dict(llm_cache._token_counters, dict.fromkeys(llm_cache._token_counters, 0)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fingerprints_ignore_key_order_but_not_parameters(self):
+        reordered = {"temperature": 0.1, "messages": REQUEST["messages"], "model": "gpt-4o-mini"}
+
+        self.assertEqual(llm_cache.fingerprint(**REQUEST), llm_cache.fingerprint(**reordered))
+        self.assertNotEqual(llm_cache.fingerprint(**REQUEST), llm_cache.fingerprint(**{**REQUEST, "temperature": 0.2}))
+
+    def test_identical_requests_are_answered_from_the_cache(self):
+        client = FakeClient("Feedback.\n3")
+
+        first = llm_cache.chat_completion_content(client, **REQUEST)
+        second = llm_cache.chat_completion_content(client, **REQUEST)
+
+        self.assertEqual((first, second), ("Feedback.\n3", "Feedback.\n3"))
+        self.assertEqual(len(client.requests), 1)
+        stats = llm_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+        self.assertEqual((stats["prompt_tokens"], stats["cached_prompt_tokens"], stats["completion_tokens"]), (100, 60, 20))
+
+    def test_a_regrade_skips_the_lookup_but_refreshes_the_entry(self):
+        client = FakeClient("Old answer", "New answer")
+        llm_cache.chat_completion_content(client, **REQUEST)
+
+        self.assertEqual(llm_cache.chat_completion_content(client, use_cache=False, **REQUEST), "New answer")
+        self.assertEqual(llm_cache.chat_completion_content(client, **REQUEST), "New answer")
+        self.assertEqual(llm_cache.stats()["bypassed"], 1)
+
+    def test_a_discarded_answer_is_asked_for_again(self):
+        client = FakeClient("Unparseable", "Feedback.\n2")
+        llm_cache.chat_completion_content(client, **REQUEST)
+
+        llm_cache.discard(**REQUEST)
+
+        self.assertEqual(llm_cache.chat_completion_content(client, **REQUEST), "Feedback.\n2")
+        self.assertEqual(len(client.requests), 2)
+
+    def test_nothing_is_cached_when_disabled(self):
+        client = FakeClient("First", "Second")
+
+        with mock.patch.object(llm_cache, "LLM_CACHE_ENABLED", False):
+            llm_cache.chat_completion_content(client, **REQUEST)
+            self.assertEqual(llm_cache.chat_completion_content(client, **REQUEST), "Second")
+        self.assertEqual(llm_cache.stats()["misses"], 0)
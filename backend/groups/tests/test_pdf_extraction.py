@@ -0,0 +1,65 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from . import requires_pdf_extraction
+
+PROSE = "The essay argues that homework should be optional for younger students. " * 8
+
+
+def make_pdf(*pages) -> bytes:
+    """A PDF with one page per kind: "text", "scan" (a page-sized image), "stamped_scan" or "blank"."""
+    import fitz
+
+    document = fitz.open()
+    for kind in pages:
+        page = document.new_page()
+        if kind == "text":
+            page.insert_textbox(page.rect + (72, 72, -72, -72), PROSE)
+        if kind in ("scan", "stamped_scan"):
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 60, 80), False)
+            pixmap.set_rect(pixmap.irect, (230, 230, 230))
+            page.insert_image(page.rect, pixmap=pixmap)
+        if kind == "stamped_scan":
+            page.insert_text((72, 40), "Page 1 of 3 - Scanned on 12 March 2024") # Text layer of a header only
+    return document.tobytes()
+
+
+@requires_pdf_extraction
+class PageRoutingTests(SimpleTestCase):
+    def setUp(self):
+        import pdf_extraction
+        self.pdf_extraction = pdf_extraction
+        patcher = mock.patch.object(pdf_extraction.pytesseract, "image_to_string", return_value="Scanned essay text")
+        self.ocr = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def methods(self, *pages) -> list[str]:
+        return [page["method"] for page in self.pdf_extraction.extract_document(make_pdf(*pages))["pages"]]
+
+    def test_pages_with_a_text_layer_are_read_by_pymupdf(self):
+        result = self.pdf_extraction.extract_document(make_pdf("text", "text"))
+
+        self.assertEqual([page["method"] for page in result["pages"]], ["pymupdf", "pymupdf"])
+        self.assertIn("homework should be optional", result["generic_text"])
+        self.assertEqual(set(result["timings"]), {"pymupdf"})
+        self.ocr.assert_not_called()
+
+    def test_scanned_pages_are_ocrd(self):
+        result = self.pdf_extraction.extract_document(make_pdf("text", "scan"))
+
+        self.assertEqual([page["method"] for page in result["pages"]], ["pymupdf", "ocr"])
+        self.assertTrue(result["generic_text"].endswith("Scanned essay text"))
+        self.assertEqual(self.ocr.call_count, 1)
+
+    def test_a_scan_with_a_stamped_header_is_still_ocrd(self):
+        self.assertEqual(self.methods("stamped_scan"), ["ocr"])
+
+    def test_pages_without_text_or_images_go_to_pdfplumber(self):
+        self.assertEqual(self.methods("blank"), ["pdfplumber"])
+        self.ocr.assert_not_called()
+
+    def test_an_unreadable_pdf_extracts_nothing(self):
+        result = self.pdf_extraction.extract_document(b"not a pdf")
+
+        self.assertEqual((result["generic_text"], result["pages"]), ("", []))
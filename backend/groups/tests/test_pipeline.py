@@ -0,0 +1,132 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from lib.pipeline import RunCancelled, Stage, StageGraph, StageTimeout, stage_time_left
+
+
+class RecordingListener:
+    def __init__(self):
+        self.starts = []
+        self.ends = {}
+        self._lock = threading.Lock()
+
+    def on_stage_start(self, name, attempt):
+        with self._lock:
+            self.starts.append((name, attempt))
+
+    def on_stage_end(self, name, duration, attempts, error):
+        self.ends[name] = (attempts, error)
+
+
+class StageGraphTests(SimpleTestCase):
+    def test_stages_run_once_their_inputs_are_ready(self):
+        listener = RecordingListener()
+        graph = StageGraph([
+            Stage("total", lambda left, right: left + right, inputs=("left", "right")),
+            Stage("left", lambda base: base + 1, inputs=("base",)),
+            Stage("right", lambda base: base * 2, inputs=("base",)),
+        ])
+
+        values = graph.run(listener=listener, base=5)
+
+        self.assertEqual(values["total"], 16)
+        started = [name for name, _ in listener.starts]
+        self.assertEqual(started[-1], "total")
+        self.assertCountEqual(started[:2], ["left", "right"])
+
+    def test_independent_stages_run_concurrently(self):
+        both_started = threading.Barrier(2, timeout=5)
+        graph = StageGraph([
+            Stage("essay", lambda: both_started.wait() is not None),
+            Stage("rubric", lambda: both_started.wait() is not None),
+        ])
+
+        values = graph.run()
+
+        self.assertTrue(values["essay"] and values["rubric"])
+
+    def test_unknown_inputs_and_cycles_are_rejected(self):
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", lambda missing: missing, inputs=("missing",))]).run()
+        with self.assertRaises(ValueError):
+            StageGraph([Stage("a", lambda b: b, inputs=("b",)), Stage("b", lambda a: a, inputs=("a",))]).run()
+
+    def test_failed_attempts_are_retried(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ConnectionError("service down")
+            return "ok"
+
+        listener = RecordingListener()
+        values = StageGraph([Stage("flaky", flaky, retries=2, backoff=0)]).run(listener=listener)
+
+        self.assertEqual(values["flaky"], "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(listener.ends["flaky"], (3, None))
+
+    def test_errors_outside_retry_on_are_raised_at_once(self):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise KeyError("bad input")
+
+        graph = StageGraph([Stage("broken", broken, retries=3, retry_on=(ConnectionError,), backoff=0)])
+
+        with self.assertRaises(KeyError):
+            graph.run()
+        self.assertEqual(len(calls), 1)
+
+    def test_an_attempt_past_its_timeout_is_abandoned_and_retried(self):
+        attempts = []
+
+        def slow_then_fast():
+            attempts.append(1)
+            if len(attempts) == 1:
+                time.sleep(1)
+            return len(attempts)
+
+        started = time.monotonic()
+        values = StageGraph([Stage("slow", slow_then_fast, timeout=0.2, retries=1, backoff=0)]).run()
+
+        self.assertEqual(values["slow"], 2)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_timeout_without_retries_raises_stage_timeout(self):
+        graph = StageGraph([Stage("slow", lambda: time.sleep(1), timeout=0.1)])
+
+        with self.assertRaises(StageTimeout):
+            graph.run()
+
+    def test_stage_time_left_reports_the_attempt_deadline(self):
+        values = StageGraph([
+            Stage("limited", stage_time_left, timeout=5),
+            Stage("unlimited", stage_time_left),
+        ]).run()
+
+        self.assertTrue(0 < values["limited"] <= 5)
+        self.assertIsNone(values["unlimited"])
+        self.assertIsNone(stage_time_left())
+
+    def test_cancel_check_stops_the_run_before_the_next_stage(self):
+        ran = []
+        checks = []
+
+        def cancel():
+            checks.append(1)
+            if len(checks) > 1:
+                raise RunCancelled("superseded")
+
+        graph = StageGraph([
+            Stage("first", lambda: ran.append("first")),
+            Stage("second", lambda first: ran.append("second"), inputs=("first",)),
+        ])
+
+        with self.assertRaises(RunCancelled):
+            graph.run(cancel=cancel)
+        self.assertEqual(ran, ["first"])
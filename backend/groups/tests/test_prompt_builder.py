@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+import prompt_builder
+
+
+class PromptBuilderTests(SimpleTestCase):
+    def test_sections_are_ordered_for_prefix_caching(self):
+        messages = prompt_builder.compile_prompt(
+            "Grade the essay.", shared=[("Essay", "Some text.")], varying=[("Trait", "Ideas")],
+        )
+
+        self.assertEqual(messages[0], {"role": "system", "content": "Grade the essay."})
+        self.assertEqual(messages[1]["content"], "### Essay\nSome text.\n\n### Trait\nIdeas")
+
+    def test_prompts_within_budget_are_not_trimmed(self):
+        messages = prompt_builder.compile_prompt("Grade.", shared=[("Essay", "Short essay.")], trim="Essay", budget=500)
+
+        self.assertIn("Short essay.", messages[1]["content"])
+        self.assertNotIn(prompt_builder.TRUNCATION_MARKER, messages[1]["content"])
+
+    def test_the_trimmed_section_is_cut_to_fit_the_budget(self):
+        essay = " ".join(f"word{i}" for i in range(5000))
+        budget = 300
+
+        messages = prompt_builder.compile_prompt(
+            "Grade the essay.", shared=[("Essay", essay)], varying=[("Trait", "Ideas")], trim="Essay", budget=budget,
+        )
+
+        user = messages[1]["content"]
+        self.assertIn(prompt_builder.TRUNCATION_MARKER, user)
+        self.assertTrue(user.endswith("### Trait\nIdeas"))
+        tokens = prompt_builder.count_tokens(messages[0]["content"]) + prompt_builder.count_tokens(user)
+        self.assertLessEqual(tokens, budget + 2) # Token counts of the joined text can differ slightly from the parts'
+
+    def test_untrimmed_sections_are_kept_whole(self):
+        rubric = "Rubric line. " * 200
+
+        messages = prompt_builder.compile_prompt(
+            "Grade.", shared=[("Rubric", rubric)], varying=[("Essay", "essay " * 2000)], trim="Essay", budget=200,
+        )
+
+        self.assertIn(rubric, messages[1]["content"])
@@ -0,0 +1,104 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import openai
+from django.test import SimpleTestCase
+
+from lib import rate_limiter
+from lib.rate_limiter import OpenAIRateLimiter, RateLimitTimeout
+
+from . import requires_fake_redis
+
+
+def rate_limit_error(code="rate_limit_exceeded", headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request, headers=headers or {})
+    return openai.RateLimitError("Rate limited", response=response, body={"code": code, "message": "Rate limited"})
+
+
+class RetryAfterTests(SimpleTestCase):
+    def test_the_servers_retry_after_is_used(self):
+        self.assertEqual(rate_limiter.retry_after_seconds(rate_limit_error(headers={"retry-after-ms": "250"})), 0.25)
+        self.assertEqual(rate_limiter.retry_after_seconds(rate_limit_error(headers={"retry-after": "3"})), 3.0)
+
+    def test_without_a_header_the_caller_picks_the_backoff(self):
+        self.assertEqual(rate_limiter.retry_after_seconds(rate_limit_error()), 0.0)
+        self.assertEqual(rate_limiter.retry_after_seconds(ValueError("no response")), 0.0)
+
+
+@requires_fake_redis
+class OpenAIRateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        import fakeredis
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.redis.flushall()
+        self.limiter = OpenAIRateLimiter(self.redis, key_prefix="test:openai")
+        patcher = mock.patch.object(rate_limiter, "_limiter", self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def deadline(self, seconds=0.2):
+        return time.monotonic() + seconds
+
+    def window(self) -> float:
+        return float(self.redis.hget(self.limiter.state_key, "limit"))
+
+    def test_a_full_concurrency_window_makes_callers_wait(self):
+        with mock.patch.object(rate_limiter, "OPENAI_INITIAL_CONCURRENCY", 1):
+            lease_id = self.limiter.acquire(10, self.deadline())
+            with self.assertRaises(RateLimitTimeout):
+                self.limiter.acquire(10, self.deadline())
+
+            self.limiter.release(lease_id)
+            self.assertIsNotNone(self.limiter.acquire(10, self.deadline()))
+
+    def test_the_request_bucket_limits_calls_per_minute(self):
+        with mock.patch.object(rate_limiter, "OPENAI_RPM_LIMIT", 1):
+            self.limiter.release(self.limiter.acquire(10, self.deadline()))
+            with self.assertRaises(RateLimitTimeout):
+                self.limiter.acquire(10, self.deadline())
+
+    def test_a_429_halves_the_window_once_per_burst_and_blocks_every_caller(self):
+        self.assertEqual(self.limiter.throttled(60), rate_limiter.OPENAI_INITIAL_CONCURRENCY / 2)
+        self.assertEqual(self.limiter.throttled(60), rate_limiter.OPENAI_INITIAL_CONCURRENCY / 2)
+
+        with self.assertRaises(RateLimitTimeout):
+            self.limiter.acquire(10, self.deadline())
+
+    def test_successes_grow_the_window(self):
+        self.limiter.succeeded()
+
+        self.assertGreater(self.window(), rate_limiter.OPENAI_INITIAL_CONCURRENCY)
+
+    def test_call_openai_retries_429s_after_the_servers_retry_after(self):
+        calls = []
+
+        def create():
+            calls.append(1)
+            if len(calls) == 1:
+                raise rate_limit_error(headers={"retry-after-ms": "10"})
+            return SimpleNamespace(usage=SimpleNamespace(total_tokens=10))
+
+        rate_limiter.call_openai(create, 10)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.redis.zcard("test:openai:leases"), 0)
+
+    def test_call_openai_does_not_retry_insufficient_quota(self):
+        create = mock.Mock(side_effect=rate_limit_error(code="insufficient_quota"))
+
+        with self.assertRaises(openai.RateLimitError):
+            rate_limiter.call_openai(create, 10)
+
+        self.assertEqual(create.call_count, 1)
+        self.assertIsNone(self.redis.hget(self.limiter.state_key, "blocked_until"))
+
+    def test_call_openai_gives_up_after_the_last_attempt(self):
+        create = mock.Mock(side_effect=rate_limit_error(headers={"retry-after-ms": "1"}))
+
+        with mock.patch.object(rate_limiter, "OPENAI_CALL_ATTEMPTS", 2), self.assertRaises(RateLimitTimeout):
+            rate_limiter.call_openai(create, 10)
+
+        self.assertEqual(create.call_count, 2)
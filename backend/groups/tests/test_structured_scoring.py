@@ -0,0 +1,80 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from lib import auto_grader, llm_cache
+
+TRAITS = [
+    {"name": "Ideas", "definition": "3 = Clear thesis\n2 = Some focus\n1 = No focus", "max_score": 3},
+    {"name": "Conventions", "definition": "4 = No errors\n0 = Unreadable", "max_score": 4},
+]
+
+
+class StructuredScoringTests(SimpleTestCase):
+    def setUp(self):
+        self.requests = []
+        self.answer = None
+        self.discarded = []
+        for name, replacement in (
+            ("chat_completion_content", self.complete),
+            ("discard", lambda **request: self.discarded.append(request)),
+        ):
+            patcher = mock.patch.object(llm_cache, name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def complete(self, client, use_cache=True, **request):
+        self.requests.append(request)
+        return self.answer
+
+    def test_every_trait_is_scored_in_one_schema_constrained_call(self):
+        self.answer = json.dumps({
+            "Ideas": {"feedback": "A clear thesis. ", "score": 3},
+            "Conventions": {"feedback": "Few errors.", "score": 2},
+        })
+
+        results = auto_grader.get_gpt_structured_scores(None, TRAITS, "My essay.")
+
+        self.assertEqual(results, {"Ideas": (3, "A clear thesis."), "Conventions": (2, "Few errors.")})
+        [request] = self.requests
+        schema = request["response_format"]["json_schema"]["schema"]
+        self.assertEqual(schema["required"], ["Ideas", "Conventions"])
+        self.assertEqual(schema["properties"]["Ideas"]["properties"]["score"]["enum"], [0, 1, 2, 3])
+        self.assertEqual(schema["properties"]["Conventions"]["properties"]["score"]["enum"], [0, 1, 2, 3, 4])
+        # The rubric is part of the cacheable prefix; the essay comes last
+        user = request["messages"][-1]["content"]
+        self.assertLess(user.index("Clear thesis"), user.index("My essay."))
+        self.assertEqual(self.discarded, [])
+
+    def test_a_trait_missing_from_the_answer_fails_and_drops_the_cached_answer(self):
+        self.answer = json.dumps({"Ideas": {"feedback": "Good.", "score": 2}})
+
+        results = auto_grader.get_gpt_structured_scores(None, TRAITS, "My essay.")
+
+        self.assertEqual(results["Ideas"], (2, "Good."))
+        self.assertIsNone(results["Conventions"][0])
+        self.assertEqual(self.discarded, self.requests)
+
+    def test_an_unparseable_answer_fails_every_trait(self):
+        self.answer = "Not JSON"
+
+        results = auto_grader.get_gpt_structured_scores(None, TRAITS, "My essay.")
+
+        self.assertEqual([score for score, _ in results.values()], [None, None])
+        self.assertEqual(self.discarded, self.requests)
+
+    def test_the_structured_stage_makes_no_per_trait_calls(self):
+        self.answer = json.dumps({
+            "Ideas": {"feedback": "Good.", "score": 3},
+            "Conventions": {"feedback": "Fine.", "score": 4},
+        })
+        hf_scores = [{"trait": "Ideas", "score": 2.8}, {"trait": "Conventions", "score": 1.0}]
+        stage = auto_grader.make_trait_scores_stage("structured")
+
+        with mock.patch.object(auto_grader, "get_gpt_trait_score", side_effect=AssertionError("per-trait call")):
+            trait_scores = stage(None, "My essay.", TRAITS, hf_scores)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual([(item["trait"], item["score"], item["max_score"]) for item in trait_scores],
+                         [("Ideas", 3, 3), ("Conventions", 4, 4)])
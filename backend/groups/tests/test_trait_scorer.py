@@ -0,0 +1,58 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+import trait_scorer
+from trait_scorer import TraitBatcher
+
+TRAITS = [{"name": "Ideas"}, {"name": "Organization"}]
+
+
+class FakeModel:
+    """Answers each prompt with the score given for its trait, recording every batch."""
+
+    def __init__(self, scores=None, error=None):
+        self.scores = scores or {}
+        self.error = error
+        self.batches = []
+
+    def generate(self, prompts):
+        self.batches.append(prompts)
+        if self.error is not None:
+            raise self.error
+        return [next((score for name, score in self.scores.items() if f"'{name}'" in prompt), "") for prompt in prompts]
+
+
+class TraitBatcherTests(SimpleTestCase):
+    def score_all(self, batcher, *essays):
+        async def run():
+            return await asyncio.gather(*(batcher.score(essay, TRAITS) for essay in essays))
+        return asyncio.run(run())
+
+    def test_concurrent_requests_share_a_batch(self):
+        model = FakeModel({"Ideas": "3", "Organization": "2.5"})
+
+        results = self.score_all(TraitBatcher(model, window_ms=50), "First essay.", "A much longer second essay.")
+
+        self.assertEqual(len(model.batches), 1)
+        self.assertEqual(len(model.batches[0]), 4)
+        for scores in results:
+            self.assertEqual(scores, [{"trait": "Ideas", "score": 3.0}, {"trait": "Organization", "score": 2.5}])
+
+    def test_batches_are_cut_at_the_max_size_shortest_prompts_first(self):
+        model = FakeModel({"Ideas": "1", "Organization": "2"})
+
+        self.score_all(TraitBatcher(model, max_batch_size=3, window_ms=50), "A long essay " * 10, "Short.")
+
+        self.assertEqual([len(batch) for batch in model.batches], [3, 1])
+        self.assertEqual(sum("Short." in prompt for prompt in model.batches[0]), 2)
+
+    def test_a_model_error_fails_every_request_of_the_batch(self):
+        batcher = TraitBatcher(FakeModel(error=RuntimeError("out of memory")), window_ms=50)
+
+        with self.assertRaisesMessage(RuntimeError, "out of memory"):
+            self.score_all(batcher, "First essay.", "Second essay.")
+
+    def test_outputs_without_a_number_have_no_score(self):
+        self.assertEqual(trait_scorer.parse_score("Score: 4"), 4.0)
+        self.assertIsNone(trait_scorer.parse_score("good"))
@@ -1,3 +1,30 @@
-from django.shortcuts import render
+import os
+import sys
 
-# Create your views here.
+from django.http import HttpResponse
+
+# Histograms are shared with the FastAPI service (backend-fastapi/latency_metrics.py)
+FASTAPI_SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend-fastapi'))
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+import latency_metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint: grading run/stage latencies and downstream
+    request latencies (recorded by the grading workers), plus LLM cache and token counters.
+    """
+    from lib import llm_cache
+
+    lines = [latency_metrics.render(latency_metrics.GRADING_METRICS).rstrip("\n")]
+    cache = llm_cache.stats()
+    lines.append("# HELP llm_cache_events_total LLM response cache lookups by outcome.")
+    lines.append("# TYPE llm_cache_events_total counter")
+    for event in ("hits", "misses", "bypassed", "errors"):
+        lines.append(f'llm_cache_events_total{{event="{event}"}} {cache[event]}')
+    lines.append("# HELP llm_tokens_total Tokens used by model requests; cached_prompt_tokens were served from the provider's prompt cache.")
+    lines.append("# TYPE llm_tokens_total counter")
+    for kind in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens"):
+        lines.append(f'llm_tokens_total{{kind="{kind}"}} {cache[kind]}')
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4")
@@ -1,19 +1,44 @@
 import requests
+import contextvars
 import json
+import logging
+import re
 import os
+import sys
 from openai import OpenAI # Import the class directly
 import traceback # Added for better error printing in main
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 # Attempt to import Submission model - ensure Django is configured
 # if this script runs standalone or called from specific management commands.
 try:
-    from groups.models import Submission
+    from groups.models import Assignment, Submission
 except ImportError as e:
     # Handle cases where Django models aren't ready or this script
     # runs outside a Django context where models are needed.
-    print(f"Warning: Could not import Submission model: {e}. Ensure Django is set up if models are needed.")
+    logger.warning("Could not import Submission model: %s. Ensure Django is set up if models are needed.", e)
+    Assignment = None
     Submission = None
 
+# Shared content cache lives with the FastAPI extraction service so both processes
+# use the same cache keys/format (backend-fastapi/ is not a package, so add it to the path).
+# The backend root is added too so lib.* imports work when this file runs as a script.
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+FASTAPI_SERVICE_DIR = os.path.join(BACKEND_DIR, 'backend-fastapi')
+for _path in (BACKEND_DIR, FASTAPI_SERVICE_DIR):
+    if _path not in sys.path:
+        sys.path.append(_path)
+import prompt_builder
+from content_cache import sha256_bytes, sha256_file, get_cached_extraction, cache_extraction
+from lib import llm_cache, service_clients
+from lib.checkpoints import NO_CHECKPOINTS, RunCheckpoints
+from lib.grading_runs import record_grading_run
+from lib.pipeline import Stage, StageGraph
+from lib.rate_limiter import RateLimitTimeout
+from structured_logging import SAMPLED, payload, setup_logging
+
 # --- Configuration ---
 # Use environment variables for URLs if possible for flexibility
 PDFPARSE_URL = os.getenv("PDFPARSE_URL", "http://host.docker.internal:3000/api/pdfparse") # Assumes your FastAPI service is at :3000 and provides this route
@@ -21,7 +46,15 @@ PARSE_RUBRIC_URL = os.getenv("PARSE_RUBRIC_URL", "http://host.docker.internal:30
 SCORE_ESSAY_URL = os.getenv("SCORE_ESSAY_URL", "http://host.docker.internal:3000/api/huggingface")
 
 REQUEST_TIMEOUT = 180 # Increased timeout for potentially longer LLM calls
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") # Get API Key once
+# Max GPT trait-scoring calls in flight per pipeline run (1 = score traits one at a time)
+TRAIT_SCORING_CONCURRENCY = int(os.getenv("TRAIT_SCORING_CONCURRENCY", "4"))
+# "per_trait": one GPT call per trait (default). "structured": one JSON-schema call scoring all traits.
+GRADING_SCORING_MODE = os.getenv("GRADING_SCORING_MODE", "per_trait")
+
+
+class ServiceError(Exception):
+    """A downstream service could not be reached or kept failing; worth retrying later."""
+
 
 # --- Helper for combining scores ---
 def validate_score(flan: float, gpt: int, gpt_reasoning_or_feedback: str) -> tuple[int, str]:
@@ -48,65 +81,74 @@ def validate_score(flan: float, gpt: int, gpt_reasoning_or_feedback: str) -> tup
         return gpt, f"⚠️ Overridden by GPT. (Flan: {flan:.1f} ({flan_int}), GPT: {gpt}). Reason Preview: {reason_preview}..."
 
 # ---- Scale to 0–100 final grade ----
-def scale_to_100(trait_scores: list, max_possible_score_per_trait: float) -> float:
+def scale_to_100(trait_scores: list, max_scores: list) -> float:
     """
-    Calculates the average of trait scores and scales it to 0-100.
+    Calculates the total of trait scores as a share of the total possible and scales it to 0-100.
     Args:
         trait_scores: List of final numeric scores for each trait.
-        max_possible_score_per_trait: The maximum possible score for a single trait (e.g., 3.0).
+        max_scores: The maximum possible score of each trait, in the same order (e.g., [3, 3, 4]).
     Returns:
         Scaled score (float) out of 100, rounded to 1 decimal place.
     """
     # Ensure trait_scores are numbers (could be integers or floats after averaging)
-    numeric_scores = [float(s) for s in trait_scores if s is not None] # Filter out potential Nones
-    if not numeric_scores or max_possible_score_per_trait <= 0:
+    scored = [(float(s), float(m)) for s, m in zip(trait_scores, max_scores) if s is not None] # Filter out potential Nones
+    total_possible = sum(m for _, m in scored)
+    if not scored or total_possible <= 0:
          return 0.0 # Avoid division by zero or invalid states
 
-    avg_score = sum(numeric_scores) / len(numeric_scores) # Average score, potentially float
     # Scale to 100
-    return round((avg_score / max_possible_score_per_trait) * 100, 1)
+    return round((sum(s for s, _ in scored) / total_possible) * 100, 1)
+
+# Static part of every per-trait scoring prompt (sent first, as the system message)
+TRAIT_SCORING_INSTRUCTIONS = """You are an AI teaching assistant evaluating a student's essay based on a specific rubric trait.
+
+Instructions for AI Assistant:
+1. Carefully read the Rubric Definition for the trait being assessed (given after the essay).
+2. Analyze the provided Student's Essay based *only* on that definition.
+3. Write constructive feedback for the student about their performance on that trait. Explain *why* they received the score you are about to give, referencing the rubric criteria. If possible, mention specific examples or general areas in their writing that demonstrate strengths or weaknesses related to this trait. Use a helpful, encouraging, and teacher-like tone. Aim for 2-4 sentences of feedback.
+4. After writing the feedback, clearly state the final integer score (within the Score Range given after the essay) for this trait based *strictly* on the rubric. The score must be the absolute last part of your response, with no other text or punctuation following it. Example ending: "...improve this aspect.\n2"
+"""
 
 # ==============================================================================
 # --- MODIFIED FUNCTION: get_gpt_trait_score ---
 # ==============================================================================
-def get_gpt_trait_score(client: OpenAI, trait_name: str, trait_def: str, essay_text: str) -> tuple[int | None, str]:
+def get_gpt_trait_score(client: OpenAI, trait_name: str, trait_def: str, essay_text: str, max_score: int = None,
+                        use_cache: bool = True) -> tuple[int | None, str]:
     """
-    Uses OpenAI to score a single trait and generate constructive feedback.
+    Uses OpenAI to score a single trait (from 0 to max_score, by default the
+    highest level in trait_def) and generate constructive feedback.
     Returns (score, constructive_feedback_string). Score is None if parsing fails.
     Parses the score robustly by looking backwards for the first number.
+    Identical requests are answered from the LLM cache unless use_cache is False.
     """
     # --- MODIFIED PROMPT ---
     # Instruct the AI to act as a teaching assistant and provide constructive feedback
     # based *only* on the rubric, mentioning essay parts if relevant, THEN give the score.
-    prompt = f"""You are an AI teaching assistant evaluating a student's essay based on a specific rubric trait.
-
-Trait Being Assessed: {trait_name}
-
-Rubric Definition for '{trait_name}':
-{trait_def}
-
-Student's Essay Text (relevant portion):
----
-{essay_text[:2500]} # Provide sufficient context
----
-
-Instructions for AI Assistant:
-1. Carefully read the Rubric Definition for '{trait_name}'.
-2. Analyze the provided Student's Essay Text based *only* on that definition.
-3. Write constructive feedback for the student about their performance on the '{trait_name}' trait. Explain *why* they received the score you are about to give, referencing the rubric criteria. If possible, mention specific examples or general areas in their writing that demonstrate strengths or weaknesses related to this trait. Use a helpful, encouraging, and teacher-like tone. Aim for 2-4 sentences of feedback.
-4. After writing the feedback, clearly state the final integer score (from 0 to 3) for this trait based *strictly* on the rubric. The score must be the absolute last part of your response, with no other text or punctuation following it. Example ending: "...improve this aspect.\n3"
-
-Constructive Feedback and Final Score:"""
+    # The instructions and essay come first and are identical for every trait of this
+    # essay, so the provider's prompt cache covers them; only the trait section varies.
+    if max_score is None:
+        max_score = trait_max_score(trait_def)
+    messages = prompt_builder.compile_prompt(
+        TRAIT_SCORING_INSTRUCTIONS,
+        shared=[("Student's Essay", prompt_builder.normalize_extracted_text(essay_text))],
+        varying=[
+            ("Trait Being Assessed", trait_name),
+            (f"Rubric Definition for '{trait_name}'", trait_def),
+            ("Score Range", f"0 to {max_score}"),
+            ("Constructive Feedback and Final Score", ""),
+        ],
+        trim="Student's Essay",
+    )
     # --- END MODIFIED PROMPT ---
 
     try:
-        completion = client.chat.completions.create(
+        request = dict(
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+            messages=messages,
             temperature=0.1 # Keep low for consistency, slight increase for natural language
         )
-        full_response_content = completion.choices[0].message.content.strip()
-        print(f"DEBUG: Raw GPT response for trait '{trait_name}': {full_response_content}")
+        full_response_content = llm_cache.chat_completion_content(client, use_cache=use_cache, **request).strip()
+        logger.debug("Raw GPT response for trait '%s': %s", trait_name, payload(full_response_content), extra=SAMPLED)
 
         score = None
         feedback_text = full_response_content # Default feedback is the whole response initially
@@ -122,45 +164,41 @@ Constructive Feedback and Final Score:"""
             if cleaned_token.isdigit(): # Check if the *cleaned* token is purely digits
                 try:
                     potential_score = int(cleaned_token)
-                    if 0 <= potential_score <= 3: # Check if score is in valid range
+                    if 0 <= potential_score <= max_score: # Check if score is in valid range
                         # Perform a quick check to ensure it's likely the intended score at the end
                         # If the original token had non-digit chars, it might be embedded (e.g., "section_3")
                         # We rely heavily on the prompt asking for score *last*.
                         if token == cleaned_token: # Only consider if the original token was *just* the number
                             score = potential_score
-                            print(f"DEBUG: Parsed score '{score}' from token '{token}'")
                             # Extract the feedback part (everything before the score token)
                             feedback_text = " ".join(split_response[:i]).strip()
                             # Clean up potential trailing noise before the number
                             feedback_text = feedback_text.rstrip('.,;:!?()[]{}<>\n\t ')
                             found_score = True
                             break # Found the last valid number in range
-                        else:
-                            print(f"DEBUG: Token '{token}' contains digits yielding '{cleaned_token}', but original token differs. Likely embedded, continuing search.")
-
-                    else:
-                        print(f"DEBUG: Token '{token}' yielded number {potential_score} but outside expected range [0-3]. Continuing search.")
+                        # else: digits embedded in a longer token (e.g. "section_3"), keep searching
                 except ValueError:
                      # Should not happen if cleaned_token.isdigit() is true, but for safety
-                     print(f"DEBUG: Token '{token}' (cleaned: '{cleaned_token}') failed int conversion unexpectedly. Continuing search.")
                      continue
             # Stop searching if we encounter common text patterns unlikely to precede final score
             if token.lower() in ["feedback:", "score:", "trait:", "rubric:"]:
-                 print(f"DEBUG: Encountered indicative text token '{token}'. Stopping reverse search for score.")
                  break
 
         if not found_score:
-            print(f"ERROR: Could not parse valid GPT score (0-3) reliably from the end of the response for trait '{trait_name}'. Raw content: {full_response_content}")
+            logger.error("Could not parse a valid GPT score (0-%d) from the end of the response for trait '%s'. Raw content: %s",
+                         max_score, trait_name, payload(full_response_content))
+            llm_cache.discard(**request) # Ask again next time instead of replaying this answer
             # Return None for score to indicate failure, but keep the text
             return None, f"Error: Could not automatically extract score. Raw AI response: {full_response_content}"
 
 
         # Return the found score and the extracted constructive feedback string
-        print(f"DEBUG: Extracted Feedback for '{trait_name}': {feedback_text[:200]}...")
         return score, feedback_text
 
+    except RateLimitTimeout:
+        raise # Out of OpenAI capacity: fail the run so it is retried, rather than storing a missing score
     except Exception as e:
-        print(f"ERROR: An error occurred during the OpenAI API call for trait '{trait_name}': {e}")
+        logger.error("OpenAI API call failed for trait '%s': %s", trait_name, e)
         # Return None for score and an error message as feedback
         return None, f"Error during OpenAI API call: {e}"
 
@@ -169,324 +207,755 @@ Constructive Feedback and Final Score:"""
 # ==============================================================================
 
 
-# --- Main Grading Function ---
-
-def trigger_auto_grading_pipeline(submission, rubric_path, essay_path):
-    """
-    Executes the full auto-grading pipeline for a given submission.
+# --- Structured (single-call) multi-trait scoring ---
+STRUCTURED_SCORING_INSTRUCTIONS = """You are an AI teaching assistant evaluating a student's essay against every trait of a rubric.
 
-    Args:
-        submission: The Submission model instance (or relevant identifier).
-        rubric_path (str): Absolute path to the rubric PDF file inside the container.
-        essay_path (str): Absolute path to the essay PDF file inside the container.
+Instructions for AI Assistant:
+For EACH rubric trait, analyze the essay based *only* on that trait's rubric definition and return:
+- "feedback": constructive feedback for the student explaining *why* they received the score, referencing the rubric criteria and, if possible, specific strengths or weaknesses in their writing. Use a helpful, encouraging, and teacher-like tone. Aim for 2-4 sentences.
+- "score": the integer score (from 0 to the trait's Maximum Score) for the trait based *strictly* on the rubric definition."""
 
-    Raises:
-        Exception: If any critical step in the pipeline fails.
+def get_gpt_structured_scores(client: OpenAI, traits: list[dict], essay_text: str, use_cache: bool = True) -> dict[str, tuple[int | None, str]]:
     """
-    global OPENAI_API_KEY # Access the global API key variable
-
-    if not OPENAI_API_KEY:
-        raise RuntimeError("CRITICAL: Missing OPENAI_API_KEY in environment variables. Grading cannot proceed.")
-    # Initialize OpenAI client here, once API key is confirmed
-    client = OpenAI(api_key=OPENAI_API_KEY, timeout=REQUEST_TIMEOUT) # Use increased timeout
-
+    Scores every trait in one OpenAI call. The response is constrained by a JSON
+    schema to {trait name: {"feedback": str, "score": int}}, each score within the
+    trait's own max_score, so no text parsing is needed.
+    Returns {trait name: (score, constructive_feedback)}; on failure every trait gets
+    (None, error message), matching get_gpt_trait_score's failure shape.
+    """
+    trait_names = [trait["name"] for trait in traits]
+    schema = {
+        "type": "object",
+        "properties": {
+            trait["name"]: {
+                "type": "object",
+                "properties": {
+                    "feedback": {"type": "string"},
+                    "score": {"type": "integer", "enum": list(range(rubric_trait_max_score(trait) + 1))},
+                },
+                "required": ["feedback", "score"],
+                "additionalProperties": False,
+            }
+            for trait in traits
+        },
+        "required": trait_names,
+        "additionalProperties": False,
+    }
+    rubric_section = "\n\n".join(
+        f"Trait: {trait['name']}\nMaximum Score: {rubric_trait_max_score(trait)}\nRubric Definition:\n{trait['definition']}"
+        for trait in traits
+    )
+    # Instructions and rubric are the same for every essay of the assignment, so they
+    # form the cacheable prefix; the essay goes last.
+    messages = prompt_builder.compile_prompt(
+        STRUCTURED_SCORING_INSTRUCTIONS,
+        shared=[("Rubric Traits", rubric_section)],
+        varying=[("Student's Essay", prompt_builder.normalize_extracted_text(essay_text))],
+        trim="Student's Essay",
+    )
 
-    if Submission is None and isinstance(submission, int):
-         print(f"Warning: Submission model not imported. Received submission ID: {submission}")
-         # Add logic here if needed (e.g., fetch submission by ID), or raise if instance is required.
+    try:
+        request = dict(
+            model="gpt-4o-mini",
+            messages=messages,
+            temperature=0.1,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "trait_scores", "strict": True, "schema": schema},
+            },
+        )
+        content = llm_cache.chat_completion_content(client, use_cache=use_cache, **request)
+        logger.debug("Raw structured GPT response: %s", payload(content), extra=SAMPLED)
+        try:
+            scored = json.loads(content)
+        except json.JSONDecodeError:
+            llm_cache.discard(**request)
+            raise
+        results = {}
+        for name in trait_names:
+            item = scored.get(name)
+            if not isinstance(item, dict) or not isinstance(item.get("score"), int):
+                results[name] = (None, f"Error: Structured response missing score for this trait. Raw AI response: {content}")
+                continue
+            results[name] = (item["score"], str(item.get("feedback", "")).strip())
+        if any(score is None for score, _ in results.values()):
+            llm_cache.discard(**request)
+        return results
+    except RateLimitTimeout:
+        raise
+    except Exception as e:
+        logger.error("Structured OpenAI API call failed: %s", e)
+        return {name: (None, f"Error during OpenAI API call: {e}") for name in trait_names}
 
-    print(f"Starting auto-grading for submission linked to essay: {essay_path}")
 
-    # --- Step 1: Parse Essay PDF ---
-    print(f"Parsing essay PDF from: {essay_path}")
-    essay_text = "" # Initialize essay_text
+# --- Per-trait GPT scoring + combination ---
+def combine_trait_score(client: OpenAI, name: str, flan_val: float, trait_def: str, essay_text: str,
+                        max_score: int, gpt_result: tuple[int | None, str] | None = None,
+                        use_cache: bool = True) -> dict:
+    """
+    Gets the GPT score/feedback for one trait and combines it with the Flan score.
+    Returns the trait's combined_scores_data entry (with the trait's max_score); "score" is None if scoring failed.
+    gpt_result skips the per-trait GPT call when the score was already obtained
+    (structured scoring mode). Safe to run from worker threads (the OpenAI client is thread-safe).
+    """
     try:
-        with open(essay_path, "rb") as ef:
-            essay_response = requests.post(
-                PDFPARSE_URL,
-                files={"file": ("essay.pdf", ef, "application/pdf")},
-                timeout=REQUEST_TIMEOUT
-            )
-            essay_response.raise_for_status()
-        essay_data = essay_response.json()
-        essay_text = (
-            essay_data.get("extracted_text")
-            or essay_data.get("text")
-            or essay_data.get("generic_text")
-            or ""
-        ).strip()
-        print(f"Essay parsed. Text length: {len(essay_text)}. Preview: {essay_text[:150].replace(os.linesep, ' ')}...")
-        if not essay_text:
-            raise ValueError("Essay parsing returned empty text.")
-    except FileNotFoundError:
-        print(f"ERROR: Essay file not found at {essay_path}")
-        raise Exception(f"Essay file not found: {essay_path}")
-    except requests.exceptions.RequestException as e:
-        print(f"ERROR: Failed to connect/communicate with PDF parsing service for essay: {e}")
-        raise Exception(f"Essay PDF parsing service failed: {e}")
-    except (json.JSONDecodeError, ValueError) as e:
-        print(f"ERROR: Failed to parse response or get text from essay parsing service: {e}")
-        raise Exception(f"Invalid response/empty text from essay parsing service: {e}")
+         # Get GPT score (int | None) and CONSTRUCTIVE FEEDBACK (string)
+         if gpt_result is None:
+             gpt_result = get_gpt_trait_score(client, name, trait_def, essay_text, max_score, use_cache=use_cache)
+         gpt_val, gpt_constructive_feedback = gpt_result
+
+         # Check if GPT scoring failed (returned None score)
+         if gpt_val is None:
+             logger.error("GPT failed to provide a score for trait '%s'. Skipping combination for this trait.", name)
+             # Store error info if needed, but don't proceed with validation/averaging
+             return {
+                "trait": name,
+                "score": None, # Indicate score failure
+                "max_score": max_score,
+                "comment": "GPT scoring failed.", # Internal comment
+                "percent": None,
+                "student_feedback": gpt_constructive_feedback # Store the error message from GPT function
+             }
+
+         # --- Score Combination ---
+         # Combine scores using the validation logic. Pass the constructive feedback
+         # as the 'reason' argument for context in case of override logging.
+         final_val, internal_comment = validate_score(flan_val, gpt_val, gpt_constructive_feedback)
+
+         # Calculate percentage for this specific trait
+         percent = round((final_val / max_score) * 100, 1) if max_score > 0 else 0
+         logger.debug("Trait '%s': combined score %s (%s%%). Internal logic: %s", name, final_val, percent, internal_comment)
+
+         return {
+            "trait": name,
+            "score": final_val,           # The final combined score (int or float)
+            "max_score": max_score,       # Highest score level of the trait's rubric definition
+            "comment": internal_comment,  # Internal status/reason (NOT FOR STUDENT)
+            "percent": percent,           # Trait percentage
+            "student_feedback": gpt_constructive_feedback # The teacher-like feedback FOR STUDENT
+         }
+
+    except RateLimitTimeout:
+         raise
     except Exception as e:
-        print(f"ERROR: Unexpected error during essay parsing: {e}")
-        raise
+         # Catch any other unexpected errors during GPT scoring or validation for this trait
+         logger.exception("Unexpected error processing trait '%s'", name)
+         # Store error info for this trait
+         return {
+                "trait": name,
+                "score": None,
+                "max_score": max_score,
+                "comment": f"Unexpected error: {e}",
+                "percent": None,
+                "student_feedback": f"An unexpected error occurred while generating feedback for this trait: {e}"
+         }
+
+
+# --- PDF text extraction (through the PDF parsing service, cached by content hash) ---
+def parse_pdf(pdf_bytes: bytes, upload_name: str) -> dict:
+    """
+    Returns the PDF parsing service's JSON for these bytes. Results are cached by
+    the SHA-256 of the PDF, so an identical file (e.g. the same rubric for every
+    submission) is only ever extracted once.
+    Raises requests exceptions / ValueError like a direct service call would.
+    """
+    content_sha256 = sha256_bytes(pdf_bytes)
+    cached = get_cached_extraction(content_sha256)
+    if cached is not None:
+        logger.info("Extraction cache hit for '%s' (%.12s).", upload_name, content_sha256)
+        return cached
+
+    response = service_clients.post(
+        "pdfparse",
+        PDFPARSE_URL,
+        files={"file": (upload_name, pdf_bytes, "application/pdf")},
+        timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    text = data.get("extracted_text") or data.get("text") or data.get("generic_text") or ""
+    cache_extraction(content_sha256, {"generic_text": text, "generic_tables": data.get("generic_tables", [])})
+    return data
+
+
+# --- Rubric trait parsing (Steps 2 & 3 of the pipeline) ---
+DEFAULT_TRAIT_MAX_SCORE = 3
+
+def trait_max_score(definition: str) -> int:
+    """Highest score level in a trait definition ("3 = Excellent...\n2 = ..."), defaulting to 3."""
+    levels = [int(m) for m in re.findall(r"^\s*(\d+)\s*=", definition, flags=re.MULTILINE)]
+    return max(levels) if levels else DEFAULT_TRAIT_MAX_SCORE
+
+
+def rubric_trait_max_score(trait: dict) -> int:
+    """
+    The max_score of a parsed trait or a combined trait score. Entries stored before
+    it was recorded fall back to their definition's levels, or the default.
+    """
+    return trait.get("max_score") or trait_max_score(trait.get("definition", ""))
 
+
+def derive_rubric_traits(rubric_path: str, use_cache: bool = True) -> list[dict]:
+    """
+    Extracts the rubric PDF's text and asks the trait parsing service for its traits.
+    Returns [{"name", "definition", "max_score"}, ...]. Raises if either step fails.
+    The service's (LLM-generated) answer is cached by rubric text unless use_cache is False.
+    """
     # --- Step 2: Parse Rubric PDF ---
-    print(f"Parsing rubric PDF from: {rubric_path}")
+    logger.info("Parsing rubric PDF from: %s", rubric_path)
     rubric_text = "" # Initialize rubric_text
     try:
         with open(rubric_path, "rb") as rf:
-            rubric_parse_response = requests.post(
-                PDFPARSE_URL,
-                files={"file": ("rubric.pdf", rf, "application/pdf")},
-                timeout=REQUEST_TIMEOUT
-            )
-            rubric_parse_response.raise_for_status()
-        rubric_text_data = rubric_parse_response.json()
+            rubric_bytes = rf.read()
+        rubric_text_data = parse_pdf(rubric_bytes, "rubric.pdf")
         rubric_text = (
             rubric_text_data.get("extracted_text")
             or rubric_text_data.get("text")
             or rubric_text_data.get("generic_text")
             or ""
         ).strip()
-        print(f"Rubric parsed. Text length: {len(rubric_text)}. Preview: {rubric_text[:150].replace(os.linesep, ' ')}...")
+        logger.info("Rubric parsed. Text length: %d.", len(rubric_text))
+        logger.debug("Rubric text: %s", payload(rubric_text, 150), extra=SAMPLED)
         if not rubric_text:
              raise ValueError("Rubric parsing returned empty text.")
     except FileNotFoundError:
-        print(f"ERROR: Rubric file not found at {rubric_path}")
+        logger.error("Rubric file not found at %s", rubric_path)
         raise Exception(f"Rubric file not found: {rubric_path}")
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: Failed to connect/communicate with PDF parsing service for rubric: {e}")
-        raise Exception(f"Rubric PDF parsing service failed: {e}")
+        logger.error("Failed to connect/communicate with PDF parsing service for rubric: %s", e)
+        raise ServiceError(f"Rubric PDF parsing service failed: {e}")
     except (json.JSONDecodeError, ValueError) as e:
-        print(f"ERROR: Failed to parse response or get text from rubric parsing service: {e}")
+        logger.error("Failed to parse response or get text from rubric parsing service: %s", e)
         raise Exception(f"Invalid response/empty text from rubric parsing service: {e}")
     except Exception as e:
-        print(f"ERROR: Unexpected error during rubric parsing: {e}")
+        logger.error("Unexpected error during rubric parsing: %s", e)
         raise
 
     # --- Step 3: Parse Rubric Traits (using external service) ---
-    print(f"Sending rubric text (length: {len(rubric_text)}) to trait parsing API: {PARSE_RUBRIC_URL}")
+    logger.info("Sending rubric text (length: %d) to trait parsing API: %s", len(rubric_text), PARSE_RUBRIC_URL)
     traits = [] # Initialize traits
     try:
-        rubric_response = requests.post(
-            PARSE_RUBRIC_URL,
-            json={"rubricText": rubric_text},
-            headers={"Content-Type": "application/json"},
-            timeout=REQUEST_TIMEOUT
-        )
-        rubric_response.raise_for_status()
-        print(f"Trait parsing API returned status: {rubric_response.status_code}. Response preview: {rubric_response.text[:300]}...")
-        rubric_data = rubric_response.json()
+        def request_traits() -> str:
+            rubric_response = service_clients.post(
+                "parse_rubric",
+                PARSE_RUBRIC_URL,
+                json={"rubricText": rubric_text},
+                headers={"Content-Type": "application/json"},
+                timeout=REQUEST_TIMEOUT
+            )
+            rubric_response.raise_for_status()
+            logger.debug("Trait parsing API response: %s", payload(rubric_response.text, 300), extra=SAMPLED)
+            rubric_response.json() # Only valid JSON is cached
+            return rubric_response.text
+
+        cache_key = llm_cache.fingerprint(PARSE_RUBRIC_URL, [{"role": "user", "content": rubric_text}])
+        rubric_data = json.loads(llm_cache.cached_response(cache_key, request_traits, use_cache=use_cache))
         if not isinstance(rubric_data, dict) or not rubric_data:
              raise ValueError("Trait parsing service returned invalid or empty data.")
         for name, definition in rubric_data.items():
+            definition = str(definition).strip()
             traits.append({
                 "name": str(name).strip(),
-                "definition": str(definition).strip()
+                "definition": definition,
+                "max_score": trait_max_score(definition)
             })
         if not traits:
             raise ValueError("No traits could be parsed from the rubric data.")
-        print(f"Rubric traits parsed successfully ({len(traits)} traits):")
-        for trait in traits[:3]: print(f" - {trait['name']}: {trait['definition'][:100]}...")
-        if len(traits) > 3: print("  ...")
-        print(f"Parsed trait names: {[trait['name'] for trait in traits]}")
+        logger.info("Rubric traits parsed successfully (%d traits): %s", len(traits), [trait["name"] for trait in traits])
     except requests.exceptions.RequestException as e:
-        print(f"ERROR: Failed to connect/communicate with trait parsing service: {e}")
-        raise Exception(f"Rubric trait parsing service failed: {e}")
+        logger.error("Failed to connect/communicate with trait parsing service: %s", e)
+        raise ServiceError(f"Rubric trait parsing service failed: {e}")
     except (json.JSONDecodeError, ValueError) as e:
-        print(f"ERROR: Failed to parse response or get valid traits from trait parsing service: {e}")
+        logger.error("Failed to parse response or get valid traits from trait parsing service: %s", e)
         raise Exception(f"Invalid response from trait parsing service: {e}")
     except Exception as e:
-        print(f"ERROR: Unexpected error during rubric trait parsing: {e}")
+        logger.error("Unexpected error during rubric trait parsing: %s", e)
         raise
 
+    return traits
+
+
+def ensure_rubric_traits(assignment, use_cache: bool = True) -> list[dict]:
+    """
+    Returns the assignment's parsed rubric traits, deriving and persisting them
+    only when the rubric file's content differs from the one they were parsed from.
+    """
+    rubric_path = assignment.rubric_file.path
+    try:
+        rubric_sha256 = sha256_file(rubric_path)
+    except FileNotFoundError:
+        logger.error("Rubric file not found at %s", rubric_path)
+        raise Exception(f"Rubric file not found: {rubric_path}")
+    if assignment.rubric_traits and assignment.rubric_sha256 == rubric_sha256:
+        return assignment.rubric_traits
 
-    # --- Step 4: Score Essay with HuggingFace Model (using external service) ---
-    # Proceed only if traits were successfully parsed
+    # Serialize derivation per assignment across workers, so a burst of submissions
+    # for a freshly uploaded rubric pays for the trait parsing call once.
+    lock = None
+    acquired = True
+    try:
+        from lib.grading_queue import get_redis
+        lock = get_redis().lock(f"rubric-traits:{assignment.pk}", timeout=REQUEST_TIMEOUT * 2, blocking_timeout=REQUEST_TIMEOUT * 2)
+        acquired = lock.acquire()
+    except Exception as e:
+        logger.warning("Could not take rubric parsing lock for assignment %s: %s", assignment.pk, e)
+        lock = None
+    try:
+        assignment.refresh_from_db(fields=["rubric_traits", "rubric_sha256"])
+        if assignment.rubric_traits and assignment.rubric_sha256 == rubric_sha256:
+            return assignment.rubric_traits
+        if not acquired:
+            # Another worker is still parsing this rubric; don't race it with a second call
+            logger.error("Timed out waiting for another worker to parse the rubric of assignment %s.", assignment.pk)
+            raise ServiceError(f"Timed out waiting for the rubric traits of assignment {assignment.pk}")
+
+        logger.info("Rubric for assignment %s is new or changed (%.12s). Parsing traits...", assignment.pk, rubric_sha256)
+        traits = derive_rubric_traits(rubric_path, use_cache=use_cache)
+        assignment.rubric_traits = traits
+        assignment.rubric_sha256 = rubric_sha256
+        assignment.save(update_fields=["rubric_traits", "rubric_sha256"])
+        return traits
+    finally:
+        if lock is not None and acquired:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+# --- Fingerprints (skip regrading unchanged resubmissions) ---
+def text_sha256(text: str) -> str:
+    """SHA-256 of essay text with whitespace normalized, so re-exported PDFs of the same essay match."""
+    return sha256_bytes(" ".join(text.split()).encode("utf-8"))
+
+
+def find_prior_grading(rubric_sha256: str, content_sha256: str = None, text_sha256: str = None, exclude_id=None):
+    """
+    Returns an AI-graded Submission whose essay has the same content or text fingerprint
+    and which was graded against the same rubric version, or None.
+    Its trait_scores / ai_grade / feedback can be reused instead of calling the models again.
+    """
+    if Submission is None or not rubric_sha256 or not (content_sha256 or text_sha256):
+        return None
+    from django.db.models import Q
+    match = Q()
+    if content_sha256:
+        match |= Q(content_sha256=content_sha256)
+    if text_sha256:
+        match |= Q(text_sha256=text_sha256)
+    candidates = Submission.objects.filter(
+        match,
+        graded_rubric_sha256=rubric_sha256,
+        graded_by_ai=True,
+        ai_grade__isnull=False,
+        trait_scores__isnull=False,
+    )
+    if exclude_id is not None:
+        candidates = candidates.exclude(id=exclude_id)
+    return candidates.order_by("-submission_date").first()
+
+
+# --- Grading pipeline stages ---
+# Each stage takes its declared inputs as keyword arguments and returns its output,
+# which later stages receive under the stage's name (see lib/pipeline.py).
+# ---
+
+# Timeouts/retries per stage. Network stages retry on ServiceError / timeouts only;
+# HTTP-level 429/5xx retries already happen inside lib/service_clients.
+STAGE_TIMEOUT = REQUEST_TIMEOUT + 30
+STAGE_RETRIES = int(os.getenv("GRADING_STAGE_RETRIES", "1"))
+
+
+def essay_text_stage(essay_path, checkpoints=None):
+    """Step 1: Parse Essay PDF (reused from the run's checkpoint while the file is unchanged)."""
+    checkpoints = checkpoints or NO_CHECKPOINTS
+    try:
+        essay_sha256 = sha256_file(essay_path)
+    except FileNotFoundError:
+        essay_sha256 = None # parse_essay_text reports the missing file
+    return checkpoints.remember("essay_text", essay_sha256, lambda: parse_essay_text(essay_path))
+
+
+def parse_essay_text(essay_path):
+    logger.info("Parsing essay PDF from: %s", essay_path)
+    essay_text = "" # Initialize essay_text
+    try:
+        with open(essay_path, "rb") as ef:
+            essay_bytes = ef.read()
+        essay_data = parse_pdf(essay_bytes, "essay.pdf")
+        essay_text = (
+            essay_data.get("extracted_text")
+            or essay_data.get("text")
+            or essay_data.get("generic_text")
+            or ""
+        ).strip()
+        logger.info("Essay parsed. Text length: %d.", len(essay_text))
+        logger.debug("Essay text: %s", payload(essay_text, 150), extra=SAMPLED)
+        if not essay_text:
+            raise ValueError("Essay parsing returned empty text.")
+    except FileNotFoundError:
+        logger.error("Essay file not found at %s", essay_path)
+        raise Exception(f"Essay file not found: {essay_path}")
+    except requests.exceptions.RequestException as e:
+        logger.error("Failed to connect/communicate with PDF parsing service for essay: %s", e)
+        raise ServiceError(f"Essay PDF parsing service failed: {e}")
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error("Failed to parse response or get text from essay parsing service: %s", e)
+        raise Exception(f"Invalid response/empty text from essay parsing service: {e}")
+    except Exception as e:
+        logger.error("Unexpected error during essay parsing: %s", e)
+        raise
+    return essay_text
+
+
+def traits_stage(submission, rubric_path, preparsed_traits, use_llm_cache=True, checkpoints=None):
+    """Steps 2 & 3: Rubric Traits (parsed once per rubric file, then reused)."""
+    if preparsed_traits is not None:
+        logger.info("Using %d pre-parsed rubric traits: %s", len(preparsed_traits), [trait["name"] for trait in preparsed_traits])
+        return preparsed_traits
+    checkpoints = checkpoints or NO_CHECKPOINTS
+    try:
+        rubric_sha256 = sha256_file(rubric_path)
+    except FileNotFoundError:
+        rubric_sha256 = None
+    assignment = getattr(submission, "assignment", None)
+    if Submission is not None and hasattr(assignment, "rubric_traits"):
+        traits = checkpoints.remember("traits", rubric_sha256, lambda: ensure_rubric_traits(assignment, use_cache=use_llm_cache))
+    else:
+        traits = checkpoints.remember("traits", rubric_sha256, lambda: derive_rubric_traits(rubric_path, use_cache=use_llm_cache))
+    if not traits:
+        logger.error("No traits were parsed, skipping scoring.")
+        raise Exception("Pipeline halted: No rubric traits available.")
+    return traits
+
+
+def fingerprints_stage(essay_path, rubric_path, essay_text):
+    """Step 1.5: Fingerprint the essay (bytes and text) and the rubric it is graded against."""
+    try:
+        rubric_sha256 = sha256_file(rubric_path)
+    except FileNotFoundError:
+        rubric_sha256 = None # The traits stage reports the missing rubric
+    return {
+        "content_sha256": sha256_file(essay_path),
+        "text_sha256": text_sha256(essay_text),
+        "rubric_sha256": rubric_sha256,
+    }
+
+
+def prior_grading_stage(submission, fingerprints):
+    """
+    Step 1.6: Look for an earlier grading of the same essay text against the same rubric.
+    Returns its trait_scores (then the model calls are skipped), or None.
+    """
+    try:
+        prior = find_prior_grading(
+            fingerprints["rubric_sha256"],
+            text_sha256=fingerprints["text_sha256"],
+            exclude_id=getattr(submission, "pk", None), # An explicit regrade of this submission re-runs the models
+        )
+    except Exception as e:
+        logger.warning("Could not look up prior gradings: %s", e)
+        return None
+    if prior is None:
+        return None
+    logger.info("Essay text matches submission %s graded against the same rubric. Reusing its trait scores.", prior.pk)
+    return prior.trait_scores
+
+
+def hf_scores_stage(essay_text, traits, prior_grading=None, checkpoints=None):
+    """Step 4: Score Essay with HuggingFace Model (reused from the run's checkpoint when resuming)."""
+    if prior_grading is not None:
+        return []
+    checkpoints = checkpoints or NO_CHECKPOINTS
+    return checkpoints.remember("hf_scores", (text_sha256(essay_text), traits), lambda: request_hf_scores(essay_text, traits))
+
+
+def request_hf_scores(essay_text, traits):
     hf_scores = [] # Initialize hf_scores
-    if traits and essay_text: # Ensure we have traits and essay text
-        print(f"Sending essay (length: {len(essay_text)}) and {len(traits)} traits to HF scoring API: {SCORE_ESSAY_URL}")
-        try:
-            score_response = requests.post(
-                SCORE_ESSAY_URL,
-                json={"essay": essay_text, "traits": traits},
-                headers={"Content-Type": "application/json"},
-                timeout=REQUEST_TIMEOUT
-            )
-            score_response.raise_for_status()
-            score_json = score_response.json()
-            if "scores" not in score_json or not isinstance(score_json["scores"], list):
-                print(f"ERROR: Scoring response missing valid 'scores' list: {score_json}")
-                raise ValueError("AI scores not returned properly from HF scoring service")
+    logger.info("Sending essay (length: %d) and %d traits to HF scoring API: %s", len(essay_text), len(traits), SCORE_ESSAY_URL)
+    try:
+        score_response = service_clients.post(
+            "score_essay",
+            SCORE_ESSAY_URL,
+            json={"essay": essay_text, "traits": traits},
+            headers={"Content-Type": "application/json"},
+            timeout=REQUEST_TIMEOUT
+        )
+        score_response.raise_for_status()
+        score_json = score_response.json()
+        if "scores" not in score_json or not isinstance(score_json["scores"], list):
+            logger.error("Scoring response missing valid 'scores' list: %s", payload(score_json))
+            raise ValueError("AI scores not returned properly from HF scoring service")
 
-            for s in score_json["scores"]:
-                try:
-                    trait_name = s.get("trait")
-                    score_value = s.get("score")
-                    if trait_name is not None and score_value is not None:
-                         hf_scores.append({"trait": str(trait_name), "score": float(score_value)})
-                    else:
-                         print(f"Warning: Skipping HF score entry due to missing data: {s}")
-                except (ValueError, TypeError) as score_ex:
-                    print(f"Warning: Could not parse HF score as float for entry {s}: {score_ex}")
-                    continue
-            print(f"HF scores collected ({len(hf_scores)} scores): {hf_scores}")
-            if not hf_scores:
-                 raise ValueError("No valid HuggingFace scores could be collected.")
-
-        except requests.exceptions.RequestException as e:
-            print(f"ERROR: Failed to connect/communicate with HF scoring service: {e}")
-            raise Exception(f"HF scoring service failed: {e}")
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"ERROR: Failed to parse response or get valid scores from HF scoring service: {e}")
-            raise Exception(f"Invalid response from HF scoring service: {e}")
-        except Exception as e:
-            print(f"ERROR: Unexpected error during HF scoring: {e}")
-            raise
+        for s in score_json["scores"]:
+            try:
+                trait_name = s.get("trait")
+                score_value = s.get("score")
+                if trait_name is not None and score_value is not None:
+                     hf_scores.append({"trait": str(trait_name), "score": float(score_value)})
+                else:
+                     logger.warning("Skipping HF score entry due to missing data: %s", s)
+            except (ValueError, TypeError) as score_ex:
+                logger.warning("Could not parse HF score as float for entry %s: %s", s, score_ex)
+                continue
+        logger.info("HF scores collected (%d scores).", len(hf_scores))
+        logger.debug("HF scores: %s", hf_scores)
+        if not hf_scores:
+             raise ValueError("No valid HuggingFace scores could be collected.")
+
+    except requests.exceptions.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status is None or status == 429 or status >= 500:
+            logger.error("HF scoring service failed: %s", e)
+            raise ServiceError(f"HF scoring service failed: {e}")
+        # The service rejected this essay (e.g. a trait's output had no numeric score); asking again gives the same answer
+        logger.error("HF scoring service could not score the essay (%s): %s", status, payload(e.response.text, 300))
+        raise Exception(f"HF scoring service could not score the essay: {e.response.text[:300]}")
+    except requests.exceptions.RequestException as e:
+        logger.error("Failed to connect/communicate with HF scoring service: %s", e)
+        raise ServiceError(f"HF scoring service failed: {e}")
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error("Failed to parse response or get valid scores from HF scoring service: %s", e)
+        raise Exception(f"Invalid response from HF scoring service: {e}")
+    except Exception as e:
+        logger.error("Unexpected error during HF scoring: %s", e)
+        raise
+    return hf_scores
 
-        # --- Step 4.5: Combine HF and GPT trait scores & Generate Feedback ---
-        print("Computing GPT scores/feedback for each trait and combining with HF scores...")
 
-        combined_scores_data = [] # Renamed to avoid confusion with hf_scores
-        trait_final_numeric_scores = [] # List to hold final scores (out of 3) for overall average
-        # --- IMPORTANT: Define Max Score Here ---
-        # This MUST match the scale used in your rubric and GPT prompt (e.g., 0-3)
-        max_possible_score_per_trait = 3.0
-        # ---
+def make_trait_scores_stage(scoring_mode: str = None):
+    """
+    Step 4.5: Combine HF and GPT trait scores & Generate Feedback.
+    Returns the stage function for a scoring mode ("per_trait" or "structured").
+    """
+    scoring_mode = scoring_mode or GRADING_SCORING_MODE
 
+    def trait_scores_stage(client, essay_text, traits, hf_scores, prior_grading=None, use_llm_cache=True,
+                           checkpoints=None, cancel_check=None):
+        if prior_grading is not None:
+            return prior_grading
+        # Each completed GPT answer is checkpointed, so a retried run only asks for the missing ones
+        checkpoints = checkpoints or NO_CHECKPOINTS
+        essay_sha256 = text_sha256(essay_text)
+
+        trait_jobs = []
         for entry in hf_scores:
             name = entry["trait"]
-            flan_val = entry["score"] # Float from HF
-
-            trait_def = next((t["definition"] for t in traits if t["name"] == name), None)
-            if trait_def is None:
-                 print(f"Warning: Could not find definition for trait '{name}'. Skipping GPT scoring & combination for this trait.")
+            trait = next((t for t in traits if t["name"] == name), None)
+            if trait is None:
+                 logger.warning("Could not find definition for trait '%s'. Skipping GPT scoring & combination for this trait.", name)
                  # Decide how to handle this: skip trait, use only HF score? Skipping is safer for now.
                  continue
-
-            try:
-                 # Get GPT score (int | None) and CONSTRUCTIVE FEEDBACK (string)
-                 gpt_val, gpt_constructive_feedback = get_gpt_trait_score(client, name, trait_def, essay_text)
-
-                 # Check if GPT scoring failed (returned None score)
-                 if gpt_val is None:
-                     print(f"ERROR: GPT failed to provide a score for trait '{name}'. Skipping combination for this trait.")
-                     # Store error info if needed, but don't proceed with validation/averaging
-                     combined_scores_data.append({
-                        "trait": name,
-                        "score": None, # Indicate score failure
-                        "comment": "GPT scoring failed.", # Internal comment
-                        "percent": None,
-                        "student_feedback": gpt_constructive_feedback # Store the error message from GPT function
-                     })
-                     continue # Skip to the next trait
-
-                 # --- Score Combination ---
-                 # Combine scores using the validation logic. Pass the constructive feedback
-                 # as the 'reason' argument for context in case of override logging.
-                 final_val, internal_comment = validate_score(flan_val, gpt_val, gpt_constructive_feedback)
-                 print(f"Combined trait score for '{name}': {final_val}. Internal logic: {internal_comment}")
-
-                 # Calculate percentage for this specific trait
-                 percent = round((final_val / max_possible_score_per_trait) * 100, 1) if max_possible_score_per_trait > 0 else 0
-
-                 combined_scores_data.append({
-                    "trait": name,
-                    "score": final_val,           # The final combined score (int or float)
-                    "comment": internal_comment,  # Internal status/reason (NOT FOR STUDENT)
-                    "percent": percent,           # Trait percentage
-                    "student_feedback": gpt_constructive_feedback # The teacher-like feedback FOR STUDENT
-                 })
-                 trait_final_numeric_scores.append(final_val) # Add the numeric score for final grade calculation
-
-                 print(f"Trait '{name}' percent (0–100): {percent}%")
-
-            except Exception as e:
-                 # Catch any other unexpected errors during GPT scoring or validation for this trait
-                 print(f"ERROR: Unexpected error processing trait '{name}'. Error: {e}")
-                 traceback.print_exc() # Print stack trace for debugging
-                 # Store error info for this trait
-                 combined_scores_data.append({
-                        "trait": name,
-                        "score": None,
-                        "comment": f"Unexpected error: {e}",
-                        "percent": None,
-                        "student_feedback": f"An unexpected error occurred while generating feedback for this trait: {e}"
-                 })
-                 continue # Continue to next trait
-
-        # --- Step 5: Calculate Final Normalized Score ---
-        if not trait_final_numeric_scores:
-             print("ERROR: No traits were successfully scored and combined. Cannot calculate final grade.")
-             # Set grade to 0 or specific error value? Setting to 0 for now.
-             normalized_score = 0.0
-             final_feedback = "Automated grading could not be completed because no rubric traits were successfully scored."
-             # Optionally raise Exception("Pipeline halted: No combined trait scores available.") if preferred
+            trait_jobs.append((name, entry["score"], trait["definition"], rubric_trait_max_score(trait)))
+
+        if scoring_mode == "structured" and trait_jobs:
+            # One call scores every trait; only the Flan/GPT combination runs per trait
+            logger.info("Scoring %d traits with a single structured GPT call...", len(trait_jobs))
+            scored_traits = [t for t in traits if any(t["name"] == job[0] for job in trait_jobs)]
+            if cancel_check is not None:
+                cancel_check()
+            gpt_results = checkpoints.remember(
+                "gpt_structured",
+                (essay_sha256, scored_traits),
+                lambda: get_gpt_structured_scores(client, scored_traits, essay_text, use_cache=use_llm_cache),
+                keep=lambda results: all(score is not None for score, _ in results.values()),
+            )
         else:
-            # Calculate final score using the list of combined numeric scores
-            normalized_score = scale_to_100(trait_final_numeric_scores, max_possible_score_per_trait)
-            print(f"List of final numeric trait scores (for averaging): {trait_final_numeric_scores}")
-            print(f"Normalized final score (0–100): {normalized_score}")
-
-            # --- Step 6: Compose Final Feedback and Persist Results ---
-            print("Composing final feedback message...")
-            feedback_parts = []
-            feedback_parts.append(f"Overall AI Assessed Grade: {normalized_score:.1f}%")
-            feedback_parts.append("---")
-            feedback_parts.append("Detailed Feedback per Rubric Trait:")
-
-            for item in combined_scores_data:
-                trait_name = item['trait']
-                trait_score = item['score'] # Could be None if scoring failed
-                trait_percent = item['percent'] # Could be None
-                student_msg = item['student_feedback'] # The constructive feedback or error message
-
-                if trait_score is not None and trait_percent is not None:
-                    score_display = f"{trait_score}/{int(max_possible_score_per_trait)} ({trait_percent}%)"
-                else:
-                    score_display = "[Scoring Incomplete]" # Indicate if score couldn't be determined
-
-                feedback_parts.append(f"\n**{trait_name}** ({score_display}):")
-                # Indent the feedback for readability
-                feedback_parts.append(f"> {student_msg.replace(os.linesep, ' ' + os.linesep + '> ')}") # Indent multi-line feedback
-
-            final_feedback = "\n".join(feedback_parts)
-
-            # Persist results
-            if Submission is not None and hasattr(submission, 'save'):
-                submission.ai_grade = normalized_score
-                submission.graded_by_ai = True
-                submission.feedback = final_feedback # Use the composed teacher-like feedback
-                submission.save()
-                print(f"Final score ({submission.ai_grade}) and feedback saved successfully for submission.")
-            else:
-                print("Warning: Submission object not available or not savable. Skipping database update.")
-                print(f"AI Grade calculated: {normalized_score}")
-                print("\n--- Final Compiled Feedback ---")
-                print(final_feedback)
-                print("--- End Feedback ---")
+            gpt_results = {}
+
+        # Score traits concurrently (bounded by TRAIT_SCORING_CONCURRENCY); results keep rubric order
+        def score_trait_job(job):
+            name, flan_val, trait_def, max_score = job
+            gpt_result = gpt_results.get(name)
+            if gpt_result is None:
+                if cancel_check is not None:
+                    cancel_check() # Stop before spending a model call on superseded work
+                gpt_result = checkpoints.remember(
+                    f"gpt:{name}",
+                    (essay_sha256, name, trait_def),
+                    lambda: get_gpt_trait_score(client, name, trait_def, essay_text, max_score, use_cache=use_llm_cache),
+                    keep=lambda result: result[0] is not None,
+                )
+            return combine_trait_score(client, name, flan_val, trait_def, essay_text, max_score,
+                                       gpt_result=gpt_result, use_cache=use_llm_cache)
+
+        fan_out = max(1, min(TRAIT_SCORING_CONCURRENCY, len(trait_jobs)))
+        if fan_out == 1 or gpt_results:
+            return [score_trait_job(job) for job in trait_jobs]
+        logger.info("Scoring %d traits with concurrency %d...", len(trait_jobs), fan_out)
+        # Each job runs in a copy of this context, so its log lines keep the run's correlation ID
+        contexts = [contextvars.copy_context() for _ in trait_jobs]
+        with ThreadPoolExecutor(max_workers=fan_out, thread_name_prefix="trait-score") as executor:
+            return list(executor.map(lambda context, job: context.run(score_trait_job, job), contexts, trait_jobs))
+
+    return trait_scores_stage
+
+
+def grade_stage(trait_scores):
+    """
+    Step 5: Calculate Final Normalized Score.
+    Returns {"normalized_score", "trait_final_numeric_scores"}; the list is empty if no trait was scored.
+    """
+    scored_traits = [item for item in trait_scores if item["score"] is not None]
+    trait_final_numeric_scores = [item["score"] for item in scored_traits]
+    if not trait_final_numeric_scores:
+         logger.error("No traits were successfully scored and combined. Cannot calculate final grade.")
+         # Set grade to 0 or specific error value? Setting to 0 for now.
+         # Optionally raise Exception("Pipeline halted: No combined trait scores available.") if preferred
+         return {"normalized_score": 0.0, "trait_final_numeric_scores": []}
+
+    # Calculate final score using the list of combined numeric scores
+    # Each trait counts against its own rubric maximum
+    normalized_score = scale_to_100(trait_final_numeric_scores, [rubric_trait_max_score(item) for item in scored_traits])
+    logger.info("Normalized final score (0–100): %s from trait scores %s", normalized_score, trait_final_numeric_scores)
+    return {"normalized_score": normalized_score, "trait_final_numeric_scores": trait_final_numeric_scores}
+
+
+def feedback_stage(grade, trait_scores):
+    """Step 6a: Compose the teacher-like final feedback message."""
+    if not grade["trait_final_numeric_scores"]:
+        return "Automated grading could not be completed because no rubric traits were successfully scored."
+
+    normalized_score = grade["normalized_score"]
+    feedback_parts = []
+    feedback_parts.append(f"Overall AI Assessed Grade: {normalized_score:.1f}%")
+    feedback_parts.append("---")
+    feedback_parts.append("Detailed Feedback per Rubric Trait:")
+
+    for item in trait_scores:
+        trait_name = item['trait']
+        trait_score = item['score'] # Could be None if scoring failed
+        trait_percent = item['percent'] # Could be None
+        student_msg = item['student_feedback'] # The constructive feedback or error message
+
+        if trait_score is not None and trait_percent is not None:
+            score_display = f"{trait_score}/{rubric_trait_max_score(item)} ({trait_percent}%)"
+        else:
+            score_display = "[Scoring Incomplete]" # Indicate if score couldn't be determined
+
+        feedback_parts.append(f"\n**{trait_name}** ({score_display}):")
+        # Indent the feedback for readability
+        feedback_parts.append(f"> {student_msg.replace(os.linesep, ' ' + os.linesep + '> ')}") # Indent multi-line feedback
+
+    return "\n".join(feedback_parts)
+
+
+def persist_stage(submission, grade, feedback, trait_scores, fingerprints, checkpoints=None):
+    """Step 6b: Persist Results (only when at least one trait was scored), then drop the run's checkpoints."""
+    normalized_score = grade["normalized_score"]
+    if not grade["trait_final_numeric_scores"]:
+        return False
+    if Submission is not None and hasattr(submission, 'save'):
+        submission.ai_grade = normalized_score
+        submission.graded_by_ai = True
+        submission.feedback = feedback # Use the composed teacher-like feedback
+        # Fingerprints let an unchanged resubmission reuse these scores
+        submission.trait_scores = trait_scores
+        submission.content_sha256 = fingerprints["content_sha256"]
+        submission.text_sha256 = fingerprints["text_sha256"]
+        submission.graded_rubric_sha256 = fingerprints["rubric_sha256"]
+        submission.save()
+        (checkpoints or NO_CHECKPOINTS).clear()
+        logger.info("Final score (%s) and feedback saved for submission %s.", submission.ai_grade, getattr(submission, "pk", None))
+        return True
+    logger.warning("Submission object not available or not savable. Skipping database update (AI grade: %s).", normalized_score)
+    logger.debug("Final compiled feedback: %s", payload(feedback), extra=SAMPLED)
+    return False
+
+
+def build_grading_graph(scoring_mode: str = None) -> StageGraph:
+    """
+    The grading pipeline as a stage DAG. Essay parsing and rubric trait parsing have
+    no dependency on each other, so they run concurrently. When the essay text was
+    already graded against the same rubric, the scoring stages reuse those trait scores.
+
+    Callers can customize a graph before running it, e.g. swap the feedback stage:
+        graph = build_grading_graph()
+        graph.replace(Stage("feedback", my_feedback, inputs=("grade", "trait_scores")))
+    or add a stage that consumes any existing output.
+    """
+    network_errors = (ServiceError,)
+    graph = StageGraph([
+        Stage("essay_text", essay_text_stage, inputs=("essay_path", "checkpoints"),
+              timeout=STAGE_TIMEOUT, retries=STAGE_RETRIES, retry_on=network_errors),
+        Stage("traits", traits_stage, inputs=("submission", "rubric_path", "preparsed_traits", "use_llm_cache", "checkpoints"),
+              timeout=2 * STAGE_TIMEOUT, retries=STAGE_RETRIES, retry_on=network_errors),
+        Stage("fingerprints", fingerprints_stage, inputs=("essay_path", "rubric_path", "essay_text")),
+        Stage("prior_grading", prior_grading_stage, inputs=("submission", "fingerprints")),
+        Stage("hf_scores", hf_scores_stage, inputs=("essay_text", "traits", "prior_grading", "checkpoints"),
+              timeout=STAGE_TIMEOUT, retries=STAGE_RETRIES, retry_on=network_errors),
+        Stage("trait_scores", make_trait_scores_stage(scoring_mode),
+              inputs=("client", "essay_text", "traits", "hf_scores", "prior_grading", "use_llm_cache", "checkpoints",
+                      "cancel_check"),
+              timeout=2 * STAGE_TIMEOUT),
+        Stage("grade", grade_stage, inputs=("trait_scores",)),
+        Stage("feedback", feedback_stage, inputs=("grade", "trait_scores")),
+        Stage("persist", persist_stage,
+              inputs=("submission", "grade", "feedback", "trait_scores", "fingerprints", "checkpoints")),
+    ])
+    graph.scoring_mode = scoring_mode or GRADING_SCORING_MODE # Recorded on each GradingRun
+    return graph
 
-    else:
-        # Handle cases where prerequisites are missing
-        if not traits:
-             message = "ERROR: No traits were parsed, skipping scoring."
-             print(message)
-             raise Exception("Pipeline halted: No rubric traits available.")
-        if not essay_text:
-             message = "ERROR: Essay text is empty, skipping scoring."
-             print(message)
-             raise Exception("Pipeline halted: Essay text is empty.")
-        if not hf_scores: # Added check in case HF scoring failed before GPT step
-             message = "ERROR: No valid scores were received from the initial scoring service (HF)."
-             print(message)
-             raise Exception("Pipeline halted: Initial scoring service failed.")
 
-    print(f"Auto-grading pipeline completed for essay: {essay_path}")
+# --- Main Grading Function ---
+
+def trigger_auto_grading_pipeline(submission, rubric_path, essay_path, traits=None, graph: StageGraph = None,
+                                  use_llm_cache: bool = True, cancel_check=None):
+    """
+    Executes the full auto-grading pipeline for a given submission.
+
+    Args:
+        submission: The Submission model instance (or relevant identifier).
+        rubric_path (str): Absolute path to the rubric PDF file inside the container.
+        essay_path (str): Absolute path to the essay PDF file inside the container.
+        traits (list, optional): Pre-parsed rubric traits. When omitted they are taken from
+            the submission's Assignment (parsed once per rubric file) or parsed from rubric_path.
+        cancel_check (callable, optional): Called before each stage and each per-trait GPT call;
+            raising from it abandons the run (e.g. when a newer upload superseded this one).
+        graph (StageGraph, optional): Custom stage graph; defaults to build_grading_graph().
+        use_llm_cache (bool): False for a deliberate regrade, so model responses are fetched
+            fresh (and the cache refreshed) instead of replayed from the LLM cache.
+
+    Intermediate artifacts (essay text, traits, HF scores, each trait's GPT result) are
+    checkpointed per submission, so rerunning a failed or interrupted grading resumes
+    after the last completed model call. Each run is recorded as a GradingRun (per-stage durations, attempts, outcome)
+    and in the latency histograms served at /metrics.
+
+    Returns:
+        dict: Every stage output ("essay_text", "traits", "hf_scores", "trait_scores", "grade", ...).
+
+    Raises:
+        Exception: If any critical step in the pipeline fails.
+    """
+    # Shared, pooled OpenAI client (raises if OPENAI_API_KEY is missing)
+    client = service_clients.get_openai_client()
+
+    if Submission is None and isinstance(submission, int):
+         logger.warning("Submission model not imported. Received submission ID: %s", submission)
+         # Add logic here if needed (e.g., fetch submission by ID), or raise if instance is required.
+
+    logger.info("Starting auto-grading for submission linked to essay: %s", essay_path)
+    graph = graph or build_grading_graph()
+    with record_grading_run(submission, scoring_mode=getattr(graph, "scoring_mode", None)) as timings:
+        results = graph.run(
+            listener=timings,
+            cancel=cancel_check,
+            submission=submission,
+            rubric_path=rubric_path,
+            essay_path=essay_path,
+            preparsed_traits=traits,
+            client=client,
+            use_llm_cache=use_llm_cache,
+            checkpoints=RunCheckpoints.for_submission(submission),
+            cancel_check=cancel_check,
+        )
+    logger.info("Auto-grading pipeline completed for essay: %s", essay_path)
+    return results
 
 
 # --- Example Usage (if running script directly for testing) ---
 if __name__ == '__main__':
+    setup_logging("auto_grader")
     print("Running auto_grader.py directly (requires setup for testing)")
 
     # Mock Submission for testing if Django models aren't available
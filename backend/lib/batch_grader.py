@@ -0,0 +1,134 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Submissions graded at once by a batch run (each run also fans out its own trait scoring)
+BATCH_GRADING_PARALLELISM = int(os.getenv("BATCH_GRADING_PARALLELISM", "8"))
+
+
+class BatchProgress:
+    """Thread-safe counters for a batch grading run, with throughput derived from wall time."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def completed(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def submissions_per_minute(self) -> float:
+        elapsed = self.elapsed
+        return round(self.completed / elapsed * 60, 2) if elapsed > 0 else 0.0
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "completed": self.completed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed_sec": round(self.elapsed, 2),
+            "submissions_per_minute": self.submissions_per_minute,
+        }
+
+
+def grade_many(submissions, grade_one, parallelism: int = BATCH_GRADING_PARALLELISM, on_progress=None) -> dict:
+    """
+    Grades submissions with at most `parallelism` in flight.
+
+    Args:
+        submissions: Submissions (or any work items) to grade.
+        grade_one: Callable(submission) -> bool, True if grading succeeded.
+        parallelism: Max submissions graded concurrently.
+        on_progress: Optional callable(BatchProgress, submission, ok) run after each one finishes.
+
+    Returns:
+        The final BatchProgress.as_dict() summary.
+    """
+    submissions = list(submissions)
+    progress = BatchProgress(len(submissions))
+    if not submissions:
+        return progress.as_dict()
+
+    def run(submission) -> bool:
+        try:
+            return bool(grade_one(submission))
+        except Exception as e:
+            logger.error("Batch grading failed for %s: %s", submission, e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(submissions))), thread_name_prefix="batch-grade") as executor:
+        futures = {executor.submit(contextvars.copy_context().run, run, submission): submission for submission in submissions}
+        for future in as_completed(futures):
+            ok = future.result()
+            progress.record(ok)
+            if on_progress is not None:
+                on_progress(progress, futures[future], ok)
+    return progress.as_dict()
+
+
+def submissions_to_grade(assignment, only_ungraded: bool = True):
+    """
+    The assignment's submissions a batch run should (re)grade. Submissions already
+    queued or being graded are left to that job instead of being graded twice.
+    """
+    submissions = assignment.submissions.select_related("assignment", "student")
+    submissions = submissions.exclude(grading_status__in=["queued", "running"])
+    if only_ungraded:
+        submissions = submissions.filter(graded_by_ai=False)
+    return submissions.order_by("id")
+
+
+def grade_assignment(assignment, only_ungraded: bool = True, parallelism: int = BATCH_GRADING_PARALLELISM, on_progress=None,
+                     use_llm_cache: bool = True) -> dict:
+    """
+    Grades an assignment's submissions in this process. The rubric traits are
+    parsed (or loaded) once up front and shared by every submission's run.
+    use_llm_cache=False bypasses cached model responses (a deliberate regrade).
+    """
+    from django.db import close_old_connections
+    from lib.auto_grader import ensure_rubric_traits
+    from lib.grading_queue import current_job_token, exclusive_run, grade_submission
+
+    if not assignment.rubric_file:
+        raise Exception(f"Assignment '{assignment.name}' has no rubric to grade against.")
+    traits = ensure_rubric_traits(assignment, use_cache=use_llm_cache)
+
+    def grade_one(submission) -> bool:
+        try:
+            with exclusive_run(submission.id) as acquired:
+                if not acquired:
+                    logger.info("Submission %s is already being graded by a worker. Skipping it.", submission.id)
+                    return False
+                # Taken before re-reading the submission: an upload after this point cancels the run
+                token = current_job_token(submission.id)
+                submission.refresh_from_db()
+                if submission.grading_status in ("queued", "running"):
+                    logger.info("Submission %s was queued for grading meanwhile. Skipping it.", submission.id)
+                    return False
+                return grade_submission(submission, traits=traits, use_llm_cache=use_llm_cache,
+                                        cancel_check=token.check if token else None)
+        finally:
+            close_old_connections() # Each pool thread holds its own DB connection
+
+    return grade_many(submissions_to_grade(assignment, only_ungraded), grade_one, parallelism, on_progress)
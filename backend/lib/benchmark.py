@@ -0,0 +1,173 @@
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from lib import auto_grader, llm_cache, rate_limiter, service_clients
+from lib.batch_grader import grade_many
+from lib.stub_services import StubServices
+import latency_metrics # On sys.path once lib.auto_grader is imported
+
+# Offline throughput/latency benchmark for the grading pipeline. Every downstream
+# service is replaced by lib/stub_services.py, so no OpenAI/HF quota is used.
+
+SCENARIOS = {
+    # Full pipeline per submission, rubric traits resolved inside each run (the queue worker path)
+    "pipeline": {"preparse_traits": False, "scoring_mode": "per_trait"},
+    # Rubric traits parsed once and shared, as grade_assignment does
+    "batch": {"preparse_traits": True, "scoring_mode": "per_trait"},
+    # Batch path with the single-call structured scoring mode
+    "batch_structured": {"preparse_traits": True, "scoring_mode": "structured"},
+}
+
+
+class BenchmarkSubmission:
+    """Stand-in for a Submission; persisting is a no-op so the database is left alone."""
+
+    pk = None
+
+    def __init__(self, id: int, essay_path: str):
+        self.id = id
+        self.essay_path = essay_path
+        self.ai_grade = None
+        self.graded_by_ai = False
+        self.feedback = ""
+
+    def save(self, *args, **kwargs):
+        pass
+
+    def __str__(self):
+        return f"benchmark submission {self.id}"
+
+
+def percentile(values: list, p: float) -> float:
+    """Linear-interpolated percentile (p in 0-100) of a non-empty list."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def write_fixture_files(directory: str, count: int) -> tuple[str, list[str]]:
+    """Writes a rubric and `count` distinct essay files (the stub parser ignores their content)."""
+    rubric_path = os.path.join(directory, "rubric.pdf")
+    with open(rubric_path, "wb") as f:
+        f.write(b"%PDF-1.4\n% benchmark rubric\n")
+    essay_paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"essay_{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4\n% benchmark essay " + os.urandom(16).hex().encode() + b"\n")
+        essay_paths.append(path)
+    return rubric_path, essay_paths
+
+
+@contextlib.contextmanager
+def pipeline_pointed_at(stubs: StubServices):
+    """
+    Routes the pipeline's downstream calls to the stub services and keeps the
+    benchmark off the production state those calls would otherwise share through
+    Redis, restoring everything afterwards:
+    - the LLM cache is off (every run pays for its model calls) and its usage
+      counters stay in this process,
+    - the stub extractions are neither read from nor written to the extraction cache,
+    - OpenAI calls (and the 429s the stubs inject) go through a limiter with its
+      own Redis keys, so real workers' concurrency window is untouched,
+    - latency metrics are kept in memory so benchmark runs do not show up in /metrics.
+    """
+    saved_urls = (auto_grader.PDFPARSE_URL, auto_grader.PARSE_RUBRIC_URL, auto_grader.SCORE_ESSAY_URL)
+    saved_env = {key: os.environ.get(key) for key in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+    saved_cache = (llm_cache.LLM_CACHE_ENABLED, llm_cache.STATS_KEY)
+    saved_extraction_cache = (auto_grader.get_cached_extraction, auto_grader.cache_extraction)
+    saved_limiter = rate_limiter._limiter
+    saved_metrics_backend = latency_metrics._backend
+
+    auto_grader.PDFPARSE_URL = stubs.urls["pdfparse"]
+    auto_grader.PARSE_RUBRIC_URL = stubs.urls["parse_rubric"]
+    auto_grader.SCORE_ESSAY_URL = stubs.urls["score_essay"]
+    os.environ["OPENAI_BASE_URL"] = stubs.urls["openai"]
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    service_clients._openai_client = None # Rebuilt against the stub base URL
+    llm_cache.LLM_CACHE_ENABLED = False
+    llm_cache.STATS_KEY = None
+    auto_grader.get_cached_extraction = lambda content_sha256: None
+    auto_grader.cache_extraction = lambda content_sha256, result: None
+    limiter = rate_limiter._limiter = rate_limiter.OpenAIRateLimiter(
+        key_prefix=f"{rate_limiter.KEY_PREFIX}:benchmark:{uuid.uuid4().hex}")
+    latency_metrics._backend = latency_metrics.MemoryBackend()
+    try:
+        yield
+    finally:
+        auto_grader.PDFPARSE_URL, auto_grader.PARSE_RUBRIC_URL, auto_grader.SCORE_ESSAY_URL = saved_urls
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        service_clients._openai_client = None
+        llm_cache.LLM_CACHE_ENABLED, llm_cache.STATS_KEY = saved_cache
+        auto_grader.get_cached_extraction, auto_grader.cache_extraction = saved_extraction_cache
+        rate_limiter._limiter = saved_limiter
+        limiter.clear()
+        latency_metrics._backend = saved_metrics_backend
+
+
+@contextlib.contextmanager
+def quiet_logs():
+    """Silences the pipeline's per-run log lines (injected failures included) while a scenario runs."""
+    logging.disable(logging.ERROR)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def run_scenario(name: str, stubs: StubServices, submissions: int, concurrency: int, quiet: bool = True) -> dict:
+    """
+    Grades `submissions` fresh essays through one scenario with `concurrency`
+    submissions in flight. Returns latency percentiles (seconds) and throughput.
+    """
+    scenario = SCENARIOS[name]
+    graph = auto_grader.build_grading_graph(scenario["scoring_mode"])
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    with tempfile.TemporaryDirectory(prefix="grading-bench-") as directory, pipeline_pointed_at(stubs):
+        rubric_path, essay_paths = write_fixture_files(directory, submissions)
+        work = [BenchmarkSubmission(i + 1, path) for i, path in enumerate(essay_paths)]
+        stubs.reset_counts()
+
+        with quiet_logs() if quiet else contextlib.nullcontext():
+            traits = auto_grader.derive_rubric_traits(rubric_path) if scenario["preparse_traits"] else None
+
+            def grade_one(submission) -> bool:
+                started = time.monotonic()
+                try:
+                    results = auto_grader.trigger_auto_grading_pipeline(
+                        submission, rubric_path, submission.essay_path, traits=traits, graph=graph
+                    )
+                    return bool(results["grade"]["trait_final_numeric_scores"])
+                finally:
+                    with latencies_lock:
+                        latencies.append(time.monotonic() - started)
+
+            summary = grade_many(work, grade_one, parallelism=concurrency)
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "submissions": summary["total"],
+        "succeeded": summary["succeeded"],
+        "failed": summary["failed"],
+        "elapsed_sec": summary["elapsed_sec"],
+        "submissions_per_minute": summary["submissions_per_minute"],
+        "p50_sec": round(percentile(latencies, 50), 3) if latencies else None,
+        "p95_sec": round(percentile(latencies, 95), 3) if latencies else None,
+        "p99_sec": round(percentile(latencies, 99), 3) if latencies else None,
+        "downstream_requests": dict(stubs.requests),
+        "downstream_errors": dict(stubs.errors),
+    }
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# How long a failed run's artifacts are kept for the retry to resume from
+CHECKPOINT_TTL = int(os.getenv("GRADING_CHECKPOINT_TTL", str(7 * 24 * 3600))) # Seconds
+KEY_PREFIX = "grading:checkpoint:"
+
+MISSING = object()
+
+
+def inputs_sha256(*parts) -> str:
+    """Stable SHA-256 of the values an artifact was computed from (any JSON-serializable values)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+
+class RunCheckpoints:
+    """
+    Intermediate artifacts of one submission's grading run (extracted text,
+    rubric traits, HF scores, each trait's GPT result), kept in a Redis hash so
+    a retried run resumes after the last completed step instead of starting over.
+
+    Each artifact is stored with the SHA-256 of its inputs and only reused while
+    they match, so a resubmitted essay or changed rubric is computed afresh.
+    The hash is deleted once the run's results are persisted. Without a saved
+    submission (e.g. benchmark runs) or Redis, nothing is checkpointed.
+    """
+
+    def __init__(self, submission_id=None, redis_client=None):
+        self.key = f"{KEY_PREFIX}{submission_id}" if submission_id is not None else None
+        self._redis = redis_client
+        self._warned = False
+
+    @classmethod
+    def for_submission(cls, submission) -> "RunCheckpoints":
+        return cls(getattr(submission, "pk", None))
+
+    def _client(self):
+        if self._redis is None:
+            from lib.grading_queue import get_redis
+            self._redis = get_redis()
+        return self._redis
+
+    def _unavailable(self, e):
+        if not self._warned:
+            self._warned = True
+            logger.warning("Grading checkpoints unavailable (%s); this run cannot be resumed.", e)
+
+    def get(self, name: str, inputs):
+        """The artifact saved under name for these inputs, or MISSING."""
+        if self.key is None or inputs is None:
+            return MISSING
+        try:
+            raw = self._client().hget(self.key, name)
+        except Exception as e:
+            self._unavailable(e)
+            return MISSING
+        if raw is None:
+            return MISSING
+        entry = json.loads(raw)
+        if entry.get("inputs") != inputs_sha256(inputs):
+            return MISSING
+        return entry["value"]
+
+    def put(self, name: str, inputs, value):
+        if self.key is None or inputs is None:
+            return
+        entry = json.dumps({"inputs": inputs_sha256(inputs), "value": value})
+        try:
+            pipe = self._client().pipeline()
+            pipe.hset(self.key, name, entry)
+            pipe.expire(self.key, CHECKPOINT_TTL)
+            pipe.execute()
+        except Exception as e:
+            self._unavailable(e)
+
+    def remember(self, name: str, inputs, compute, keep=None):
+        """
+        Returns the checkpointed artifact, or compute()'s result, which is
+        checkpointed unless keep(result) is False (e.g. an unusable model answer).
+        """
+        value = self.get(name, inputs)
+        if value is not MISSING:
+            logger.info("Resuming from checkpoint: reusing '%s'.", name)
+            return value
+        value = compute()
+        if keep is None or keep(value):
+            self.put(name, inputs, value)
+        return value
+
+    def clear(self):
+        if self.key is None:
+            return
+        try:
+            self._client().delete(self.key)
+        except Exception as e:
+            self._unavailable(e)
+
+
+NO_CHECKPOINTS = RunCheckpoints()
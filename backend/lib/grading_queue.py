@@ -0,0 +1,510 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+from lib.grading_scheduler import MAX_SIGNALS, PRIORITY_REGRADE, PRIORITY_SUBMISSION, FairShareScheduler
+from lib.pipeline import RunCancelled
+
+# Queue-wait histograms and logging live in backend-fastapi/ (shared with the FastAPI service)
+FASTAPI_SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend-fastapi'))
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+from latency_metrics import observe
+from structured_logging import correlation, get_correlation_id
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+QUEUE_KEY = os.getenv("GRADING_QUEUE_KEY", "grading:queue")
+PROCESSING_KEY_PREFIX = f"{QUEUE_KEY}:processing:"
+HEARTBEAT_KEY_PREFIX = f"{QUEUE_KEY}:heartbeat:"
+SIGNAL_KEY = f"{QUEUE_KEY}:signal" # Wakes idle workers when a job is enqueued
+DELAYED_KEY = f"{QUEUE_KEY}:delayed" # Jobs waiting to be retried, scored by when they may run
+CURRENT_JOB_KEY_PREFIX = f"{QUEUE_KEY}:current:" # Latest grading job id per submission
+RUN_LOCK_KEY_PREFIX = f"{QUEUE_KEY}:running:" # Held while a submission is being graded
+
+WORKER_CONCURRENCY = int(os.getenv("GRADING_WORKER_CONCURRENCY", "4"))
+HEARTBEAT_TTL = 30 # Seconds before a silent worker's in-flight jobs are considered orphaned
+DEQUEUE_TIMEOUT = 5 # Seconds a worker thread blocks waiting for a job before re-checking shutdown
+CURRENT_JOB_TTL = 7 * 24 * 3600 # Seconds; older jobs count as current again
+RUN_LOCK_TTL = int(os.getenv("GRADING_RUN_LOCK_TTL", "3600")) # Upper bound on one grading run
+RUN_LOCK_WAIT = int(os.getenv("GRADING_RUN_LOCK_WAIT", "300")) # How long a newer job waits for a superseded run to stop
+# Runs per grading job when it fails transiently (service down, stage timeout, out of OpenAI capacity);
+# later runs resume from its checkpoints
+GRADING_MAX_ATTEMPTS = int(os.getenv("GRADING_MAX_ATTEMPTS", "4"))
+GRADING_RETRY_BACKOFF = float(os.getenv("GRADING_RETRY_BACKOFF", "60")) # Seconds before the first retry, doubled for each further one
+
+JOB_GRADE_SUBMISSION = "grade_submission"
+JOB_PARSE_RUBRIC = "parse_rubric"
+
+_redis_client = None
+_redis_lock = threading.Lock()
+_scheduler = None
+
+# KEYS: delayed zset, express list, signal list. ARGV: now, max signals.
+# Moves the jobs whose retry time has come onto the express list.
+PROMOTE_DELAYED_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(due) do
+  redis.call('ZREM', KEYS[1], job)
+  redis.call('LPUSH', KEYS[2], job)
+end
+if #due > 0 then
+  redis.call('LPUSH', KEYS[3], '1')
+  redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[2]) - 1)
+end
+return #due
+"""
+
+# Deletes KEYS[1] only if it still holds ARGV[1]
+RELEASE_IF_CURRENT_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class GradingSuperseded(RunCancelled):
+    """The grading job was replaced by a newer one for the same submission."""
+
+
+def get_redis() -> redis.Redis:
+    """Returns the process-wide Redis client (connection pooled by redis-py)."""
+    global _redis_client
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                _redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _redis_client
+
+
+def get_scheduler() -> FairShareScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _redis_lock:
+            if _scheduler is None:
+                _scheduler = FairShareScheduler(get_redis(), QUEUE_KEY, SIGNAL_KEY)
+    return _scheduler
+
+
+# --- Producer side ---
+
+def enqueue_job(job_type: str, schedule: dict = None, job_id: str = None, delay: float = 0, **payload) -> str:
+    """
+    Pushes a job onto the durable grading queue and returns its id.
+    Jobs are JSON objects so any process with Redis access can consume them.
+
+    Without `schedule` the job goes on the express FIFO, served before anything
+    else. With schedule={"priority", "teacher_id", "class_id", "due_ts"} it is
+    placed by the fair-share scheduler (lib/grading_scheduler.py). With a delay
+    (retries) it waits that many seconds, then goes on the express FIFO.
+    The job carries the enqueuing request's correlation ID, so the worker's
+    log lines for it can be matched to that request.
+    """
+    job_id = job_id or uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "type": job_type,
+        "enqueued_at": time.time(),
+        "correlation_id": get_correlation_id() or job_id,
+        **payload,
+    }
+    if delay > 0:
+        get_redis().zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+        return job["id"]
+    if schedule is None:
+        pipe = get_redis().pipeline()
+        pipe.lpush(QUEUE_KEY, json.dumps(job))
+        pipe.lpush(SIGNAL_KEY, "1")
+        pipe.ltrim(SIGNAL_KEY, 0, MAX_SIGNALS - 1)
+        pipe.execute()
+        return job["id"]
+    job["priority"] = schedule["priority"]
+    job["class_id"] = schedule["class_id"]
+    get_scheduler().enqueue(
+        job["id"], json.dumps(job), schedule["priority"], schedule["teacher_id"], schedule["class_id"],
+        schedule["due_ts"], job["enqueued_at"],
+    )
+    return job["id"]
+
+
+def grading_schedule(assignment, priority: str = PRIORITY_SUBMISSION) -> dict:
+    """Scheduling fields for grading work on an assignment: its class, the class's teacher and the due date."""
+    class_assigned = assignment.class_assigned
+    return {
+        "priority": priority,
+        "teacher_id": class_assigned.teacher_id,
+        "class_id": class_assigned.id,
+        "due_ts": assignment.due_date.timestamp(),
+    }
+
+
+def enqueue_grading(submission_id: int, use_llm_cache: bool = True, assignment=None,
+                    priority: str = PRIORITY_SUBMISSION) -> str:
+    """
+    Queues a submission for auto-grading. priority is PRIORITY_SUBMISSION for a fresh
+    upload or PRIORITY_REGRADE for teacher-initiated (bulk) grading, and
+    use_llm_cache=False forces fresh model responses. Pass the submission's
+    assignment when at hand to save looking it up.
+
+    Only the latest grading job of a submission runs: any job queued for it
+    earlier is dropped when dequeued, and a running one is cancelled at its next
+    stage or model call.
+    """
+    if assignment is None:
+        from groups.models import Submission
+        assignment = Submission.objects.select_related("assignment__class_assigned").get(id=submission_id).assignment
+    schedule = grading_schedule(assignment, priority)
+    job_id = uuid.uuid4().hex
+    get_redis().set(f"{CURRENT_JOB_KEY_PREFIX}{submission_id}", job_id, ex=CURRENT_JOB_TTL)
+    if not use_llm_cache:
+        return enqueue_job(JOB_GRADE_SUBMISSION, schedule=schedule, job_id=job_id, submission_id=submission_id,
+                           use_llm_cache=False)
+    return enqueue_job(JOB_GRADE_SUBMISSION, schedule=schedule, job_id=job_id, submission_id=submission_id)
+
+
+def supersede_grading(submission_id: int):
+    """Drops or cancels any queued/running grading job of a submission (e.g. its new file reused a prior grade)."""
+    get_redis().set(f"{CURRENT_JOB_KEY_PREFIX}{submission_id}", "superseded", ex=CURRENT_JOB_TTL)
+
+
+class GradingJobToken:
+    """
+    Identifies one grading job of a submission. It stays current until a newer job
+    (or supersede_grading) replaces it; check() raises GradingSuperseded after that,
+    which the pipeline calls between stages and before each model call.
+    Jobs without a recorded current job (queued before coalescing existed) count as current.
+    """
+
+    def __init__(self, submission_id: int, job_id: str):
+        self.submission_id = submission_id
+        self.job_id = job_id
+        self.key = f"{CURRENT_JOB_KEY_PREFIX}{submission_id}"
+
+    def is_current(self) -> bool:
+        try:
+            current = get_redis().get(self.key)
+        except redis.exceptions.RedisError as e:
+            logger.warning("Could not check whether grading job %s is current: %s", self.job_id, e)
+            return True
+        return current is None or current == self.job_id
+
+    def check(self):
+        if not self.is_current():
+            raise GradingSuperseded(f"Grading job {self.job_id} for submission {self.submission_id} was superseded.")
+
+    def release(self):
+        """Forgets this job once it has finished (unless a newer one has replaced it meanwhile)."""
+        try:
+            r = get_redis()
+            r.eval(RELEASE_IF_CURRENT_SCRIPT, 1, self.key, self.job_id)
+        except redis.exceptions.RedisError as e:
+            logger.warning("Could not release grading job %s: %s", self.job_id, e)
+
+
+def current_job_token(submission_id: int) -> GradingJobToken | None:
+    """
+    A token for a grading run outside the queue (batch grading): it stays current
+    until a new upload or grading job for the submission replaces whatever job is
+    recorded now, so such a run is cancelled the same way a queued one is. It
+    records nothing itself and needs no release(). None without Redis.
+    """
+    try:
+        return GradingJobToken(submission_id, get_redis().get(f"{CURRENT_JOB_KEY_PREFIX}{submission_id}"))
+    except redis.exceptions.RedisError as e:
+        logger.warning("Could not read the current grading job of submission %s: %s", submission_id, e)
+        return None
+
+
+@contextmanager
+def exclusive_run(submission_id: int, wait: float = 0):
+    """
+    Holds the submission's run lock, so at most one grading run per submission is
+    active across all workers. Yields False if another run still held it after
+    `wait` seconds. Without Redis, yields True (no coordination).
+    """
+    lock = None
+    try:
+        lock = get_redis().lock(f"{RUN_LOCK_KEY_PREFIX}{submission_id}", timeout=RUN_LOCK_TTL, blocking_timeout=wait)
+        acquired = lock.acquire(blocking=wait > 0)
+    except redis.exceptions.RedisError as e:
+        logger.warning("Could not take the grading run lock for submission %s: %s", submission_id, e)
+        lock, acquired = None, True
+    try:
+        yield acquired
+    finally:
+        if lock is not None and acquired:
+            try:
+                lock.release()
+            except redis.exceptions.RedisError:
+                pass # Expired (run longer than RUN_LOCK_TTL) or Redis gone
+
+
+def enqueue_rubric_parsing(assignment_id: int) -> str:
+    """Queues parsing of an assignment's rubric traits (a no-op if they are already current)."""
+    return enqueue_job(JOB_PARSE_RUBRIC, assignment_id=assignment_id)
+
+
+def queue_length() -> int:
+    r = get_redis()
+    return r.llen(QUEUE_KEY) + r.zcard(DELAYED_KEY) + get_scheduler().pending()
+
+
+# --- Consumer side ---
+
+def recover_orphaned_jobs() -> int:
+    """
+    Moves jobs left in the processing list of a dead worker (no heartbeat) back
+    onto the queue (the express FIFO, so they run next). Safe to call from every
+    worker at startup.
+    """
+    r = get_redis()
+    recovered = 0
+    for processing_key in r.scan_iter(match=f"{PROCESSING_KEY_PREFIX}*"):
+        worker_id = processing_key[len(PROCESSING_KEY_PREFIX):]
+        if r.exists(f"{HEARTBEAT_KEY_PREFIX}{worker_id}"):
+            continue
+        while r.lmove(processing_key, QUEUE_KEY, "RIGHT", "LEFT") is not None:
+            recovered += 1
+    return recovered
+
+
+def promote_delayed_jobs() -> int:
+    """Moves delayed jobs that are due onto the queue. Run periodically by every worker."""
+    return get_redis().eval(PROMOTE_DELAYED_SCRIPT, 3, DELAYED_KEY, QUEUE_KEY, SIGNAL_KEY, time.time(), MAX_SIGNALS)
+
+
+def retryable_grading_error(error: Exception) -> bool:
+    """
+    Whether a failed grading run is worth running again later: a downstream service
+    or OpenAI was unavailable, or a stage ran out of time. The next run resumes from
+    the checkpoints this one left (see lib/checkpoints.py).
+    """
+    from lib.auto_grader import ServiceError
+    from lib.pipeline import StageTimeout
+    from lib.rate_limiter import RateLimitTimeout
+    return isinstance(error, (ServiceError, StageTimeout, RateLimitTimeout))
+
+
+class GradingWorker:
+    """
+    Pool of threads consuming the grading queue.
+
+    Each job is atomically moved to this worker's processing list while it runs
+    and only removed once handled, so a crashed worker never loses a job.
+    Jobs are taken in fair-share order (see lib/grading_scheduler.py).
+    """
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, worker_id: str | None = None):
+        self.concurrency = max(1, concurrency)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.processing_key = f"{PROCESSING_KEY_PREFIX}{self.worker_id}"
+        self.heartbeat_key = f"{HEARTBEAT_KEY_PREFIX}{self.worker_id}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _heartbeat(self):
+        r = get_redis()
+        while not self._stop.is_set():
+            # A Redis hiccup must not end the loop: once the heartbeat lapses, other
+            # workers recover (and grade again) the jobs this worker is still running
+            try:
+                r.set(self.heartbeat_key, "1", ex=HEARTBEAT_TTL)
+                promote_delayed_jobs()
+            except redis.exceptions.RedisError as e:
+                logger.warning("Grading worker heartbeat failed: %s. Retrying shortly.", e)
+            self._stop.wait(HEARTBEAT_TTL / 3)
+        r.delete(self.heartbeat_key)
+
+    def _consume(self):
+        r = get_redis()
+        scheduler = get_scheduler()
+        while not self._stop.is_set():
+            try:
+                raw_job = scheduler.dequeue(self.processing_key)
+                if raw_job is None:
+                    scheduler.wait_for_work(DEQUEUE_TIMEOUT)
+                    continue
+            except redis.exceptions.ConnectionError as e:
+                logger.error("Grading worker lost Redis connection: %s. Retrying shortly.", e)
+                self._stop.wait(DEQUEUE_TIMEOUT)
+                continue
+            try:
+                job = json.loads(raw_job)
+                if "priority" in job:
+                    observe("grading_queue_wait_seconds", max(0.0, time.time() - job["enqueued_at"]),
+                            priority=job["priority"], class_id=job["class_id"])
+                with correlation(job.get("correlation_id") or job.get("id")):
+                    run_job(job)
+            except Exception as e:
+                logger.exception("Grading job failed: %s", e)
+            finally:
+                r.lrem(self.processing_key, 1, raw_job)
+
+    def start(self):
+        get_redis().set(self.heartbeat_key, "1", ex=HEARTBEAT_TTL)
+        recovered = recover_orphaned_jobs()
+        if recovered:
+            logger.info("Recovered %s orphaned grading job(s).", recovered)
+        self._threads = [threading.Thread(target=self._heartbeat, name="grading-heartbeat", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._consume, name=f"grading-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info("Grading worker %s started with concurrency %s.", self.worker_id, self.concurrency)
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+# --- Job handlers ---
+
+def grade_submission(submission, traits=None, use_llm_cache: bool = True, cancel_check=None, retry=None) -> bool:
+    """
+    Runs the auto-grading pipeline for one submission, tracking its grading_status.
+    Returns True if grading completed. Pass traits to reuse an already parsed rubric,
+    and use_llm_cache=False to fetch fresh model responses. If cancel_check raises
+    GradingSuperseded the run stops and grading_status is left to the newer job.
+    retry, if given, is called with a transient error (see retryable_grading_error)
+    and returns True if it scheduled another run; the submission then stays queued.
+    """
+    from django.core.files.storage import default_storage
+    from lib.auto_grader import trigger_auto_grading_pipeline
+
+    assignment = submission.assignment
+    if not assignment.rubric_file:
+        logger.warning("Assignment %s has no rubric. Skipping grading for submission %s.", assignment.id, submission.id)
+        submission.grading_status = None
+        submission.save(update_fields=["grading_status"])
+        return False
+
+    submission.grading_status = "running"
+    submission.grading_error = None
+    submission.save(update_fields=["grading_status", "grading_error"])
+    try:
+        trigger_auto_grading_pipeline(
+            submission=submission,
+            rubric_path=assignment.rubric_file.path,
+            essay_path=default_storage.path(submission.submission_file.name),
+            traits=traits,
+            use_llm_cache=use_llm_cache,
+            cancel_check=cancel_check,
+        )
+    except GradingSuperseded as e:
+        logger.info("Stopped grading submission %s: %s", submission.id, e)
+        return False
+    except Exception as e:
+        if retry is not None and retryable_grading_error(e) and retry(e):
+            submission.grading_status = "queued"
+            submission.grading_error = f"Retrying after: {e}"
+            submission.save(update_fields=["grading_status", "grading_error"])
+            return False
+        logger.error("Grading pipeline error for submission %s: %s", submission.id, e)
+        submission.grading_status = "failed"
+        submission.grading_error = str(e)
+        submission.save(update_fields=["grading_status", "grading_error"])
+        return False
+
+    submission.grading_status = "done"
+    submission.save(update_fields=["grading_status"])
+    return True
+
+
+def grade_submission_job(submission_id: int, use_llm_cache: bool = True, job_id: str = None, attempt: int = 1):
+    """
+    Queue handler: loads the submission and grades it, unless a newer job for the
+    same submission superseded this one. Waits for a superseded run that is still
+    stopping, so only one run per submission is ever active. A run that fails
+    transiently is requeued (same job id, so it stays current) with exponential
+    backoff, up to GRADING_MAX_ATTEMPTS runs.
+    """
+    from django.db import close_old_connections
+    from groups.models import Submission
+
+    token = GradingJobToken(submission_id, job_id) if job_id else None
+    if token is not None and not token.is_current():
+        logger.info("Grading job %s for submission %s was superseded. Dropping it.", job_id, submission_id)
+        return
+
+    with exclusive_run(submission_id, wait=RUN_LOCK_WAIT) as acquired:
+        if not acquired:
+            logger.warning("Submission %s is still being graded by an earlier run. Requeueing job %s.", submission_id, job_id)
+            enqueue_job(JOB_GRADE_SUBMISSION, job_id=job_id, submission_id=submission_id, use_llm_cache=use_llm_cache,
+                        attempt=attempt)
+            return
+        if token is not None and not token.is_current():
+            logger.info("Grading job %s for submission %s was superseded while waiting. Dropping it.", job_id, submission_id)
+            return
+
+        close_old_connections()
+        try:
+            submission = Submission.objects.select_related("assignment").get(id=submission_id)
+        except Submission.DoesNotExist:
+            logger.warning("Submission %s no longer exists. Dropping grading job.", submission_id)
+            return
+        def retry(error) -> bool:
+            if attempt >= GRADING_MAX_ATTEMPTS:
+                return False
+            delay = GRADING_RETRY_BACKOFF * 2 ** (attempt - 1)
+            logger.warning("Grading submission %s failed (%s); retrying in %.0fs (attempt %s of %s).",
+                           submission_id, error, delay, attempt + 1, GRADING_MAX_ATTEMPTS)
+            enqueue_job(JOB_GRADE_SUBMISSION, job_id=job_id, delay=delay, submission_id=submission_id,
+                        use_llm_cache=use_llm_cache, attempt=attempt + 1)
+            return True
+
+        try:
+            grade_submission(submission, use_llm_cache=use_llm_cache, cancel_check=token.check if token else None,
+                             retry=retry if job_id else None)
+        finally:
+            if token is not None:
+                token.release()
+            close_old_connections()
+
+
+def parse_rubric_job(assignment_id: int):
+    """Parses and stores an assignment's rubric traits ahead of grading."""
+    from django.db import close_old_connections
+    from groups.models import Assignment
+    from lib.auto_grader import ensure_rubric_traits
+
+    close_old_connections()
+    try:
+        assignment = Assignment.objects.get(id=assignment_id)
+    except Assignment.DoesNotExist:
+        logger.warning("Assignment %s no longer exists. Dropping rubric parsing job.", assignment_id)
+        return
+    if not assignment.rubric_file:
+        return
+    try:
+        ensure_rubric_traits(assignment)
+    finally:
+        close_old_connections()
+
+
+JOB_HANDLERS = {
+    JOB_GRADE_SUBMISSION: lambda job: grade_submission_job(job["submission_id"], job.get("use_llm_cache", True), job["id"],
+                                                           job.get("attempt", 1)),
+    JOB_PARSE_RUBRIC: lambda job: parse_rubric_job(job["assignment_id"]),
+}
+
+
+def run_job(job: dict):
+    handler = JOB_HANDLERS.get(job.get("type"))
+    if handler is None:
+        logger.warning("Unknown grading job type '%s'. Dropping job %s.", job.get('type'), job.get('id'))
+        return
+    handler(job)
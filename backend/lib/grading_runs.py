@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from latency_metrics import observe
+
+from lib.pipeline import RunCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimings:
+    """
+    Pipeline listener (see StageGraph.run) that collects each stage's duration,
+    attempt count and error, and feeds the per-stage latency histogram.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def on_stage_start(self, name, attempt):
+        pass
+
+    def on_stage_end(self, name, duration, attempts, error):
+        with self._lock:
+            self.stages[name] = {
+                "duration_sec": round(duration, 3),
+                "attempts": attempts,
+                "error": str(error) if error is not None else None,
+            }
+        observe("grading_stage_duration_seconds", duration, stage=name)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(self.stages)
+
+
+@contextmanager
+def record_grading_run(submission, scoring_mode: str = None):
+    """
+    Records one pipeline run as a GradingRun row (when submission is a saved
+    Submission) and in the run latency histogram. Yields the StageTimings
+    listener to pass to StageGraph.run.
+    """
+    timings = StageTimings()
+    run = None
+    try:
+        from groups.models import GradingRun, Submission
+        if isinstance(submission, Submission) and submission.pk is not None:
+            run = GradingRun.objects.create(submission=submission, scoring_mode=scoring_mode)
+    except Exception as e:
+        logger.warning("Could not create GradingRun record: %s", e)
+
+    started = time.monotonic()
+    error = None
+    try:
+        yield timings
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        duration = time.monotonic() - started
+        if isinstance(error, RunCancelled):
+            status = "cancelled"
+        else:
+            status = "failed" if error is not None else "succeeded"
+        observe("grading_run_duration_seconds", duration, status=status)
+        if run is not None:
+            from django.utils.timezone import now
+            run.status = status
+            run.finished_at = now()
+            run.duration_sec = round(duration, 3)
+            run.stages = timings.as_dict()
+            run.error = str(error) if error is not None else None
+            try:
+                run.save(update_fields=["status", "finished_at", "duration_sec", "stages", "error"])
+            except Exception as e:
+                logger.warning("Could not save GradingRun %s: %s", run.id, e)
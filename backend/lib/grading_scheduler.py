@@ -0,0 +1,145 @@
+import os
+
+# --- Configuration ---
+# Share of worker capacity per priority class: fresh student submissions get
+# GRADING_WEIGHT_SUBMISSION turns for every GRADING_WEIGHT_REGRADE turns of teacher regrades.
+PRIORITY_SUBMISSION = "submission"
+PRIORITY_REGRADE = "regrade"
+PRIORITY_WEIGHTS = {
+    PRIORITY_SUBMISSION: float(os.getenv("GRADING_WEIGHT_SUBMISSION", "4")),
+    PRIORITY_REGRADE: float(os.getenv("GRADING_WEIGHT_REGRADE", "1")),
+}
+SCHEDULER_PREFIX = os.getenv("GRADING_SCHEDULER_KEY", "grading:sched") + ":"
+# Per-teacher / per-class weights (default 1), e.g. HSET grading:sched:weights class:12 2
+WEIGHT_OVERRIDES_KEY = f"{SCHEDULER_PREFIX}weights"
+MAX_SIGNALS = 1000
+
+# Hierarchical stride scheduling. Every node (root -> priority class -> teacher ->
+# class) keeps its active children in a ZSET scored by "pass": a dispatch charges
+# the chosen child (and its ancestors) 1/weight, and the child with the lowest pass
+# goes next, so each level shares capacity in proportion to the weights. A child
+# that becomes active again is placed one turn after its parent's current virtual
+# time, so being idle earns no burst credit. Within a class, jobs are ordered by
+# due date (earliest deadline first), then by enqueue time.
+#
+# Keys are derived inside the scripts, so they assume a single (non-cluster) Redis,
+# like the rest of the grading queue.
+
+# ARGV: prefix, priority, teacher node, class node, member, payload, score, w_priority, w_teacher, w_class, signal key, max signals
+ENQUEUE_SCRIPT = """
+local prefix = ARGV[1]
+local path = {'root', ARGV[2], ARGV[3], ARGV[4]}
+local weights = {ARGV[8], ARGV[9], ARGV[10]}
+redis.call('HSET', prefix .. 'payload', ARGV[5], ARGV[6])
+redis.call('ZADD', prefix .. ARGV[4] .. ':jobs', tonumber(ARGV[7]), ARGV[5])
+for i = 1, 3 do
+  redis.call('HSET', prefix .. 'node-weight', path[i + 1], weights[i])
+end
+for i = 3, 1, -1 do
+  local node, child = path[i], path[i + 1]
+  local children = prefix .. node .. ':children'
+  if redis.call('ZSCORE', children, child) then break end
+  local pass = tonumber(redis.call('HGET', prefix .. 'pass', child) or '0')
+  local vtime = tonumber(redis.call('HGET', prefix .. 'vtime', node) or '0')
+  redis.call('ZADD', children, math.max(pass, vtime + 1 / tonumber(weights[i])), child)
+end
+redis.call('LPUSH', ARGV[11], '1')
+redis.call('LTRIM', ARGV[11], 0, tonumber(ARGV[12]) - 1)
+return 1
+"""
+
+# KEYS: express list, processing list. ARGV: prefix.
+# Express jobs (rubric parsing, recovered jobs) go first; otherwise the scheduled job
+# is moved onto the worker's processing list. Returns the payload, or nil when idle.
+DEQUEUE_SCRIPT = """
+local express = redis.call('LMOVE', KEYS[1], KEYS[2], 'RIGHT', 'LEFT')
+if express then return express end
+local prefix = ARGV[1]
+local path = {'root'}
+local passes = {}
+for level = 1, 3 do
+  local top = redis.call('ZRANGE', prefix .. path[level] .. ':children', 0, 0, 'WITHSCORES')
+  if #top == 0 then return false end
+  path[level + 1] = top[1]
+  passes[level] = tonumber(top[2])
+end
+local jobs = prefix .. path[4] .. ':jobs'
+local member = redis.call('ZRANGE', jobs, 0, 0)[1]
+local payload = false
+if member then
+  redis.call('ZREM', jobs, member)
+  payload = redis.call('HGET', prefix .. 'payload', member)
+  redis.call('HDEL', prefix .. 'payload', member)
+end
+local empty = redis.call('ZCARD', jobs) == 0
+for level = 3, 1, -1 do
+  local node, child = path[level], path[level + 1]
+  local children = prefix .. node .. ':children'
+  local pass = passes[level] + 1 / tonumber(redis.call('HGET', prefix .. 'node-weight', child) or '1')
+  redis.call('HSET', prefix .. 'vtime', node, passes[level])
+  if empty then
+    redis.call('ZREM', children, child)
+    redis.call('HSET', prefix .. 'pass', child, pass)
+    empty = redis.call('ZCARD', children) == 0
+  else
+    redis.call('ZADD', children, pass, child)
+  end
+end
+if payload then
+  redis.call('LPUSH', KEYS[2], payload)
+  return payload
+end
+return ''
+"""
+
+
+class FairShareScheduler:
+    """
+    Orders scheduled grading jobs by weighted fair share across priority classes,
+    teachers and classes (see the scripts above). Jobs carry the job JSON; the
+    express list (the plain FIFO queue) is always served first.
+    """
+
+    def __init__(self, client, express_key: str, signal_key: str):
+        self.client = client
+        self.express_key = express_key
+        self.signal_key = signal_key
+        self._enqueue = client.register_script(ENQUEUE_SCRIPT)
+        self._dequeue = client.register_script(DEQUEUE_SCRIPT)
+
+    def weights(self, priority: str, teacher_id, class_id) -> tuple:
+        overrides = self.client.hmget(WEIGHT_OVERRIDES_KEY, f"teacher:{teacher_id}", f"class:{class_id}")
+        return (
+            PRIORITY_WEIGHTS.get(priority, 1.0),
+            float(overrides[0] or 1),
+            float(overrides[1] or 1),
+        )
+
+    def enqueue(self, job_id: str, payload: str, priority: str, teacher_id, class_id, due_ts: float, enqueued_at: float):
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown grading priority '{priority}'.")
+        teacher_node = f"{priority}/teacher:{teacher_id}"
+        class_node = f"{teacher_node}/class:{class_id}"
+        # Equal due dates fall back to FIFO: ZSET ties are ordered by member
+        member = f"{int(enqueued_at * 1000):015d}:{job_id}"
+        self._enqueue(args=[
+            SCHEDULER_PREFIX, priority, teacher_node, class_node, member, payload, due_ts,
+            *self.weights(priority, teacher_id, class_id), self.signal_key, MAX_SIGNALS,
+        ])
+
+    def dequeue(self, processing_key: str) -> str | None:
+        """Moves the next job onto processing_key and returns it (None if nothing is queued)."""
+        while True:
+            payload = self._dequeue(keys=[self.express_key, processing_key], args=[SCHEDULER_PREFIX])
+            if payload is None:
+                return None
+            if payload != "":
+                return payload
+            # A job id without payload (already removed): its pass was still charged, try the next one
+
+    def wait_for_work(self, timeout: int):
+        """Blocks until something is enqueued (or timeout seconds pass)."""
+        self.client.blpop(self.signal_key, timeout)
+
+    def pending(self) -> int:
+        return self.client.hlen(f"{SCHEDULER_PREFIX}payload")
@@ -0,0 +1,65 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600))) # Seconds a result is replayed for its key
+IDEMPOTENCY_CLAIM_TTL = 120 # Seconds a request may hold its key before a retry may run it again
+KEY_PREFIX = "idempotency:"
+IN_PROGRESS = "__in_progress__"
+
+# Deletes KEYS[1] only while it still holds the in-progress marker ARGV[1]
+RELEASE_CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RequestInProgress(Exception):
+    """A request with the same idempotency key is still being processed."""
+
+
+def _key(scope: str, key: str) -> str:
+    return f"{KEY_PREFIX}{scope}:{key}"
+
+
+def _redis():
+    from lib.grading_queue import get_redis
+    return get_redis()
+
+
+def claim(scope: str, key: str) -> str | None:
+    """
+    Claims an idempotency key for a request. Returns None if this request should
+    run, or the result stored by an earlier request with the same key (to be
+    returned as is). Raises RequestInProgress while that earlier request runs.
+    Without Redis every request runs.
+    """
+    try:
+        r = _redis()
+        if r.set(_key(scope, key), IN_PROGRESS, nx=True, ex=IDEMPOTENCY_CLAIM_TTL):
+            return None
+        previous = r.get(_key(scope, key))
+    except Exception as e:
+        logger.warning("Idempotency check failed (%s); processing the request.", e)
+        return None
+    if previous == IN_PROGRESS:
+        raise RequestInProgress("This request is already being processed.")
+    return previous # None if the claim expired in between: run it
+
+
+def store_result(scope: str, key: str, result: str):
+    """Records a claimed request's result, replayed to repeats of the key for IDEMPOTENCY_TTL."""
+    try:
+        _redis().set(_key(scope, key), result, ex=IDEMPOTENCY_TTL)
+    except Exception as e:
+        logger.warning("Could not store idempotent result: %s", e)
+
+
+def release(scope: str, key: str):
+    """Gives up a claim whose request failed, so a retry with the same key runs at once."""
+    try:
+        _redis().eval(RELEASE_CLAIM_SCRIPT, 1, _key(scope, key), IN_PROGRESS)
+    except Exception as e:
+        logger.warning("Could not release idempotency key: %s", e)
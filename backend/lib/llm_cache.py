@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+# The cache stores live in backend-fastapi/content_cache.py (shared with the extraction cache),
+# token counting in backend-fastapi/prompt_builder.py
+FASTAPI_SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend-fastapi'))
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+from content_cache import RedisLRUStore, make_store
+from latency_metrics import timed
+from prompt_builder import count_tokens
+
+from lib.rate_limiter import call_openai
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Set LLM_CACHE_ENABLED=0 to send every request to the model (reads and writes are both skipped)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_NAMESPACE = "llm"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))) # Seconds
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Redis hash the counters are mirrored into for every process. Set LLM_CACHE_SHARED_STATS=0
+# to keep them in this process only (STATS_KEY is then None, as the benchmark sets it)
+STATS_KEY = f"{LLM_CACHE_NAMESPACE}:__stats__" if os.getenv("LLM_CACHE_SHARED_STATS", "1") != "0" else None
+
+_counters = {"hits": 0, "misses": 0, "bypassed": 0, "errors": 0}
+COMPLETION_TOKEN_ESTIMATE = 300 # Reserved per request in the tokens/minute bucket until real usage is known
+
+# Token usage of the requests that reached the model; cached_prompt_tokens is the part
+# of prompt_tokens the provider served from its prompt (prefix) cache
+_token_counters = {"prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0}
+_counters_lock = threading.Lock()
+
+
+def fingerprint(model: str, messages, **params) -> str:
+    """
+    Stable SHA-256 of a request: the model, the messages and every other parameter
+    (temperature, response_format, ...). Key order does not matter.
+    """
+    request = {"model": model, "messages": messages, "params": params}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+
+def _store():
+    return make_store(LLM_CACHE_NAMESPACE, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL)
+
+
+def _count(event: str, amount: int = 1):
+    with _counters_lock:
+        counters = _counters if event in _counters else _token_counters
+        counters[event] += amount
+    # Mirror into Redis so counters cover every worker process
+    try:
+        store = _store()
+        if STATS_KEY and isinstance(store, RedisLRUStore):
+            store.client.hincrby(STATS_KEY, event, amount)
+    except Exception:
+        pass
+
+
+def record_usage(usage):
+    """Adds a completion's token usage (including provider-cached prompt tokens) to the counters."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    logger.debug("Prompt tokens %s (%s cached by the provider), completion tokens %s.", prompt_tokens, cached, completion_tokens)
+    _count("prompt_tokens", prompt_tokens)
+    _count("cached_prompt_tokens", cached)
+    _count("completion_tokens", completion_tokens)
+
+
+def stats() -> dict:
+    """
+    Hit/miss counters and token usage (across processes when Redis backs the
+    cache, else for this process).
+    """
+    events = list(_counters) + list(_token_counters)
+    try:
+        store = _store()
+        if STATS_KEY and isinstance(store, RedisLRUStore):
+            shared = store.client.hgetall(STATS_KEY)
+            counts = {event: int(shared.get(event.encode(), shared.get(event, 0))) for event in events}
+        else:
+            with _counters_lock:
+                counts = {**_counters, **_token_counters}
+    except Exception:
+        with _counters_lock:
+            counts = {**_counters, **_token_counters}
+    lookups = counts["hits"] + counts["misses"]
+    counts["hit_rate"] = round(counts["hits"] / lookups, 3) if lookups else 0.0
+    prompt_tokens = counts["prompt_tokens"]
+    counts["cached_prompt_token_rate"] = round(counts["cached_prompt_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0
+    return counts
+
+
+def cached_response(key: str, compute, use_cache: bool = True) -> str:
+    """
+    Returns the cached text for key, or calls compute() and caches its result.
+    use_cache=False (a deliberate regrade) skips the lookup but still refreshes the entry.
+    Exceptions from compute() propagate and nothing is cached.
+    """
+    if not LLM_CACHE_ENABLED:
+        return compute()
+
+    if use_cache:
+        try:
+            cached = _store().get(key)
+        except Exception as e:
+            logger.warning("LLM cache read failed: %s", e)
+            cached = None
+            _count("errors")
+        if cached is not None:
+            _count("hits")
+            return cached.decode("utf-8")
+        _count("misses")
+    else:
+        _count("bypassed")
+
+    value = compute()
+    if value:
+        try:
+            _store().set(key, value.encode("utf-8"))
+        except Exception as e:
+            logger.warning("LLM cache write failed: %s", e)
+            _count("errors")
+    return value
+
+
+def estimate_tokens(messages) -> int:
+    """Prompt tokens of the messages plus a typical completion, for the rate limiter's token bucket."""
+    return sum(count_tokens(str(message.get("content", ""))) for message in messages) + COMPLETION_TOKEN_ESTIMATE
+
+
+def chat_completion_content(client, use_cache: bool = True, **request) -> str:
+    """
+    client.chat.completions.create(**request), returning the first choice's message
+    content; identical requests are answered from the cache. Model calls go through
+    the shared OpenAI rate limiter, waiting for capacity instead of failing on 429s.
+    """
+    def create():
+        with timed("downstream_request_duration_seconds", service="openai"):
+            return client.chat.completions.create(**request)
+
+    def compute():
+        completion = call_openai(create, estimate_tokens(request.get("messages", ())))
+        record_usage(completion.usage)
+        return completion.choices[0].message.content
+
+    return cached_response(fingerprint(**request), compute, use_cache=use_cache)
+
+
+def discard(**request):
+    """Drops a cached response, e.g. one that turned out to be unparseable, so it is not replayed."""
+    if not LLM_CACHE_ENABLED:
+        return
+    try:
+        _store().delete(fingerprint(**request))
+    except Exception as e:
+        logger.warning("LLM cache delete failed: %s", e)
@@ -0,0 +1,198 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# time.monotonic() deadline of the stage attempt running in this context (None = no limit)
+_stage_deadline = contextvars.ContextVar("stage_deadline", default=None)
+
+
+class StageTimeout(Exception):
+    """Raised when a stage attempt exceeds its timeout."""
+
+
+def stage_time_left() -> float | None:
+    """
+    Seconds until the current stage attempt times out, for work inside a stage
+    that waits (e.g. for rate limit capacity) and should give up before its
+    stage does. None outside a stage or for stages without a timeout.
+    """
+    deadline = _stage_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class RunCancelled(Exception):
+    """Raised by a run's cancel check to abandon it (see StageGraph.run)."""
+
+
+class Stage:
+    """
+    A named unit of pipeline work.
+
+    func is called with one keyword argument per name in `inputs`; each name is
+    either a run argument or another stage's name. The return value is published
+    under the stage's own name for downstream stages.
+
+    Args:
+        name: Unique stage name (also the name of its output).
+        func: Callable producing the stage's output.
+        inputs: Names of the values the stage depends on.
+        timeout: Seconds an attempt may run before it is abandoned (None = no limit).
+        retries: Extra attempts after a failure matching retry_on.
+        retry_on: Exception types worth retrying (timeouts are always retryable).
+        backoff: Seconds before the first retry, doubled for each further one.
+    """
+
+    def __init__(self, name: str, func, inputs=(), timeout: float | None = None, retries: int = 0,
+                 retry_on: tuple = (Exception,), backoff: float = 1.0):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_on = tuple(retry_on) + (StageTimeout,)
+        self.backoff = backoff
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={list(self.inputs)})"
+
+
+class StageGraph:
+    """
+    A DAG of stages. run() starts every stage as soon as its inputs are available,
+    so independent stages (e.g. essay and rubric parsing) execute concurrently.
+    Stages can be added, replaced or removed before a run without touching the others.
+    """
+
+    def __init__(self, stages=()):
+        self.stages = {}
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage: Stage) -> "StageGraph":
+        if stage.name in self.stages:
+            raise ValueError(f"Stage '{stage.name}' already exists; use replace() to swap it.")
+        self.stages[stage.name] = stage
+        return self
+
+    def replace(self, stage: Stage) -> "StageGraph":
+        if stage.name not in self.stages:
+            raise KeyError(f"No stage named '{stage.name}' to replace.")
+        self.stages[stage.name] = stage
+        return self
+
+    def remove(self, name: str) -> "StageGraph":
+        del self.stages[name]
+        return self
+
+    def validate(self, provided=()):
+        """Checks every input resolves to a run argument or a stage, and that there are no cycles."""
+        known = set(provided) | set(self.stages)
+        for stage in self.stages.values():
+            missing = [name for name in stage.inputs if name not in known]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown input(s): {missing}")
+        resolved = set(provided)
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items() if all(i in resolved for i in stage.inputs)]
+            if not ready:
+                raise ValueError(f"Stage graph has a cycle among: {sorted(remaining)}")
+            for name in ready:
+                resolved.add(name)
+                del remaining[name]
+
+    def run(self, max_workers: int | None = None, listener=None, cancel=None, **provided) -> dict:
+        """
+        Runs the graph and returns every value (run arguments plus stage outputs).
+
+        listener, if given, may define on_stage_start(name, attempt) and
+        on_stage_end(name, duration, attempts, error) to observe execution.
+        cancel, if given, is called before each stage starts; an exception it
+        raises stops the run (stages already running finish in the background).
+        The first stage that fails after its retries stops the run; its exception is re-raised.
+        """
+        self.validate(provided)
+        values = dict(provided)
+        pending = dict(self.stages)
+        running = {} # future -> (stage, attempt, deadline)
+        attempts = {}
+        stage_started = {}
+        # Enough threads for every attempt, since an abandoned (timed out) attempt keeps its thread
+        default_workers = sum(1 + stage.retries for stage in self.stages.values())
+        executor = ThreadPoolExecutor(max_workers=max_workers or max(1, default_workers), thread_name_prefix="stage")
+
+        def notify(event, *args):
+            handler = getattr(listener, event, None)
+            if handler is not None:
+                try:
+                    handler(*args)
+                except Exception as e:
+                    logger.warning("Pipeline listener %s failed: %s", event, e)
+
+        def submit(stage, delay=0.0):
+            attempt = attempts.get(stage.name, 0) + 1
+            attempts[stage.name] = attempt
+            stage_started.setdefault(stage.name, time.monotonic())
+            kwargs = {name: values[name] for name in stage.inputs}
+
+            deadline = time.monotonic() + delay + stage.timeout if stage.timeout else None
+
+            def call():
+                if delay:
+                    time.sleep(delay)
+                notify("on_stage_start", stage.name, attempt)
+                _stage_deadline.set(deadline)
+                return stage.func(**kwargs)
+
+            # Stages run in a copy of the caller's context (keeps e.g. the run's log correlation ID)
+            running[executor.submit(contextvars.copy_context().run, call)] = (stage, attempt, deadline)
+
+        def finish(stage, error=None):
+            duration = time.monotonic() - stage_started[stage.name]
+            notify("on_stage_end", stage.name, duration, attempts[stage.name], error)
+
+        def retry_or_raise(stage, attempt, error):
+            if attempt <= stage.retries and isinstance(error, stage.retry_on):
+                delay = stage.backoff * (2 ** (attempt - 1))
+                logger.warning("Stage '%s' attempt %s failed (%s). Retrying in %.1fs...", stage.name, attempt, error, delay)
+                submit(stage, delay)
+                return
+            finish(stage, error)
+            raise error
+
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(i in values for i in stage.inputs):
+                        if cancel is not None:
+                            cancel()
+                        del pending[name]
+                        submit(stage)
+
+                deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+                wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, attempt, _ = running.pop(future)
+                    try:
+                        values[stage.name] = future.result()
+                    except Exception as error:
+                        retry_or_raise(stage, attempt, error)
+                        continue
+                    finish(stage)
+
+                now = time.monotonic()
+                for future, (stage, attempt, deadline) in list(running.items()):
+                    if deadline is not None and now >= deadline and not future.done():
+                        # The thread cannot be killed; its late result is simply ignored
+                        running.pop(future)
+                        future.cancel()
+                        retry_or_raise(stage, attempt, StageTimeout(f"Stage '{stage.name}' timed out after {stage.timeout}s"))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return values
@@ -0,0 +1,302 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+import openai
+
+from lib.pipeline import stage_time_left
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Account-wide OpenAI limits, shared by every grading process through Redis
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+# AIMD window on in-flight requests (cluster-wide): +1 per window of successes, halved on a 429
+OPENAI_MIN_CONCURRENCY = int(os.getenv("OPENAI_MIN_CONCURRENCY", "1"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_INITIAL_CONCURRENCY = int(os.getenv("OPENAI_INITIAL_CONCURRENCY", "8"))
+# How long a call may wait for capacity before giving up (less inside a grading stage: see call_openai)
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "600"))
+# Attempts per call for 429 / 5xx / connection errors (this limiter retries, not the SDK)
+OPENAI_CALL_ATTEMPTS = int(os.getenv("OPENAI_CALL_ATTEMPTS", "6"))
+DECREASE_COOLDOWN = 2.0 # Seconds; one burst of 429s halves the window only once
+LEASE_TTL = 300 # Seconds; leases of crashed processes expire on their own
+POLL_INTERVAL = 0.05
+KEY_PREFIX = "ratelimit:openai"
+
+
+class RateLimitTimeout(Exception):
+    """
+    No OpenAI capacity became available before the call's deadline (or retries
+    ran out on 429s). The grading queue requeues the job for a later run.
+    """
+
+
+# KEYS: rpm bucket, tpm bucket. ARGV: now, rpm limit, tpm limit, tokens wanted.
+# Refills both buckets, then takes 1 request + the tokens if both have room.
+# Returns 0 on success, else the milliseconds to wait before trying again.
+TAKE_TOKENS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local function refill(key, limit)
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or limit
+  local ts = tonumber(state[2]) or now
+  return math.min(limit, tokens + math.max(0, now - ts) * limit / 60)
+end
+local rpm, tpm, wanted = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local requests = refill(KEYS[1], rpm)
+local tokens = refill(KEYS[2], tpm)
+local needed = math.min(wanted, tpm)
+local wait = 0
+if requests >= 1 and tokens >= needed then
+  requests = requests - 1
+  tokens = tokens - wanted
+else
+  if requests < 1 then wait = math.max(wait, (1 - requests) * 60 / rpm) end
+  if tokens < needed then wait = math.max(wait, (needed - tokens) * 60 / tpm) end
+end
+redis.call('HSET', KEYS[1], 'tokens', requests, 'ts', now)
+redis.call('HSET', KEYS[2], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return math.ceil(wait * 1000)
+"""
+
+# KEYS: leases zset, state hash. ARGV: now, lease id, lease ttl, initial limit.
+# Returns 0 if a lease was granted, ms to wait if OpenAI asked us to back off, -1 if the window is full.
+ACQUIRE_LEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local blocked = tonumber(redis.call('HGET', KEYS[2], 'blocked_until') or '0')
+if blocked > now then return math.ceil((blocked - now) * 1000) end
+local limit = tonumber(redis.call('HGET', KEYS[2], 'limit') or ARGV[4])
+if redis.call('ZCARD', KEYS[1]) < math.max(1, math.floor(limit)) then
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+  return 0
+end
+return -1
+"""
+
+# KEYS: state hash. ARGV: now, min, max, initial, retry-after seconds, cooldown.
+THROTTLED_SCRIPT = """
+local now = tonumber(ARGV[1])
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit') or ARGV[4])
+local last = tonumber(redis.call('HGET', KEYS[1], 'last_decrease') or '0')
+if now - last >= tonumber(ARGV[6]) then
+  limit = math.max(tonumber(ARGV[2]), limit / 2)
+  redis.call('HSET', KEYS[1], 'limit', limit, 'last_decrease', now)
+end
+local until_ts = now + tonumber(ARGV[5])
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0')
+if until_ts > blocked then redis.call('HSET', KEYS[1], 'blocked_until', until_ts) end
+return tostring(limit)
+"""
+
+# KEYS: state hash. ARGV: max, initial. Additive increase: +1 per `limit` successes.
+SUCCEEDED_SCRIPT = """
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit') or ARGV[2])
+limit = math.min(tonumber(ARGV[1]), limit + 1 / math.max(1, limit))
+redis.call('HSET', KEYS[1], 'limit', limit)
+return tostring(limit)
+"""
+
+
+class OpenAIRateLimiter:
+    """
+    Coordinates every process's OpenAI calls through Redis:
+    - token buckets for requests/minute and tokens/minute,
+    - an AIMD concurrency window (leases) that halves on 429s and grows on success,
+    - a shared back-off deadline taken from retry-after headers.
+    Callers wait (up to RATE_LIMIT_MAX_WAIT) for capacity instead of failing.
+    If Redis is unreachable the limiter lets calls through, and only retries apply.
+    """
+
+    def __init__(self, redis_client=None, key_prefix: str = KEY_PREFIX):
+        self.key_prefix = key_prefix
+        self._redis = redis_client
+        self._scripts = None
+        self._lock = threading.Lock()
+        self._warned = False
+
+    def _client(self):
+        if self._redis is None:
+            from lib.grading_queue import get_redis
+            self._redis = get_redis()
+        if self._scripts is None:
+            with self._lock:
+                if self._scripts is None:
+                    self._scripts = {
+                        "take": self._redis.register_script(TAKE_TOKENS_SCRIPT),
+                        "acquire": self._redis.register_script(ACQUIRE_LEASE_SCRIPT),
+                        "throttled": self._redis.register_script(THROTTLED_SCRIPT),
+                        "succeeded": self._redis.register_script(SUCCEEDED_SCRIPT),
+                    }
+        return self._redis
+
+    def _unavailable(self, e):
+        if not self._warned:
+            self._warned = True
+            logger.warning("OpenAI rate limiter unavailable (%s); calls are not coordinated across workers.", e)
+
+    @property
+    def state_key(self):
+        return f"{self.key_prefix}:state"
+
+    def acquire(self, estimated_tokens: int, deadline: float) -> str | None:
+        """Waits for a concurrency lease and bucket capacity. Returns the lease id (None if Redis is down)."""
+        lease_id = uuid.uuid4().hex
+        try:
+            self._client()
+            # 1. A slot in the concurrency window (also honours a shared retry-after)
+            while True:
+                wait_ms = self._scripts["acquire"](
+                    keys=[f"{self.key_prefix}:leases", self.state_key],
+                    args=[time.time(), lease_id, LEASE_TTL, OPENAI_INITIAL_CONCURRENCY],
+                )
+                if wait_ms == 0:
+                    break
+                self._sleep(wait_ms / 1000 if wait_ms > 0 else POLL_INTERVAL, deadline)
+            # 2. Request and token budget for this minute
+            try:
+                while True:
+                    wait_ms = self._scripts["take"](
+                        keys=[f"{self.key_prefix}:rpm", f"{self.key_prefix}:tpm"],
+                        args=[time.time(), OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, estimated_tokens],
+                    )
+                    if wait_ms == 0:
+                        return lease_id
+                    self._sleep(wait_ms / 1000, deadline)
+            except BaseException:
+                self.release(lease_id)
+                raise
+        except RateLimitTimeout:
+            raise
+        except Exception as e:
+            self._unavailable(e)
+            return None
+
+    def release(self, lease_id: str | None):
+        if lease_id is None:
+            return
+        try:
+            self._client().zrem(f"{self.key_prefix}:leases", lease_id)
+        except Exception as e:
+            self._unavailable(e)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Charges the tokens/minute bucket for the difference between the estimate and real usage."""
+        if not actual_tokens or actual_tokens == estimated_tokens:
+            return
+        try:
+            self._client().hincrbyfloat(f"{self.key_prefix}:tpm", "tokens", estimated_tokens - actual_tokens)
+        except Exception as e:
+            self._unavailable(e)
+
+    def succeeded(self):
+        try:
+            self._client()
+            self._scripts["succeeded"](keys=[self.state_key], args=[OPENAI_MAX_CONCURRENCY, OPENAI_INITIAL_CONCURRENCY])
+        except Exception as e:
+            self._unavailable(e)
+
+    def throttled(self, retry_after: float) -> float | None:
+        """Halves the concurrency window and makes every process wait retry_after seconds."""
+        try:
+            self._client()
+            limit = self._scripts["throttled"](
+                keys=[self.state_key],
+                args=[time.time(), OPENAI_MIN_CONCURRENCY, OPENAI_MAX_CONCURRENCY, OPENAI_INITIAL_CONCURRENCY,
+                      retry_after, DECREASE_COOLDOWN],
+            )
+            return float(limit)
+        except Exception as e:
+            self._unavailable(e)
+            return None
+
+    def clear(self):
+        """Deletes this limiter's Redis state (leases, buckets, window)."""
+        try:
+            self._client().delete(*(f"{self.key_prefix}:{name}" for name in ("leases", "state", "rpm", "tpm")))
+        except Exception as e:
+            self._unavailable(e)
+
+    def _sleep(self, seconds: float, deadline: float):
+        if time.monotonic() + seconds > deadline:
+            raise RateLimitTimeout("No OpenAI capacity before the call's deadline.")
+        time.sleep(seconds)
+
+
+def retry_after_seconds(error) -> float:
+    """
+    The back-off an OpenAI error asks for (retry-after-ms / retry-after headers),
+    else 0.0: the caller then falls back to its own jittered exponential backoff.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                pass
+    return 0.0
+
+
+_limiter = OpenAIRateLimiter()
+
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+def call_openai(create, estimated_tokens: int):
+    """
+    Runs create() (an OpenAI request) under the shared rate limits, retrying 429s
+    (after the server's retry-after, shrinking the concurrency window) and
+    transient 5xx/connection errors with jittered exponential backoff. A 429 for
+    insufficient_quota is raised at once.
+    Raises RateLimitTimeout if capacity does not free up within RATE_LIMIT_MAX_WAIT,
+    or before the calling pipeline stage would time out: a call its stage has
+    abandoned must not go on to take a lease and spend quota.
+    """
+    deadline = time.monotonic() + RATE_LIMIT_MAX_WAIT
+    stage_left = stage_time_left()
+    if stage_left is not None:
+        deadline = min(deadline, time.monotonic() + stage_left)
+    for attempt in range(1, OPENAI_CALL_ATTEMPTS + 1):
+        if time.monotonic() >= deadline:
+            raise RateLimitTimeout("No OpenAI capacity before the call's deadline.")
+        lease_id = _limiter.acquire(estimated_tokens, deadline)
+        try:
+            completion = create()
+        except openai.RateLimitError as e:
+            _limiter.release(lease_id)
+            if e.code == "insufficient_quota":
+                raise # Out of credits, not over a rate limit: retrying only delays the failure
+            backoff = retry_after_seconds(e) or min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+            limit = _limiter.throttled(backoff)
+            logger.warning("OpenAI returned 429 (attempt %s); waiting %.1fs, concurrency window now %s.",
+                           attempt, backoff, "unchanged" if limit is None else f"{limit:.1f}")
+            if attempt == OPENAI_CALL_ATTEMPTS:
+                raise RateLimitTimeout(f"OpenAI kept rate limiting after {attempt} attempts: {e}")
+            if lease_id is None:
+                _limiter._sleep(backoff, deadline) # No shared back-off without Redis
+            continue
+        except RETRYABLE_ERRORS as e:
+            _limiter.release(lease_id)
+            if attempt == OPENAI_CALL_ATTEMPTS:
+                raise
+            backoff = retry_after_seconds(e) or min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+            logger.warning("OpenAI call failed (%s); retrying in %.1fs (attempt %s).", e, backoff, attempt)
+            _limiter._sleep(backoff, deadline)
+            continue
+        except BaseException:
+            _limiter.release(lease_id)
+            raise
+        _limiter.release(lease_id)
+        _limiter.succeeded()
+        usage = getattr(completion, "usage", None)
+        _limiter.settle(estimated_tokens, getattr(usage, "total_tokens", 0) or 0)
+        return completion
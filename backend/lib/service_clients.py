@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+
+import httpx
+import requests
+from openai import DefaultHttpxClient, OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Latency histograms and logging live in backend-fastapi/ (shared with the FastAPI service)
+FASTAPI_SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend-fastapi'))
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+from latency_metrics import timed
+from structured_logging import REQUEST_ID_HEADER, get_correlation_id
+
+# --- Configuration ---
+# Connections kept alive per downstream service (size it to worker threads x trait fan-out)
+SERVICE_POOL_SIZE = int(os.getenv("SERVICE_POOL_SIZE", "16"))
+SERVICE_MAX_RETRIES = int(os.getenv("SERVICE_MAX_RETRIES", "3"))
+SERVICE_BACKOFF_FACTOR = float(os.getenv("SERVICE_BACKOFF_FACTOR", "0.5")) # Sleeps 0.5s, 1s, 2s, ...
+SERVICE_BACKOFF_JITTER = float(os.getenv("SERVICE_BACKOFF_JITTER", "0.5")) # Plus up to this many random seconds
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "32"))
+# The SDK's own retries stay off (0): lib/rate_limiter.py retries 429/5xx and coordinates back-off across workers
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+REQUEST_TIMEOUT = 180
+
+_sessions = {}
+_openai_client = None
+_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=SERVICE_MAX_RETRIES,
+        connect=SERVICE_MAX_RETRIES, # The request never reached the service
+        # Never resend a request that timed out or broke off mid-response: the service may
+        # still be running it (a slow OCR or LLM call), and the stage retry covers that case
+        read=0,
+        other=0,
+        backoff_factor=SERVICE_BACKOFF_FACTOR,
+        backoff_jitter=SERVICE_BACKOFF_JITTER,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None, # Also retry POST on 429/5xx, where the service answered without doing the work
+        respect_retry_after_header=True,
+        raise_on_status=False, # Hand the final response to raise_for_status() as before
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SERVICE_POOL_SIZE, max_retries=retry, pool_block=True)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(service: str) -> requests.Session:
+    """
+    Returns the process-wide keep-alive session for a downstream service
+    (e.g. "pdfparse", "parse_rubric", "score_essay"), creating it on first use.
+    Sessions are shared by every thread; each keeps its own connection pool.
+    """
+    session = _sessions.get(service)
+    if session is None:
+        with _lock:
+            session = _sessions.get(service)
+            if session is None:
+                session = _sessions[service] = _build_session()
+    return session
+
+
+def post(service: str, url: str, **kwargs) -> requests.Response:
+    """
+    requests.post through the service's pooled session (retries connection errors and 429/5xx
+    with jittered backoff, never read timeouts).
+    The latency, retries included, is recorded per service. The current
+    correlation ID is forwarded so the service's logs can be matched up.
+    """
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    request_id = get_correlation_id()
+    if request_id:
+        kwargs["headers"] = {REQUEST_ID_HEADER: request_id, **(kwargs.get("headers") or {})}
+    with timed("downstream_request_duration_seconds", service=service):
+        return get_session(service).post(url, **kwargs)
+
+
+def get_openai_client() -> OpenAI:
+    """Returns the process-wide OpenAI client, sharing one keep-alive connection pool."""
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("CRITICAL: Missing OPENAI_API_KEY in environment variables. Grading cannot proceed.")
+                _openai_client = OpenAI(
+                    api_key=api_key,
+                    timeout=REQUEST_TIMEOUT,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=DefaultHttpxClient(
+                        limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE)
+                    ),
+                )
+    return _openai_client
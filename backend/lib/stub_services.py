@@ -0,0 +1,212 @@
+import hashlib
+import http.server
+import json
+import math
+import random
+import threading
+import time
+
+# Stand-ins for the grading pipeline's downstream services (PDF parsing, rubric
+# trait parsing, HF scoring and the OpenAI chat endpoint), so the pipeline can be
+# benchmarked offline. Each service answers after a delay drawn from its latency
+# model and fails with a configurable probability.
+
+STUB_TRAITS = {
+    "Ideas": "3 = Clear, insightful thesis\n2 = Adequate thesis\n1 = Vague thesis\n0 = No thesis",
+    "Organization": "3 = Logical structure\n2 = Mostly organized\n1 = Hard to follow\n0 = No structure",
+    "Evidence": "3 = Strong, relevant support\n2 = Some support\n1 = Little support\n0 = None",
+    "Conventions": "3 = Few errors\n2 = Some errors\n1 = Many errors\n0 = Errors block meaning",
+}
+
+SERVICES = ("pdfparse", "parse_rubric", "score_essay", "openai")
+
+
+class LatencyModel:
+    """
+    A response-time distribution parsed from "fixed:S", "uniform:LOW,HIGH" or
+    "lognormal:MEDIAN,SIGMA" (seconds). A bare number means fixed.
+    """
+
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+        self.kind = kind
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        try:
+            self.params = [float(arg) for arg in args.split(",") if arg]
+        except ValueError:
+            self.params = []
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec '{spec}' (use fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA)")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def __repr__(self):
+        return f"LatencyModel({self.spec!r})"
+
+
+class ServiceProfile:
+    """How one stub service behaves: its latency model and the share of requests that fail."""
+
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0, error_status: int = 503):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+
+DEFAULT_PROFILES = {
+    "pdfparse": ServiceProfile("lognormal:0.4,0.5"),
+    "parse_rubric": ServiceProfile("lognormal:2.0,0.4"),
+    "score_essay": ServiceProfile("lognormal:1.5,0.5"),
+    "openai": ServiceProfile("lognormal:1.2,0.6", error_status=429),
+}
+
+
+def stub_essay_text(pdf_bytes: bytes) -> str:
+    """Text the stub parser "extracts": unique per file, so content/text fingerprints never collide."""
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    return f"Essay {digest}. " + "The author argues a point and supports it with examples. " * 40
+
+
+def _trait_score(*parts) -> int:
+    return int(hashlib.sha256("|".join(parts).encode()).hexdigest(), 16) % 4
+
+
+class StubServices:
+    """
+    Runs every stub service on one local threaded HTTP server. Use as a context
+    manager, or start()/stop(); urls maps each service to its endpoint.
+    """
+
+    def __init__(self, profiles: dict = None, seed: int = None):
+        self.profiles = dict(DEFAULT_PROFILES)
+        self.profiles.update(profiles or {})
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.requests = {service: 0 for service in SERVICES}
+        self.errors = {service: 0 for service in SERVICES}
+        self._counts_lock = threading.Lock()
+        self.server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def urls(self) -> dict:
+        return {
+            "pdfparse": f"{self.base_url}/api/pdfparse",
+            "parse_rubric": f"{self.base_url}/api/parse-rubric",
+            "score_essay": f"{self.base_url}/api/huggingface",
+            "openai": f"{self.base_url}/v1",
+        }
+
+    def start(self) -> "StubServices":
+        stubs = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, payload = stubs.handle(self.path, self.headers.get("Content-Type", ""), body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="stub-services").start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counts(self):
+        with self._counts_lock:
+            for service in SERVICES:
+                self.requests[service] = 0
+                self.errors[service] = 0
+
+    # --- Request handling ---
+
+    def handle(self, path: str, content_type: str, body: bytes) -> tuple[int, dict]:
+        routes = {
+            "/api/pdfparse": ("pdfparse", self.pdfparse),
+            "/api/parse-rubric": ("parse_rubric", self.parse_rubric),
+            "/api/huggingface": ("score_essay", self.score_essay),
+            "/v1/chat/completions": ("openai", self.chat_completion),
+        }
+        if path not in routes:
+            return 404, {"error": f"No stub for {path}"}
+        service, handler = routes[path]
+        profile = self.profiles[service]
+        with self._rng_lock:
+            delay = profile.latency.sample(self.rng)
+            failed = self.rng.random() < profile.error_rate
+        with self._counts_lock:
+            self.requests[service] += 1
+            if failed:
+                self.errors[service] += 1
+        time.sleep(delay)
+        if failed:
+            return profile.error_status, {"error": {"message": f"Injected {service} failure", "type": "stub_error"}}
+        return 200, handler(content_type, body)
+
+    def pdfparse(self, content_type: str, body: bytes) -> dict:
+        # The multipart body embeds the PDF bytes; hashing all of it is enough to tell files apart
+        return {"generic_text": stub_essay_text(body), "generic_tables": []}
+
+    def parse_rubric(self, content_type: str, body: bytes) -> dict:
+        return STUB_TRAITS
+
+    def score_essay(self, content_type: str, body: bytes) -> dict:
+        request = json.loads(body)
+        return {"scores": [
+            {"trait": trait["name"], "score": float(_trait_score(request["essay"][:80], trait["name"]))}
+            for trait in request["traits"]
+        ]}
+
+    def chat_completion(self, content_type: str, body: bytes) -> dict:
+        request = json.loads(body)
+        prompt = request["messages"][-1]["content"]
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            names = response_format["json_schema"]["schema"]["properties"]
+            content = json.dumps({
+                name: {"feedback": f"Stub feedback for {name}.", "score": _trait_score(prompt[:200], name)}
+                for name in names
+            })
+        else:
+            content = f"Stub feedback that explains the score for this trait.\n{_trait_score(prompt)}"
+        prompt_tokens = len(prompt) // 4
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                      "total_tokens": prompt_tokens + len(content) // 4},
+        }
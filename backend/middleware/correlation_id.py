@@ -0,0 +1,17 @@
+from structured_logging import REQUEST_ID_HEADER, correlation, incoming_correlation_id
+
+
+class CorrelationIdMiddleware:
+    """
+    Tags everything logged while handling a request (and the grading jobs it
+    enqueues) with the caller's X-Request-ID, or a fresh ID, echoed back in the response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with correlation(incoming_correlation_id(request.headers.get(REQUEST_ID_HEADER))) as request_id:
+            response = self.get_response(request)
+        response.headers[REQUEST_ID_HEADER] = request_id
+        return response
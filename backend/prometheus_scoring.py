@@ -1,12 +1,28 @@
 # prometheus_scoring.py
 
 # Added UploadFile back for the extract_rubric_from_pdf function
-from fastapi import APIRouter, Request, HTTPException, UploadFile
+from fastapi import APIRouter, HTTPException, UploadFile
 from pydantic import BaseModel
 import json
+import logging
+import os
+import sys
 import time
 import re # For parsing score
-# Removed: requests, os, Body, File (unless extract_rubric_from_pdf needs File)
+# Removed: requests, Body, File (unless extract_rubric_from_pdf needs File)
+
+# Payload sampling and truncation live in backend-fastapi/structured_logging.py, prompt assembly in prompt_builder.py
+FASTAPI_SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend-fastapi")
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+import prompt_builder
+from structured_logging import SAMPLED, payload
+
+logger = logging.getLogger(__name__)
+
+# Prompt tokens per scoring call: below the tokenizer's 4096-token cut (which would drop the
+# rubric and the "###Feedback:" marker at the end), with room for estimation error. The essay is trimmed to fit.
+PROMETHEUS_PROMPT_TOKEN_BUDGET = int(os.getenv("PROMETHEUS_PROMPT_TOKEN_BUDGET", "3584"))
 
 # --- Access Model and Tokenizer from backend.py ---
 # This assumes 'model' and 'tokenizer' are loaded and accessible
@@ -25,9 +41,9 @@ try:
 
 except ImportError:
     # Handle case where backend hasn't loaded them yet or structure is wrong
-    # For now, we'll print a warning and rely on a check within the endpoint.
-    print("⚠️ Warning: Could not import model/tokenizer from backend.py initially.")
-    print("Ensure backend.py loads them before requests hit this endpoint.")
+    # For now, we'll log a warning and rely on a check within the endpoint.
+    logger.warning("Could not import model/tokenizer from backend.py initially; "
+                   "ensure backend.py loads them before requests hit this endpoint.")
     model = None
     tokenizer = None
 
@@ -41,35 +57,17 @@ router = APIRouter()
 
 # --- Refactored Scoring Endpoint ---
 @router.post("/score-essay/")
-async def score_essay_endpoint(request: Request, data: EssayInput):
+async def score_essay_endpoint(data: EssayInput):
     """
     Receives essay text and rubric, formats a prompt for scoring,
     calls the loaded LLM directly, parses the result, and returns score/feedback.
     """
     global model, tokenizer # Reference globals if using that method
-    print("\n✅ Entered score_essay_endpoint (Refactored for Direct LLM Call)")
-
-    # --- Optional: Raw Request Logging ---
-    try:
-        body_bytes = await request.body()
-        body_str = body_bytes.decode('utf-8')
-        print("--- Received Raw Request Body ---")
-        print(f"Body Length: {len(body_bytes)}")
-        print(f"Body Content (Snippet): {body_str[:500]}{'...' if len(body_str) > 500 else ''}")
-        print("---------------------------------\n")
-    except Exception as e:
-        print(f"--- Error reading raw request body: {e} ---\n")
-    # --- End Optional Logging ---
-
-    # --- Log Parsed Data ---
-    print("📦 Data received (after Pydantic parsing)")
-    print(f"📦 Essay Text Snippet: {data.essayText[:200]}...")
-    if isinstance(data.rubric, dict):
-        print(f"📦 Rubric Keys: {list(data.rubric.keys())}")
-    else:
-        print("⚠️ Rubric data is not a dictionary after parsing:", data.rubric)
+    # The body is parsed once by Pydantic; only sizes are logged, the text itself at sampled debug level
+    if not isinstance(data.rubric, dict):
+        logger.warning("Rubric data is not a dictionary after parsing: %s", type(data.rubric).__name__)
         raise HTTPException(status_code=400, detail="Invalid rubric format received.")
-     # --- End Data Logging ---
+    logger.info("Scoring essay (%d chars) against rubric keys %s.", len(data.essayText), list(data.rubric))
 
     # --- Check if model/tokenizer were loaded ---
     if model is None or tokenizer is None:
@@ -79,9 +77,9 @@ async def score_essay_endpoint(request: Request, data: EssayInput):
              tokenizer = backend_tokenizer
              if model is None or tokenizer is None:
                  raise ImportError("Model or tokenizer still None after re-import attempt")
-             print("✅ Successfully accessed model/tokenizer on second attempt.")
+             logger.info("Accessed model/tokenizer on second attempt.")
          except ImportError as e:
-              print("❌ CRITICAL: Model or Tokenizer not loaded/accessible from backend.py")
+              logger.critical("Model or tokenizer not loaded/accessible from backend.py")
               raise HTTPException(status_code=500, detail=f"Model/Tokenizer not available: {e}")
 
     # --- 1. Format Scoring Prompt ---
@@ -93,36 +91,34 @@ An instruction (might include an Input inside it), a response to evaluate, a ref
 4. Please do not generate any other opening, closing, and explanations."""
 
     try:
-        rubric_str = json.dumps(data.rubric, indent=2)
+        rubric_str = json.dumps(data.rubric, separators=(",", ":"), ensure_ascii=False) # Compact: indentation only costs tokens
     except TypeError as e:
-        print(f"❌ Error converting rubric to JSON: {e}")
+        logger.warning("Could not convert rubric to JSON: %s", e)
         raise HTTPException(status_code=400, detail=f"Invalid rubric structure: {e}")
 
-    user_prompt = f"""###The instruction to evaluate:
-{data.rubric.get("instruction", "Evaluate the following essay based on the rubric.")}
-
-###Response to evaluate:
-{data.essayText}
-
-###Reference Answer (Score 5):
-{data.rubric.get("reference_answer", "N/A")}
-
-###Score Rubrics:
-{rubric_str}
-
-###Feedback:"""
+    # Prometheus's absolute grading layout; only the essay is trimmed to the token budget
+    user_prompt = prompt_builder.compile_text_prompt(
+        system_prompt,
+        varying=[
+            ("The instruction to evaluate:", data.rubric.get("instruction", "Evaluate the following essay based on the rubric.")),
+            ("Response to evaluate:", prompt_builder.normalize_extracted_text(data.essayText)),
+            ("Reference Answer (Score 5):", data.rubric.get("reference_answer", "N/A")),
+            ("Score Rubrics:", rubric_str),
+            ("Feedback:", ""),
+        ],
+        trim="Response to evaluate:",
+        budget=PROMETHEUS_PROMPT_TOKEN_BUDGET,
+    )
 
     # --- 2. Call LLM Directly ---
     generated_score_feedback = ""
     llm_duration = -1.0
     try:
         model_device = getattr(model, 'device', 'unknown')
-        print(f"🔵 Preparing input for scoring (Device: {model_device})...")
         inputs = tokenizer(user_prompt, return_tensors="pt", truncation=True, max_length=4096)
         input_ids = inputs["input_ids"].to(model_device)
         attention_mask = inputs["attention_mask"].to(model_device)
 
-        print(f"🔵 Generating score/feedback (Input Length: {input_ids.shape[1]})...")
         start_time = time.time()
         outputs = model.generate(
             input_ids,
@@ -133,19 +129,17 @@ An instruction (might include an Input inside it), a response to evaluate, a ref
         )
         end_time = time.time()
         llm_duration = end_time - start_time
-        print(f"✅ LLM generation took {llm_duration:.2f} seconds")
+        logger.info("LLM generation took %.2f seconds (%d input tokens, device %s).", llm_duration, input_ids.shape[1], model_device)
 
         output_ids = outputs[0][input_ids.shape[1]:]
         generated_score_feedback = tokenizer.decode(output_ids, skip_special_tokens=True).strip()
-        print(f"✅ Raw LLM Output Snippet: {generated_score_feedback[:200]}...")
+        logger.debug("Raw LLM output: %s", payload(generated_score_feedback), extra=SAMPLED)
 
     except AttributeError as e:
-        print(f"❌ Error accessing model device or calling generate: {e}")
+        logger.error("Error accessing model device or calling generate: %s", e)
         raise HTTPException(status_code=500, detail=f"Model object error: {e}")
     except Exception as e:
-        print(f"❌ Error during LLM scoring call: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error during LLM scoring call")
         raise HTTPException(status_code=500, detail=f"Error during LLM generation: {e}")
 
     # --- 3. Parse LLM Output ---
@@ -163,19 +157,17 @@ An instruction (might include an Input inside it), a response to evaluate, a ref
                  if 1 <= extracted_score <= 5:
                      score = extracted_score
                      feedback = feedback_part
-                     print(f"✅ Successfully parsed score: {score}")
                  else:
-                     print(f"⚠️ Parsed score {extracted_score} out of range (1-5).")
+                     logger.warning("Parsed score %d out of range (1-5).", extracted_score)
             else:
-                 print("⚠️ Could not find numerical score after [RESULT].")
+                 logger.warning("Could not find numerical score after [RESULT].")
         else:
-            print("⚠️ Marker [RESULT] not found in LLM output.")
+            logger.warning("Marker [RESULT] not found in LLM output.")
     except Exception as e:
-        print(f"❌ Error parsing LLM output: {e}")
+        logger.error("Error parsing LLM output: %s", e)
         score = None # Ensure score is None if parsing failed
 
-    print(f"✅ Final Score: {score}")
-    print(f"✅ Final Feedback Snippet: {feedback[:100]}...")
+    logger.info("Final score: %s", score)
 
     # --- 4. Return Parsed Result ---
     return {"score": score, "feedback": feedback, "llm_duration_sec": round(llm_duration, 2)}
@@ -190,7 +182,7 @@ def extract_rubric_from_pdf(rubric_file: UploadFile):
     For simplicity, assuming the rubric is predefined in this example.
     Actual PDF parsing would be needed here if used.
     """
-    print(f"⚠️ Function 'extract_rubric_from_pdf' called (currently uses hardcoded example). File: {rubric_file.filename}")
+    logger.warning("extract_rubric_from_pdf uses a hardcoded example rubric (file: %s).", rubric_file.filename)
     # In a real implementation, you would add PDF parsing logic here
     # using libraries like pdfplumber, PyPDF2, etc. to extract data
     # from the uploaded 'rubric_file'.
@@ -220,5 +212,4 @@ def extract_rubric_from_pdf(rubric_file: UploadFile):
         }
         # Add other criteria as needed based on your actual rubric structure
     }
-    print("⚠️ Returning hardcoded example rubric.")
     return rubric
\ No newline at end of file
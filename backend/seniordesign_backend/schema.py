@@ -1,3 +1,4 @@
+import logging
 import strawberry
 from strawberry import Schema
 from strawberry.tools import merge_types
@@ -24,8 +25,9 @@ mutations = (
 Query = merge_types('Query', queries)
 Mutation = merge_types('Mutation', mutations)
 
-print("Merged Query fields:", Query.__dict__.keys())
-print("Merged Mutation fields:", Mutation.__dict__.keys())
+logger = logging.getLogger(__name__)
+logger.debug("Merged Query fields: %s", list(Query.__dict__))
+logger.debug("Merged Mutation fields: %s", list(Mutation.__dict__))
 
 # Create schema
 schema = strawberry.Schema(
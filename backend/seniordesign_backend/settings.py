@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,6 +57,7 @@ CORS_ALLOW_CREDENTIALS = True
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
 MIDDLEWARE = [    
+    "middleware.correlation_id.CorrelationIdMiddleware",
     "middleware.allow_iframe.AllowIframeForMedia",    
     "corsheaders.middleware.CorsMiddleware", 
     'django.middleware.security.SecurityMiddleware',
@@ -147,3 +149,37 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+
+# Logging
+# Records go through the queued, structured handler shared with the FastAPI
+# service (backend-fastapi/structured_logging.py); see LOG_LEVEL / LOG_FORMAT there.
+
+FASTAPI_SERVICE_DIR = str(BASE_DIR / 'backend-fastapi')
+if FASTAPI_SERVICE_DIR not in sys.path:
+    sys.path.append(FASTAPI_SERVICE_DIR)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'queue': {
+            '()': 'structured_logging.queue_handler',
+            'service': 'django',
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': os.getenv('LOG_LEVEL', 'INFO').upper(),
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO').upper(),
+            'propagate': False,
+        },
+        'httpx': { # One INFO line per OpenAI request otherwise
+            'level': 'WARNING',
+        },
+    },
+}
@@ -20,9 +20,11 @@ from strawberry.django.views import GraphQLView
 from django.conf import settings
 from django.conf.urls.static import static  # ✅ required for serving media files
 from .schema import schema
+from groups.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('graphql', GraphQLView.as_view(schema=schema, graphiql=True)),
     path("", include("accounts.urls")),
+    path("metrics", metrics_view),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)  # ✅ serve media in dev
@@ -10,6 +10,8 @@ import { FileUp, UploadCloud } from "lucide-react";
 const TestUploadPage = () => {
   const [assignmentId, setAssignmentId] = useState("10");
   const [file, setFile] = useState<File | null>(null);
+  // One key per chosen file: repeated clicks for the same upload are processed once
+  const [idempotencyKey, setIdempotencyKey] = useState("");
   const [message, setMessage] = useState("");
 
   const handleUpload = async () => {
@@ -19,13 +21,14 @@ const TestUploadPage = () => {
 
     const operations = JSON.stringify({
       query: `
-        mutation SubmitAssignment($assignment_id: Int!, $submission_file: Upload!) {
-          submit_assignment(assignment_id: $assignment_id, submission_file: $submission_file)
+        mutation SubmitAssignment($assignment_id: Int!, $submission_file: Upload!, $idempotency_key: String) {
+          submit_assignment(assignment_id: $assignment_id, submission_file: $submission_file, idempotency_key: $idempotency_key)
         }
       `,
       variables: {
         assignment_id: parseInt(assignmentId, 10),
         submission_file: null,
+        idempotency_key: idempotencyKey || null,
       },
     });
 
@@ -87,7 +90,10 @@ const TestUploadPage = () => {
               id="file"
               type="file"
               accept=".pdf,.doc,.docx"
-              onChange={(e) => setFile(e.target.files?.[0] || null)}
+              onChange={(e) => {
+                setFile(e.target.files?.[0] || null);
+                setIdempotencyKey(crypto.randomUUID());
+              }}
               className="border-blue-200 focus:ring-blue-500"
             />
           </div>
@@ -14,8 +14,8 @@ export const LOGIN_MUTATION = gql`
 
 
 export const SUBMIT_ASSIGNMENT = gql`
-  mutation SubmitAssignment($assignment_id: Int!, $submission_file: Upload!) {
-    submit_assignment(assignment_id: $assignment_id, submission_file: $submission_file)
+  mutation SubmitAssignment($assignment_id: Int!, $submission_file: Upload!, $idempotency_key: String) {
+    submit_assignment(assignment_id: $assignment_id, submission_file: $submission_file, idempotency_key: $idempotency_key)
   }
 `;
 